@@ -1,11 +1,21 @@
 import streamlit as st
 import pandas as pd
 import uuid
-import openai
 import json
-import time
 import base64
-from supabase import create_client
+from licensee_enrichment.batch_runner import DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+from licensee_enrichment.enrichment_cache import get_shared_enrichment_cache
+from licensee_enrichment.clients import create_openai_client, create_supabase_client, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+from licensee_enrichment.category_matcher import LICENSING_CATEGORIES
+from licensee_enrichment.category_embeddings import CATEGORY_MODES
+from licensee_enrichment.enrichment import MAX_PACK_SIZE
+from licensee_enrichment.csv_stream import read_csv_columns, missing_required_columns, count_csv_rows
+from licensee_enrichment.job_runner import get_job_runner
+from licensee_enrichment.licensee import process_licensee
+from licensee_enrichment.supabase_writer import DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE
+from licensee_enrichment.similarity_index import index_written
+from results_view import render_jobs_panel, JOB_SELECT_KEY
+from similarity_view import render_similarity_panel
 
 # Page config
 st.set_page_config(page_title="Licensee Enrichment Portal", layout="wide")
@@ -46,267 +56,14 @@ try:
 except:
     pass
 
-# Function to process a single licensee - can be used for both single and batch processing
-def process_licensee(uid, brand_name, contact_name, email, website, headquarters, 
-                     supabase_url, supabase_key, openai_api_key, category_list):
-    """
-    Process a single licensee entry - handles enrichment, embedding, and Supabase upload
-    Returns a dictionary with the processed data and status
-    """
-    # Initialize result dictionary
-    result = {
-        "success": False,
-        "message": "",
-        "data": {}
-    }
-    
-    try:
-        # Initialize OpenAI
-        openai.api_key = openai_api_key
-        
-        # Prepare website URL
-        if not website.startswith(('http://', 'https://')):
-            website = 'https://' + website
-            
-        # Call OpenAI for enrichment
-        prompt = f"""You are analyzing a brand based on its official website. Prioritize extracting insights from the website before relying on the brand name.
-
-Brand website: {website}
-Brand name: {brand_name}
-
-TASK 1: ANALYZE COMPANY INFORMATION
-First, provide a detailed analysis of the brand based on the website and your knowledge.
-
-TASK 2: DETERMINE HEADQUARTERS LOCATION
-Based on the website domain, your knowledge of the brand, and any context clues, determine the most likely headquarters location for this company. If the headquarters location is not specified in the input, you must make your best educated guess. Consider:
-- Domain TLD (.com, .co.uk, etc.)
-- Company history
-- Known locations of similar brands
-- Industry trends
-
-IMPORTANT: DO NOT return an error message. Instead, use your training knowledge about this website and brand. You have been trained on vast amounts of internet data up until your knowledge cutoff, so use that knowledge to analyze this brand rather than trying to access the live website.
-
-You MUST provide substantive answers for all fields based on your prior knowledge, even if you cannot currently browse the website. If it's a known brand or website, provide detailed information from your training. If it's completely unknown, provide reasonable guesses based on the domain name, brand name, and any other contextual clues.
+# Process-wide API clients - created once per set of credentials and shared by every session and worker
+@st.cache_resource
+def get_openai_client(api_key, pool_size, timeout):
+    return create_openai_client(api_key, pool_size=pool_size, timeout=timeout)
 
-Based on this information, return the following structured data. Format the output exactly as shown, with each key followed by a colon on the same line. Do not skip any fields. Do not add commentary.
-
-business_category: What type of business are they in? (e.g., Fashion, Sportswear, Consumer Goods, Tech)
-age_group: Classify their main buyer by age range (e.g., 18–25, 25–35, etc.)
-audience_description: Describe the brand's audience and its most ravenous buyers in one sentence
-industry_classification: NAICS or SIC-style classification (write the industry name, not the number)
-popular_products_or_services: List the top two most purchased or known-for products/services
-price_positioning: Budget, Mid-Tier, Premium, or Luxury
-brand_affinity_competitors: Who is their biggest competitor or most similar brand?
-retail_distribution_channels: List the top retail or distribution channels (e.g., Amazon, Walmart, DTC)
-countries_distributed: Choose the top 3 countries they sell into from this list ONLY: USA, Canada, China, Mexico, United Kingdom, France, Germany, Taiwan
-primary_licensing_category: From their product types, what is the single strongest licensing category (1 only)?
-secondary_licensing_category: From their product types, what is the next most relevant licensing category (1 only)?
-known_licensing_agreements: Name up to 3 known licensing agreements the brand has been involved in — where the brand either (1) licensed its name to another company to create products, or (2) licensed another brand/IP to put onto their own products. These must be real brand-to-brand licensing agreements and should only include products that were actually sold.
-product_summary_text: Write one paragraph summarizing the types of products they are known for and where they are being sold most effectively. This will be used to match categories."""
-
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0.7,
-            max_tokens=500
-        )
-        
-        # Parse response
-        raw_text = response.choices[0].message.content
-        raw_text = raw_text.replace('\r\n', '\n').strip()
-        output = raw_text.split('\n')
-        
-        # Parse fields
-        raw_map = {}
-        current_key = None
-        summary_started = False
-        summary_lines = []
-        
-        for line in output:
-            if ":" not in line:
-                if summary_started and current_key:
-                    summary_lines.append(line.strip())
-                continue
-                
-            parts = line.split(":", 1)
-            if len(parts) == 2:
-                current_key = parts[0].strip().lower()
-                value = parts[1].strip()
-                
-                if current_key == "product_summary_text":
-                    summary_started = True
-                    summary_lines.append(value)
-                else:
-                    raw_map[current_key] = value
-        
-        if summary_lines:
-            raw_map["product_summary_text"] = " ".join(summary_lines)
-        
-        # Category matching
-        summary_text = raw_map.get("product_summary_text", "").lower()
-        
-        # Calculate scores
-        import re
-        scores = []
-        for cat in category_list:
-            cat_lower = cat.lower()
-            regex = r'(?:^|\W)' + re.escape(cat_lower) + r'(?:$|\W)'
-            count = len(re.findall(regex, summary_text))
-            scores.append({"category": cat, "count": count})
-        
-        # Sort by count
-        scores.sort(key=lambda x: x["count"], reverse=True)
-        
-        # Override categories
-        if scores and scores[0]["count"] > 0:
-            raw_map["primary_licensing_category"] = scores[0]["category"]
-        if len(scores) > 1 and scores[1]["count"] > 0:
-            raw_map["secondary_licensing_category"] = scores[1]["category"]
-        
-        # Generate summaries
-        brand_full = brand_name
-        
-        # Basic summaries
-        summaries = {
-            "audience_summary": f"This company targets {raw_map.get('age_group', 'N/A')} consumers, focusing on {raw_map.get('business_category', 'N/A')} across {raw_map.get('countries_distributed', 'N/A')}. {raw_map.get('audience_description', 'N/A')}",
-            
-            "product_summary": f"They specialize in {raw_map.get('popular_products_or_services', 'N/A')}, with licensing focus areas in {raw_map.get('primary_licensing_category', 'N/A')} and {raw_map.get('secondary_licensing_category', 'N/A')}.",
-            
-            "market_fit_summary": f"Distributed across {raw_map.get('countries_distributed', 'N/A')}, their products are positioned as {raw_map.get('price_positioning', 'N/A')} offerings through {raw_map.get('retail_distribution_channels', 'N/A')} channels.",
-            
-            "competitive_summary": f"Compared to {raw_map.get('brand_affinity_competitors', 'other players') if raw_map.get('brand_affinity_competitors') else 'other players'}, they differentiate by focusing on {raw_map.get('industry_classification', 'N/A')} with notable licensing agreements including {raw_map.get('known_licensing_agreements', 'N/A')}.",
-            
-            "combined_summary": f"{brand_name} is a company specializing in {raw_map.get('popular_products_or_services', 'N/A')} ({raw_map.get('primary_licensing_category', 'N/A')} and {raw_map.get('secondary_licensing_category', 'N/A')}) distributed across {raw_map.get('countries_distributed', 'N/A')}. They target {raw_map.get('age_group', 'N/A')} consumers ({raw_map.get('audience_description', 'N/A')}) through {raw_map.get('retail_distribution_channels', 'N/A')} channels, offering {raw_map.get('price_positioning', 'N/A')} products. Competitively, they stand out versus {raw_map.get('brand_affinity_competitors', 'N/A')} by focusing on {raw_map.get('industry_classification', 'N/A')} with key licensing agreements like {raw_map.get('known_licensing_agreements', 'N/A')}."
-        }
-        
-        # Commentary fields
-        opportunity_commentary = f"Based on {brand_full}'s focus on {raw_map.get('business_category', 'their industry')}, they show potential for licensing opportunities in the {raw_map.get('primary_licensing_category', 'primary')} and {raw_map.get('secondary_licensing_category', 'secondary')} categories. Their target demographic of {raw_map.get('age_group', 'consumers')} aligns with current market trends, and their existing distribution across {raw_map.get('countries_distributed', 'markets')} suggests capacity for expanded licensing partnerships."
-        
-        market_readiness = f"{brand_full} demonstrates market readiness through their established {raw_map.get('price_positioning', '')} positioning and presence in {raw_map.get('retail_distribution_channels', 'retail channels')}. Their experience with {raw_map.get('known_licensing_agreements', 'licensing agreements')} indicates familiarity with licensing processes. Their current position in the {raw_map.get('industry_classification', 'industry')} market provides a foundation for licensing expansion."
-        
-        audience_harmony = f"The harmony between {brand_full}'s products and their target audience of {raw_map.get('age_group', 'consumers')} is evident in their specialization in {raw_map.get('popular_products_or_services', 'products/services')}. Their understanding of {raw_map.get('audience_description', 'their audience')} enables them to create products that resonate with consumer preferences and lifestyle needs in the {raw_map.get('primary_licensing_category', 'licensing')} category."
-        
-        competitive_strength = f"In comparison to {raw_map.get('brand_affinity_competitors', 'competitors')}, {brand_full} differentiates through their focus on {raw_map.get('industry_classification', 'their classification')}. Their strength in {raw_map.get('primary_licensing_category', 'primary category')} positions them uniquely in the market. Their {raw_map.get('price_positioning', 'price point')} strategy gives them competitive advantage with their target {raw_map.get('age_group', 'demographic')} across {raw_map.get('countries_distributed', 'their markets')}."
-        
-        strategic_fit = f"{brand_full} exhibits strategic fit for licensing opportunities through their established brand identity in {raw_map.get('business_category', 'their category')}, market presence across {raw_map.get('countries_distributed', 'markets')}, and experience with {raw_map.get('known_licensing_agreements', 'licensing')}. Their focus on {raw_map.get('primary_licensing_category', 'primary')} and {raw_map.get('secondary_licensing_category', 'secondary')} categories allows for natural brand extensions that would resonate with their {raw_map.get('age_group', 'target audience')}."
-        
-        # Add to summaries
-        summaries["opportunity_alignment_commentary"] = opportunity_commentary
-        summaries["market_readiness_commentary"] = market_readiness
-        summaries["audience_harmony_analysis"] = audience_harmony
-        summaries["competitive_strength_analysis"] = competitive_strength
-        summaries["strategic_fit_commentary"] = strategic_fit
-        
-        # Generate embeddings
-        embeddings = {}
-        
-        # List of fields that need embeddings
-        text_fields = [
-            ("combined_strategic_summary", summaries.get("combined_summary", "")),
-            ("opportunity_alignment_score_commentary", summaries.get("opportunity_alignment_commentary", "")),
-            ("market_readiness_commentary", summaries.get("market_readiness_commentary", "")),
-            ("audience_product_harmony_analysis", summaries.get("audience_harmony_analysis", "")),
-            ("competitive_strength_analysis", summaries.get("competitive_strength_analysis", "")),
-            ("strategic_fit_commentary", summaries.get("strategic_fit_commentary", ""))
-        ]
-        
-        # Generate embeddings for each field
-        for field_name, text in text_fields:
-            embedding_name = f"{field_name}_embedding"
-            
-            # Skip if text is empty
-            if not text.strip():
-                embeddings[embedding_name] = None
-                continue
-            
-            try:
-                embedding_response = openai.embeddings.create(
-                    model="text-embedding-ada-002",
-                    input=text
-                )
-                embeddings[embedding_name] = embedding_response.data[0].embedding
-            except Exception as e:
-                print(f"Error generating {embedding_name}: {e}")
-                embeddings[embedding_name] = None
-        
-        # Prepare data for Supabase
-        licensee_data = {
-            "uid": uid,
-            "brand_name": brand_name,
-            "contact": contact_name,
-            "website": website,
-            "headquarters": headquarters or "Unknown",
-            # Enriched fields
-            "business_category": raw_map.get("business_category", "N/A"),
-            "age_group": raw_map.get("age_group", "N/A"),
-            "audience_description": raw_map.get("audience_description", "N/A"),
-            "industry_classification": raw_map.get("industry_classification", "N/A"),
-            "popular_type_of_product": raw_map.get("popular_products_or_services", "N/A"),
-            "price_positioning": raw_map.get("price_positioning", "N/A"),
-            "brand_competitors": raw_map.get("brand_affinity_competitors", "N/A"),
-            "retail_distribution_channel": raw_map.get("retail_distribution_channels", "N/A"),
-            "countries_distributed": raw_map.get("countries_distributed", "N/A"),
-            "primary_licensing_category": raw_map.get("primary_licensing_category", "N/A"),
-            "secondary_licensing_category": raw_map.get("secondary_licensing_category", "N/A"),
-            "known_licensing_agreements": raw_map.get("known_licensing_agreements", "N/A"),
-            "product": raw_map.get("product_summary_text", "N/A"),
-            # Summaries
-            "audience_summary": summaries.get("audience_summary", "N/A"),
-            "product_summary": summaries.get("product_summary", "N/A"),
-            "market_fit_summary": summaries.get("market_fit_summary", "N/A"),
-            "competitive_differentiation_summary": summaries.get("competitive_summary", "N/A"),
-            "combined_strategic_summary": summaries.get("combined_summary", "N/A"),
-            # Additional commentary fields
-            "opportunity_alignment_score_commentary": summaries.get("opportunity_alignment_commentary", ""),
-            "market_readiness_commentary": summaries.get("market_readiness_commentary", ""),
-            "audience_product_harmony_analysis": summaries.get("audience_harmony_analysis", ""),
-            "competitive_strength_analysis": summaries.get("competitive_strength_analysis", ""),
-            "strategic_fit_commentary": summaries.get("strategic_fit_commentary", ""),
-            # Embeddings
-            "combined_strategic_summary_embedding": embeddings.get("combined_strategic_summary_embedding"),
-            "opportunity_alignment_score_commentary_embedding": embeddings.get("opportunity_alignment_score_commentary_embedding"),
-            "market_readiness_commentary_embedding": embeddings.get("market_readiness_commentary_embedding"),
-            "audience_product_harmony_analysis_embedding": embeddings.get("audience_product_harmony_analysis_embedding"),
-            "competitive_strength_analysis_embedding": embeddings.get("competitive_strength_analysis_embedding"),
-            "strategic_fit_commentary_embedding": embeddings.get("strategic_fit_commentary_embedding")
-        }
-        
-        # Upload to Supabase
-        supabase = create_client(supabase_url, supabase_key)
-        
-        # First check if record already exists
-        existing_records = supabase.table("licensees").select("*").filter("uid", "eq", uid).execute()
-        
-        if existing_records.data and len(existing_records.data) > 0:
-            # Update existing record
-            existing_id = existing_records.data[0]["id"] if "id" in existing_records.data[0] else None
-            if existing_id:
-                result = supabase.table("licensees").update(licensee_data).filter("id", "eq", existing_id).execute()
-                result_message = f"Updated existing record with ID: {existing_id}"
-            else:
-                # If there's no id, fall back to UID
-                result = supabase.table("licensees").update(licensee_data).filter("uid", "eq", uid).execute()
-                result_message = f"Updated existing record with UID: {uid}"
-        else:
-            # Insert new record
-            result = supabase.table("licensees").insert(licensee_data).execute()
-            result_message = f"Added new record with UID: {uid}"
-        
-        # Record success
-        result = {
-            "success": True,
-            "message": result_message,
-            "data": licensee_data,
-            "raw_enrichment": raw_map,
-            "summaries": summaries
-        }
-        
-        return result
-        
-    except Exception as e:
-        result["success"] = False
-        result["message"] = str(e)
-        return result
+@st.cache_resource
+def get_supabase_client(url, key, pool_size, timeout):
+    return create_supabase_client(url, key, pool_size=pool_size, timeout=timeout)
 
 # App title and description
 if not logo_added:
@@ -340,33 +97,27 @@ else:
     supabase_url = st.secrets["SUPABASE_URL"]
     supabase_key = st.secrets["SUPABASE_KEY"]
 
-# Initialize OpenAI
-openai.api_key = openai_api_key
+# Pooled API clients, shared by single entries and batch workers
+http_pool_size = int(st.secrets.get("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+http_timeout = float(st.secrets.get("HTTP_TIMEOUT", DEFAULT_TIMEOUT))
+openai_client = get_openai_client(openai_api_key, http_pool_size, http_timeout)
+supabase_client = get_supabase_client(supabase_url, supabase_key, http_pool_size, http_timeout)
+
+# Category list for matching
+category_list = LICENSING_CATEGORIES
 
-# Category list for matching (from your original script)
-category_list = ["Accessories", "Sunglasses", "Scarves", "Belts", "Baseball Caps", "Beanies", "Tote Bags", "Backpacks", "Clutches", 
-                 "Crossbody Bags", "Bags", "Mini Backpacks", "Wallets", "Lunch Bags / Lunch Kits", "Hair Accessories", "Hats", 
-                 "Keychains", "Jewelry", "Temporary Tattoos", "Body Jewelry", "Buckles & Accessories", "Ties / Bowties", "Gloves", 
-                 "Kids Socks", "Adults Socks", "Optical Glasses", "Kids Underwear", "Adult Underwear", "Kids Watches", "Adult Watches", 
-                 "Watch Accessories", "Kids Luggage", "Adult Luggage", "Travel Accessories", "Pins", "Umbrellas", "Iron-On Patches", 
-                 "Apparel", "Men's T-Shirts", "Men's Shirts", "Men's Jeans", "Men's Jackets", "Men's Suits", "Men's Activewear", 
-                 "Women's Dresses", "Women's Tops", "Women's Skirts", "Women's Leggings", "Women's Blazers", "Women's Maternity Wear", 
-                 "Boys' Apparel", "Girls' Apparel", "School Uniforms", "Kids Activewear", "Women's Activewear", "Boy's Pajamas", 
-                 "Girl's Pajamas", "Women's Pajamas", "Men's Pajamas", "Kids Jackets", "Kids Onesies", "Adult Onesies", 
-                 "Women's Jackets", "Men's Pants", "Kids Sweaters", "Adult Sweaters", "Kids Hoodies", "Adult Hoodies", 
-                 "Boy's Swimwear", "Girl's Swimwear", "Women's Swimwear", "Men's Swimwear", "Kids Bathrobes", "Adult Bathrobes", 
-                 "Kids Raincoats", "Adult Raincoats", "Scrubs", "Domestics", "Bed Sheets", "Duvet Covers", "Pillowcases", 
-                 "Comforters", "Bath Towels", "Hand Towels", "Beach Towels", "Bath Mats", "Outdoor Rugs", "Bedding Sets", 
-                 "Blankets / Throws", "Weighted Blankets", "Throw Pillows", "Body Pillows", "Shower Curtains", "Cushions", 
-                 "Bathroom Accessories", "Indoor Rugs", "Curtains", "Electronics & Accessories", "Phone cases", "Wall Chargers", 
-                 "Wireless Chargers", "Car Chargers", "Portable chargers", "Backpack", "Messenger Bags", "Briefcases", 
-                 "Rolling Laptop Bags", "Tablet Cases & Sleeves", "Laptop Cases & Sleeves", "Laptop Accessories", "Laptop Bags", 
-                 "Kids Tablets", "Smartwatches", "Fitness Trackers", "Wearable Tech", "Speakers", "Gaming Accessories", 
-                 "Gaming Controllers", "USB Memory Sticks", "Headphones", "Electronic Cables", "Footwear", "Men's Sneakers", 
-                 "Men's Dress Shoes", "Men's Boots", "Men's Sandals", "Women's Flats", "Women's Heels", "Women's Sandals", 
-                 "Women's Athletic Shoes", "Kids Sneakers", "Kids School Shoes", "Kids Boots", "Kids Sandals", "Women's Sneakers", 
-                 "Men's Athletic Shoes", "Women's Boots", "Kids Athletic Shoes", "Men's Slippers", "Women's Slippers", 
-                 "Kids Slippers", "Men's Flipflops", "Women's Flipflops", "Kids Flipflops", "Kids Rain Boots", "Adult Rain Boots"]
+# How licensing categories are picked from the product summary
+category_mode_labels = {
+    "keyword": "Keyword counts",
+    "embedding": "Embedding similarity",
+    "hybrid": "Keyword counts, embeddings when no keyword matches"
+}
+category_mode = st.selectbox("Category matching", CATEGORY_MODES, format_func=category_mode_labels.get,
+                             help="Embedding similarity ranks every category against the product summary's embedding")
+
+# Resume a stopped batch job, finishing only the rows it hadn't completed
+def resume_batch_job(job_id):
+    return get_job_runner().resume(job_id, openai_client, supabase_client)
 
 # Create tabs for Single Entry vs Batch Upload
 st.markdown("""
@@ -390,6 +141,8 @@ with tab1:
             website = st.text_input("Company Website URL")
             headquarters = st.text_input("Headquarters Location (Optional)")
         
+        force_refresh = st.checkbox("Force refresh", help="Ignore any cached enrichment and call the model again")
+        
         submit = st.form_submit_button("Process Licensee Data")
 
 with tab2:
@@ -412,6 +165,27 @@ with tab2:
     # File uploader
     uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
     
+    # Number of licensees processed at the same time
+    batch_concurrency = st.number_input("Concurrent requests", min_value=1, max_value=MAX_CONCURRENCY,
+                                        value=DEFAULT_CONCURRENCY, key="batch_concurrency",
+                                        help="How many licensees are enriched in parallel")
+    batch_force_refresh = st.checkbox("Force refresh", key="batch_force_refresh",
+                                      help="Ignore any cached enrichment and call the model again")
+    batch_chunk_size = st.number_input("Database write chunk size", min_value=1, max_value=MAX_CHUNK_SIZE,
+                                       value=DEFAULT_CHUNK_SIZE, key="batch_chunk_size",
+                                       help="How many records are upserted to Supabase per request")
+    batch_incremental = st.checkbox("Incremental mode", key="batch_incremental",
+                                    help="Skip rows whose brand name, website, headquarters and contact "
+                                         "are unchanged since they were last enriched")
+    batch_pack_size = st.number_input("Brands per request", min_value=1, max_value=MAX_PACK_SIZE, value=1,
+                                      key="batch_pack_size",
+                                      help="Enrich several brands in one model request, sharing the instructions "
+                                           "(1 sends each brand on its own)")
+    batch_budget = st.number_input("Budget ceiling (USD)", min_value=0.0, value=0.0, step=1.0,
+                                   key="batch_budget",
+                                   help="Pause the batch before its estimated API cost passes this amount "
+                                        "(0 for no limit)")
+    
     # Process batch button
     batch_submit = st.button("Process Batch")
 
@@ -429,6 +203,27 @@ def456,Brand 2,Contact 2,email2@example.com,example2.com,London UK"""
     csv_text = st.text_area("Enter CSV data", height=200, 
                            help="Paste your CSV data here. Make sure the first row contains headers.")
     
+    # Number of licensees processed at the same time
+    csv_text_concurrency = st.number_input("Concurrent requests", min_value=1, max_value=MAX_CONCURRENCY,
+                                           value=DEFAULT_CONCURRENCY, key="csv_text_concurrency",
+                                           help="How many licensees are enriched in parallel")
+    csv_text_force_refresh = st.checkbox("Force refresh", key="csv_text_force_refresh",
+                                         help="Ignore any cached enrichment and call the model again")
+    csv_text_chunk_size = st.number_input("Database write chunk size", min_value=1, max_value=MAX_CHUNK_SIZE,
+                                          value=DEFAULT_CHUNK_SIZE, key="csv_text_chunk_size",
+                                          help="How many records are upserted to Supabase per request")
+    csv_text_incremental = st.checkbox("Incremental mode", key="csv_text_incremental",
+                                       help="Skip rows whose brand name, website, headquarters and contact "
+                                            "are unchanged since they were last enriched")
+    csv_text_pack_size = st.number_input("Brands per request", min_value=1, max_value=MAX_PACK_SIZE, value=1,
+                                         key="csv_text_pack_size",
+                                         help="Enrich several brands in one model request, sharing the instructions "
+                                              "(1 sends each brand on its own)")
+    csv_text_budget = st.number_input("Budget ceiling (USD)", min_value=0.0, value=0.0, step=1.0,
+                                      key="csv_text_budget",
+                                      help="Pause the batch before its estimated API cost passes this amount "
+                                           "(0 for no limit)")
+    
     # Process CSV text button
     csv_text_submit = st.button("Process CSV Text")
     
@@ -451,103 +246,23 @@ def456,Brand 2,Contact 2,email2@example.com,example2.com,London UK"""
                 st.error(f"Error: Missing required columns: {', '.join(missing_columns)}")
                 st.stop()
             
-            # Setup progress tracking
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+            total_rows = len(df)
             
-            # Create container for batch results
-            batch_results = st.container()
-            
-            # Count for successful and failed entries
-            success_count = 0
-            failed_count = 0
-            
-            # Will store minimal results for display
-            results_list = []
-            
-            with batch_results:
-                st.write("### Batch Processing Results")
-                results_table = st.empty()
-                
-                # Process each row
-                for index, row in df.iterrows():
-                    # Update progress
-                    progress = (index + 1) / len(df)
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing row {index + 1} of {len(df)}: {row.get('brand_name', 'Unknown')}")
-                    
-                    # Extract row data
-                    row_uid = row.get("uid", "")
-                    row_brand_name = row.get("brand_name", "")
-                    row_contact = row.get("contact", "")
-                    row_email = row.get("email", "")
-                    row_website = row.get("website", "")
-                    row_headquarters = row.get("headquarters", "")
-                    
-                    # Skip if missing required fields
-                    if not row_uid or not row_website:
-                        results_list.append({
-                            "uid": row_uid,
-                            "brand_name": row_brand_name,
-                            "status": "Failed - Missing required fields",
-                            "enriched": False
-                        })
-                        failed_count += 1
-                        continue
-                    
-                    try:
-                        # Process this row
-                        result = process_licensee(
-                            uid=row_uid,
-                            brand_name=row_brand_name,
-                            contact_name=row_contact,
-                            email=row_email,
-                            website=row_website,
-                            headquarters=row_headquarters,
-                            supabase_url=supabase_url,
-                            supabase_key=supabase_key,
-                            openai_api_key=openai_api_key,
-                            category_list=category_list
-                        )
-                        
-                        # Add to results
-                        results_list.append({
-                            "uid": row_uid,
-                            "brand_name": row_brand_name,
-                            "status": "Success" if result["success"] else f"Failed - {result['message']}",
-                            "enriched": result["success"]
-                        })
-                        
-                        if result["success"]:
-                            success_count += 1
-                        else:
-                            failed_count += 1
-                            
-                    except Exception as e:
-                        results_list.append({
-                            "uid": row_uid,
-                            "brand_name": row_brand_name,
-                            "status": f"Failed - {str(e)}",
-                            "enriched": False
-                        })
-                        failed_count += 1
-                    
-                    # Display current results
-                    results_df = pd.DataFrame(results_list)
-                    results_table.dataframe(results_df)
-                    
-                    # Add a small delay to avoid rate limits
-                    time.sleep(0.5)
-            
-            # Final progress update
-            progress_bar.progress(1.0)
-            status_text.text(f"Processing complete: {success_count} succeeded, {failed_count} failed")
-            
-            # Final success message
-            if success_count > 0:
-                st.success(f"Successfully processed {success_count} licensees!")
-            if failed_count > 0:
-                st.warning(f"Failed to process {failed_count} licensees. See results table for details.")
+            # The batch runs in a background job, so it survives reruns and closed tabs
+            options = {
+                "concurrency": csv_text_concurrency,
+                "chunk_size": csv_text_chunk_size,
+                "incremental": csv_text_incremental,
+                "force_refresh": csv_text_force_refresh,
+                "category_mode": category_mode,
+                "budget": csv_text_budget or None,
+                "pack_size": csv_text_pack_size
+            }
+            job_id = get_job_runner().submit(csv_text.encode("utf-8"), total_rows, openai_client, supabase_client,
+                                             source="Pasted CSV", options=options)
+            st.session_state[JOB_SELECT_KEY] = job_id
+            st.success(f"Submitted batch job {job_id} for {total_rows} rows - "
+                       "follow its progress under Batch Jobs below")
         
         except Exception as e:
             st.error(f"Error processing CSV text: {str(e)}")
@@ -582,15 +297,24 @@ if submit:
             email=email,
             website=website,
             headquarters=headquarters,
-            supabase_url=supabase_url,
-            supabase_key=supabase_key,
-            openai_api_key=openai_api_key,
-            category_list=category_list
+            openai_client=openai_client,
+            supabase_client=supabase_client,
+            category_list=category_list,
+            force_refresh=force_refresh,
+            category_mode=category_mode
         )
         
         # Update process log
         if process_result["success"]:
+            # Make the new licensee searchable straight away
+            index_written([process_result["data"]])
             log_content += f"✅ {process_result['message']}\n"
+            if process_result.get("enrichment_cached"):
+                log_content += "♻️ Reused cached enrichment (tick 'Force refresh' to call the model again)\n"
+            usage = process_result["usage"]
+            log_content += (f"🪙 Tokens: {usage['prompt_tokens']} prompt ({usage['cached_tokens']} cached), "
+                            f"{usage['completion_tokens']} completion, {usage['embedding_tokens']} embedding - "
+                            f"estimated cost ${usage['cost']:.4f}\n")
             log_content += "\n--- RECORD DETAILS ---\n"
             log_content += f"UID: {uid}\n"
             log_content += f"Brand Name: {brand_name}\n"
@@ -651,119 +375,60 @@ if uploaded_file is not None and batch_submit:
     batch_process_placeholder.info("Starting batch processing...")
     
     try:
-        # Load CSV
-        df = pd.read_csv(uploaded_file)
-        batch_process_placeholder.info(f"Loaded CSV with {len(df)} rows")
+        # Read the header only - rows are streamed from the file in chunks
+        columns = read_csv_columns(uploaded_file)
         
         # Validate required columns
-        required_columns = ["uid", "brand_name", "website"]
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        missing_columns = missing_required_columns(columns)
         
         if missing_columns:
             st.error(f"Error: Missing required columns: {', '.join(missing_columns)}")
             st.stop()
         
-        # Setup progress tracking
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        # Create container for batch results
-        batch_results = st.container()
-        
-        # Count for successful and failed entries
-        success_count = 0
-        failed_count = 0
-        
-        # Will store minimal results for display
-        results_list = []
-        
-        with batch_results:
-            st.write("### Batch Processing Results")
-            results_table = st.empty()
-            
-            # Process each row
-            for index, row in df.iterrows():
-                # Update progress
-                progress = (index + 1) / len(df)
-                progress_bar.progress(progress)
-                status_text.text(f"Processing row {index + 1} of {len(df)}: {row.get('brand_name', 'Unknown')}")
-                
-                # Extract row data
-                row_uid = row.get("uid", "")
-                row_brand_name = row.get("brand_name", "")
-                row_contact = row.get("contact", "")
-                row_email = row.get("email", "")
-                row_website = row.get("website", "")
-                row_headquarters = row.get("headquarters", "")
-                
-                # Skip if missing required fields
-                if not row_uid or not row_website:
-                    results_list.append({
-                        "uid": row_uid,
-                        "brand_name": row_brand_name,
-                        "status": "Failed - Missing required fields",
-                        "enriched": False
-                    })
-                    failed_count += 1
-                    continue
-                
-                try:
-                    # Process this row
-                    result = process_licensee(
-                        uid=row_uid,
-                        brand_name=row_brand_name,
-                        contact_name=row_contact,
-                        email=row_email,
-                        website=row_website,
-                        headquarters=row_headquarters,
-                        supabase_url=supabase_url,
-                        supabase_key=supabase_key,
-                        openai_api_key=openai_api_key,
-                        category_list=category_list
-                    )
-                    
-                    # Add to results
-                    results_list.append({
-                        "uid": row_uid,
-                        "brand_name": row_brand_name,
-                        "status": "Success" if result["success"] else f"Failed - {result['message']}",
-                        "enriched": result["success"]
-                    })
-                    
-                    if result["success"]:
-                        success_count += 1
-                    else:
-                        failed_count += 1
-                        
-                except Exception as e:
-                    results_list.append({
-                        "uid": row_uid,
-                        "brand_name": row_brand_name,
-                        "status": f"Failed - {str(e)}",
-                        "enriched": False
-                    })
-                    failed_count += 1
-                
-                # Display current results
-                results_df = pd.DataFrame(results_list)
-                results_table.dataframe(results_df)
-                
-                # Add a small delay to avoid rate limits
-                time.sleep(0.5)
-        
-        # Final progress update
-        progress_bar.progress(1.0)
-        status_text.text(f"Processing complete: {success_count} succeeded, {failed_count} failed")
-        
-        # Final success message
-        if success_count > 0:
-            st.success(f"Successfully processed {success_count} licensees!")
-        if failed_count > 0:
-            st.warning(f"Failed to process {failed_count} licensees. See results table for details.")
+        total_rows = count_csv_rows(uploaded_file)
+        batch_process_placeholder.info(f"Streaming CSV with {total_rows} rows")
+        
+        # The batch runs in a background job, so it survives reruns and closed tabs
+        options = {
+            "concurrency": batch_concurrency,
+            "chunk_size": batch_chunk_size,
+            "incremental": batch_incremental,
+            "force_refresh": batch_force_refresh,
+            "category_mode": category_mode,
+            "budget": batch_budget or None,
+            "pack_size": batch_pack_size
+        }
+        job_id = get_job_runner().submit(uploaded_file.getvalue(), total_rows, openai_client, supabase_client,
+                                         source=uploaded_file.name, options=options)
+        st.session_state[JOB_SELECT_KEY] = job_id
+        batch_process_placeholder.success(f"Submitted batch job {job_id} for {total_rows} rows - "
+                                          "follow its progress under Batch Jobs below")
     
     except Exception as e:
         st.error(f"Error processing batch: {str(e)}")
 
+# Progress and results of background batch jobs
+render_jobs_panel(get_job_runner(), resume_job=resume_batch_job)
+
+# Search the stored embeddings for licensees like a given one
+render_similarity_panel(openai_client, supabase_client)
+
+# Manage cached enrichment results
+with st.expander("Enrichment cache"):
+    enrichment_cache = get_shared_enrichment_cache()
+    cache_info = enrichment_cache.stats()
+    st.write(f"{cache_info['entries']} cached enrichments "
+             f"({cache_info['hits']} hits, {cache_info['misses']} misses this session)")
+    
+    invalidate_website = st.text_input("Website to invalidate", help="Removes cached results for this domain")
+    if st.button("Invalidate website") and invalidate_website:
+        removed = enrichment_cache.invalidate(invalidate_website)
+        st.success(f"Removed {removed} cached result(s) for {invalidate_website}")
+    
+    if st.button("Clear enrichment cache"):
+        removed = enrichment_cache.clear()
+        st.success(f"Removed {removed} cached result(s)")
+
 # Show instructions at the bottom
 st.markdown("<hr style='margin-top: 50px; margin-bottom: 30px;'>", unsafe_allow_html=True)
 
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark: precompiled CategoryMatcher vs. the original per-category regex loop.
+
+Run from the repository root:
+    python benchmarks/bench_category_matcher.py --summaries 2000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from licensee_enrichment.category_matcher import LICENSING_CATEGORIES, CategoryMatcher  # noqa: E402
+
+FILLER = ("the brand is known for its premium line of products sold through department stores "
+          "and online marketplaces across north america and europe with strong growth").split()
+
+
+def legacy_scores(summary_text, category_list):
+    """
+    The original scoring loop from process_licensee
+    """
+    summary_text = summary_text.lower()
+    scores = []
+    for cat in category_list:
+        cat_lower = cat.lower()
+        regex = r'(?:^|\W)' + re.escape(cat_lower) + r'(?:$|\W)'
+        count = len(re.findall(regex, summary_text))
+        scores.append({"category": cat, "count": count})
+    scores.sort(key=lambda x: x["count"], reverse=True)
+    return scores
+
+
+def make_summaries(count, seed):
+    """
+    Paragraph-sized summaries that mention a few categories each
+    """
+    rng = random.Random(seed)
+    summaries = []
+    for _ in range(count):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(60, 120))]
+        for _ in range(rng.randint(0, 6)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(LICENSING_CATEGORIES) + rng.choice([",", "", "."]))
+        summaries.append(" ".join(words))
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--summaries", type=int, default=1000, help="number of summaries to score")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repeats (best is reported)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    summaries = make_summaries(args.summaries, args.seed)
+    matcher = CategoryMatcher(LICENSING_CATEGORIES)
+
+    # Same counts and ranking as the original loop
+    for summary, counts in zip(summaries, matcher.count_many(summaries)):
+        if matcher.rank(counts) != legacy_scores(summary, LICENSING_CATEGORIES):
+            raise SystemExit(f"Ranking mismatch for summary: {summary!r}")
+
+    timings = {
+        "legacy loop": lambda: [legacy_scores(s, LICENSING_CATEGORIES) for s in summaries],
+        "matcher (per summary)": lambda: [matcher.rank(matcher.count(s)) for s in summaries],
+        "matcher (whole batch)": lambda: [matcher.rank(c) for c in matcher.count_many(summaries)],
+    }
+
+    print(f"{len(summaries)} summaries, {len(LICENSING_CATEGORIES)} categories - rankings identical")
+    baseline = None
+    for name, fn in timings.items():
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        per_summary_us = best / len(summaries) * 1e6
+        baseline = baseline or best
+        print(f"{name:<24} {best * 1000:9.1f} ms total {per_summary_us:9.1f} us/summary {baseline / best:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
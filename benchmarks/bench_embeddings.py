@@ -0,0 +1,174 @@
+"""
+Recall and size of the embedding profiles against the current ada-002 vectors.
+
+Embeds a set of summary texts with text-embedding-ada-002 (the reference,
+as stored today) and with the model and dimensions of each profile, passes
+every vector through its profile's storage format and back, and reports per
+profile the stored bytes per vector, the JSON payload of a record's six
+embedding columns, and recall@k: the share of each query text's k nearest
+neighbors under the reference float32 vectors that are also among its k
+nearest under the profile's stored vectors.
+
+Texts are the summary columns of a CSV export of the licensees table
+(--input), or summaries templated from synthetic enrichment answers. Uses
+the OpenAI API (OPENAI_API_KEY) unless --mock is given, which embeds with the
+local stand-in; its vectors are hashes of the text, so there only the
+quantization loss of same-model profiles means anything.
+
+Run from the repository root:
+    python benchmarks/bench_embeddings.py --input licensees.csv --k 10
+    python benchmarks/bench_embeddings.py --mock --records 1000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from licensee_enrichment.clients import create_openai_client  # noqa: E402
+from licensee_enrichment.embedding_profiles import EMBEDDING_PROFILES, get_embedding_profile  # noqa: E402
+from licensee_enrichment.embeddings import embed_texts  # noqa: E402
+from licensee_enrichment.licensee import EMBEDDING_COLUMNS, build_summaries, embedding_text_fields  # noqa: E402
+
+REFERENCE_PROFILE = "ada-002"
+
+# Values the synthetic enrichment answers are drawn from
+SYNTHETIC_VALUES = {
+    "business_category": ["Fashion", "Sportswear", "Consumer Goods", "Tech", "Toys", "Home Goods", "Beauty", "Food"],
+    "age_group": ["18-25", "25-35", "35-50", "Kids 6-12", "Teens", "50+"],
+    "audience_description": ["Young urban shoppers", "Outdoor enthusiasts", "Busy parents", "Gamers and streamers",
+                             "Fitness-focused professionals", "Collectors of pop culture merchandise"],
+    "industry_classification": ["Apparel Manufacturing", "Sporting Goods", "Toy Manufacturing", "Cosmetics",
+                                "Consumer Electronics", "Home Furnishings"],
+    "popular_products_or_services": ["Sneakers, hoodies", "Action figures, board games", "Skincare, fragrance",
+                                     "Headphones, chargers", "Bedding, kitchenware", "Snacks, beverages"],
+    "price_positioning": ["Budget", "Mid-Tier", "Premium", "Luxury"],
+    "brand_affinity_competitors": ["Nike", "Hasbro", "L'Oreal", "Sony", "IKEA", "PepsiCo", "Patagonia"],
+    "retail_distribution_channels": ["Amazon, DTC", "Walmart, Target", "Department stores", "Specialty retail"],
+    "countries_distributed": ["USA, Canada, Mexico", "USA, United Kingdom, France", "China, Taiwan, USA",
+                              "Germany, France, United Kingdom"],
+    "primary_licensing_category": ["Apparel", "Toys", "Accessories", "Home Decor", "Health & Beauty", "Food"],
+    "secondary_licensing_category": ["Footwear", "Games", "Stationery", "Electronics", "Housewares", "Publishing"],
+    "known_licensing_agreements": ["None", "Disney", "Marvel", "NFL", "Pokemon", "Star Wars", "NBA"]
+}
+
+
+def synthetic_texts(records, seed):
+    """
+    The embedded summary texts of records licensees with random enrichment answers
+    """
+    rng = random.Random(seed)
+    texts = []
+    for index in range(records):
+        raw_map = {name: rng.choice(values) for name, values in SYNTHETIC_VALUES.items()}
+        summaries = build_summaries(f"Brand {index}", raw_map)
+        texts.extend(text for _, text in embedding_text_fields(summaries))
+    return texts
+
+
+def csv_texts(path):
+    """
+    The non-empty summary texts of a licensees table export
+    """
+    names = [field_name for field_name, _ in embedding_text_fields({})]
+    with open(path, newline="", encoding="utf-8") as source:
+        return [row[name] for row in csv.DictReader(source) for name in names if (row.get(name) or "").strip()]
+
+
+def normalized(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def nearest(matrix, queries, k):
+    """
+    Indexes of the k nearest rows of matrix by cosine similarity to each query row, excluding the row itself
+    """
+    scores = matrix[queries] @ matrix.T
+    scores[np.arange(len(queries)), queries] = -np.inf
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+def record_payload(profile, vectors):
+    """
+    JSON bytes of a record's six embedding columns as sent to Supabase, using the first six vectors
+    """
+    return len(json.dumps(profile.encode_embeddings(dict(zip(EMBEDDING_COLUMNS, vectors)))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", help="CSV export of the licensees table (default: synthetic summaries)")
+    parser.add_argument("--records", type=int, default=500, help="synthetic licensees, six texts each")
+    parser.add_argument("--profiles", nargs="+", choices=list(EMBEDDING_PROFILES), default=list(EMBEDDING_PROFILES))
+    parser.add_argument("--k", type=int, default=10, help="neighbors compared per query")
+    parser.add_argument("--queries", type=int, default=200, help="query texts sampled from the set")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--mock", action="store_true", help="embed with benchmarks/mock_services.py instead of OpenAI")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.mock:
+        from mock_services import start_server
+        server, root_url = start_server(0)
+        client = create_openai_client("sk-bench").with_options(base_url=f"{root_url}/v1")
+    else:
+        if not os.environ.get("OPENAI_API_KEY"):
+            sys.exit("Set OPENAI_API_KEY, or pass --mock")
+        client = create_openai_client(os.environ["OPENAI_API_KEY"])
+
+    texts = list(dict.fromkeys(csv_texts(args.input) if args.input else synthetic_texts(args.records, args.seed)))
+    if len(texts) <= args.k:
+        sys.exit(f"Need more than {args.k} distinct texts, found {len(texts)}")
+    queries = np.array(random.Random(args.seed).sample(range(len(texts)), min(args.queries, len(texts))))
+    print(f"Embedding {len(texts)} texts...", file=sys.stderr)
+
+    # One round of embeddings per model and dimensions; the storage formats share them
+    reference = get_embedding_profile(REFERENCE_PROFILE)
+    profiles = [get_embedding_profile(name) for name in args.profiles]
+    vectors = {}
+    for profile in [reference] + profiles:
+        key = (profile.model, profile.dimensions)
+        if key not in vectors:
+            vectors[key] = embed_texts(texts, model=profile.model, dimensions=profile.dimensions, client=client)
+    reference_vectors = vectors[(reference.model, reference.dimensions)]
+    truth = nearest(normalized(np.asarray(reference_vectors, dtype=np.float32)), queries, args.k)
+    reference_payload = record_payload(reference, reference_vectors)
+
+    results = []
+    for profile in profiles:
+        raw = vectors[(profile.model, profile.dimensions)]
+        stored = [profile.encode("v", vector) for vector in raw]
+        decoded = normalized(np.stack([profile.decode(values["v"], values.get("v_scale")) for values in stored]))
+        found = nearest(decoded, queries, args.k)
+        recall = float(np.mean([len(expected & got) / args.k for expected, got in zip(truth, found)]))
+        results.append({"profile": profile.name, "model": profile.model, "dimensions": profile.size,
+                        "storage": profile.storage, "bytes_per_vector": profile.bytes_per_vector,
+                        "payload_bytes_per_record": record_payload(profile, raw),
+                        f"recall_at_{args.k}": round(recall, 4)})
+
+    print(f"{'profile':<22} {'dims':>5} {'storage':>8} {'bytes/vec':>10} {'payload KB':>11} {'vs ada':>7} "
+          f"{f'recall@{args.k}':>10}")
+    for result in results:
+        print(f"{result['profile']:<22} {result['dimensions']:>5} {result['storage']:>8} "
+              f"{result['bytes_per_vector']:>10} {result['payload_bytes_per_record'] / 1024:>11.1f} "
+              f"{result['payload_bytes_per_record'] / reference_payload:>7.1%} "
+              f"{result[f'recall_at_{args.k}']:>10.3f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as output:
+            json.dump({"texts": len(texts), "queries": len(queries), "k": args.k, "results": results}, output,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
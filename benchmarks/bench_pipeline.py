@@ -0,0 +1,218 @@
+"""
+End-to-end throughput benchmark of batch enrichment against the local stand-in services.
+
+Starts benchmarks/mock_services.py in its own process, then enriches a
+synthetic CSV of each size through the real code path (the staged
+LicenseePipeline, or BatchEnrichment with --mode openai-batch). Each size runs
+in a fresh process and working directory, so caches start empty and peak
+memory is measured per run. Reports rows/sec, p50/p95/p99 per-row latency
+(from the row being read to its outcome), peak RSS and the estimated API cost.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --rows 100 1000 10000 --chat-latency lognormal:0.3:0.4
+    python benchmarks/bench_pipeline.py --rows 1000 --pack-size 8   # several brands per chat request
+    python benchmarks/bench_pipeline.py --save baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json   # exits 1 on a throughput regression
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_services import add_config_arguments  # noqa: E402
+
+DEFAULT_ROWS = [100, 1000, 10000]
+
+# Allowed drop in rows/sec against a baseline before the run counts as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def write_input(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as output:
+        writer = csv.writer(output)
+        writer.writerow(["uid", "brand_name", "contact", "email", "website", "headquarters"])
+        for index in range(rows):
+            writer.writerow([f"bench-{index}", f"Bench Brand {index}", "Pat Example", f"pat{index}@example.com",
+                             f"brand{index}.example.com", "New York, USA"])
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_worker(args):
+    """
+    Enrich one input file against the stand-in and print the measurements as JSON
+    """
+    from licensee_enrichment.batch_runner import outcome_kind
+    from licensee_enrichment.clients import create_openai_client, create_supabase_client
+    from licensee_enrichment.csv_stream import iter_csv_rows
+    from licensee_enrichment.openai_batch import BatchEnrichment
+    from licensee_enrichment.pipeline import LicenseePipeline
+
+    openai_client = create_openai_client("sk-bench", pool_size=args.pool_size).with_options(
+        base_url=f"{args.root_url}/v1")
+    supabase_client = create_supabase_client(args.root_url, "bench-" + "k" * 40, pool_size=args.pool_size)
+    if args.mode == "pipeline":
+        runner = LicenseePipeline(openai_client, supabase_client, concurrency=args.concurrency,
+                                  chunk_size=args.chunk_size, embed_batch_size=args.embed_batch_size,
+                                  embed_workers=args.embed_workers, pack_size=args.pack_size)
+    else:
+        runner = BatchEnrichment(openai_client, supabase_client, chunk_size=args.chunk_size, poll_interval=0.2)
+
+    read_at = {}
+
+    def timed_rows(source):
+        for row in iter_csv_rows(source):
+            read_at[row["uid"]] = time.perf_counter()
+            yield row
+
+    latencies = []
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+    started = time.perf_counter()
+    with open(args.worker, "rb") as source:
+        for outcome in runner.run(timed_rows(source)):
+            latencies.append(time.perf_counter() - read_at.pop(outcome["uid"]))
+            counts[outcome_kind(outcome)] += 1
+            for name in usage:
+                usage[name] += outcome[name]
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "rows": len(latencies),
+        **counts,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_p50": round(percentile(latencies, 0.50), 4),
+        "latency_p95": round(percentile(latencies, 0.95), 4),
+        "latency_p99": round(percentile(latencies, 0.99), 4),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **usage,
+        "cost": round(usage["cost"], 4),
+        "stages": runner.metrics()
+    }))
+
+
+def start_mock(args):
+    command = [sys.executable, os.path.join(BENCH_DIR, "mock_services.py"), "--port", "0",
+               "--chat-latency", args.chat_latency, "--embed-latency", args.embed_latency,
+               "--db-latency", args.db_latency, "--rate-limit-rate", str(args.rate_limit_rate),
+               "--error-rate", str(args.error_rate), "--db-error-rate", str(args.db_error_rate),
+               "--batch-delay", str(args.batch_delay), "--batch-drop-rate", str(args.batch_drop_rate)]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def run_size(args, root_url, rows):
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as work_dir:
+        input_path = os.path.join(work_dir, "input.csv")
+        write_input(input_path, rows)
+        command = [sys.executable, os.path.abspath(__file__), "--worker", input_path, "--root-url", root_url,
+                   "--mode", args.mode, "--concurrency", str(args.concurrency),
+                   "--chunk-size", str(args.chunk_size), "--embed-batch-size", str(args.embed_batch_size),
+                   "--embed-workers", str(args.embed_workers), "--pack-size", str(args.pack_size),
+                   "--pool-size", str(args.pool_size)]
+        # Run in the scratch directory so the enrichment and embedding caches start empty
+        finished = subprocess.run(command, cwd=work_dir, capture_output=True, text=True,
+                                  env={**os.environ, "PYTHONPATH": REPO_ROOT})
+        if finished.returncode != 0:
+            raise RuntimeError(f"benchmark of {rows} rows failed:\n{finished.stderr}")
+        return json.loads(finished.stdout.strip().splitlines()[-1])
+
+
+def print_table(results):
+    print(f"{'rows':>7} {'rows/s':>9} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'peak MB':>8} {'failed':>7} "
+          f"{'cost $':>9}")
+    for result in results:
+        print(f"{result['rows']:>7} {result['rows_per_second']:>9.1f} {result['latency_p50']:>8.3f} "
+              f"{result['latency_p95']:>8.3f} {result['latency_p99']:>8.3f} {result['peak_rss_mb']:>8.1f} "
+              f"{result['failed']:>7} {result['cost']:>9.4f}")
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Sizes whose rows/sec fell more than tolerance below the baseline run
+    """
+    previous = {result["rows"]: result for result in baseline["results"]}
+    found = []
+    for result in results:
+        before = previous.get(result["rows"])
+        if before and result["rows_per_second"] < before["rows_per_second"] * (1 - tolerance):
+            found.append(f"{result['rows']} rows: {result['rows_per_second']:.1f} rows/s "
+                         f"vs {before['rows_per_second']:.1f} in the baseline")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="input sizes to benchmark")
+    parser.add_argument("--mode", choices=("pipeline", "openai-batch"), default="pipeline",
+                        help="staged pipeline (run) or Batch API mode (batch)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--embed-batch-size", type=int, default=32)
+    parser.add_argument("--embed-workers", type=int, default=2)
+    parser.add_argument("--pack-size", type=int, default=1, help="brands per chat request in pipeline mode")
+    parser.add_argument("--pool-size", type=int, default=64)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare rows/sec with a file written by --save")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed rows/sec drop against the baseline (default {DEFAULT_TOLERANCE:.0%})")
+    add_config_arguments(parser)
+    # Internal: run one size in this process
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--root-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(args)
+
+    server, root_url = start_mock(args)
+    try:
+        results = []
+        for rows in args.rows:
+            print(f"Enriching {rows} rows...", file=sys.stderr)
+            results.append(run_size(args, root_url, rows))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_table(results)
+    settings = {name: getattr(args, name) for name in ("mode", "concurrency", "chunk_size", "embed_batch_size",
+                                                        "embed_workers", "pack_size", "chat_latency", "embed_latency",
+                                                        "db_latency", "rate_limit_rate", "error_rate")}
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as output:
+            json.dump({"settings": settings, "results": results}, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            found = regressions(results, json.load(baseline_file), args.tolerance)
+        for message in found:
+            print(f"Regression: {message}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
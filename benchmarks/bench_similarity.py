@@ -0,0 +1,102 @@
+"""
+Query latency of the similarity index, exact and (with hnswlib installed) HNSW.
+
+Fills a throwaway SimilarityIndex with clustered random vectors of a
+profile's size, in the combined summary column only, and reports for each
+table size the time to add the rows and to reopen the index, then the
+median and 95th percentile query time for the k nearest neighbors. With
+hnswlib installed it also builds the HNSW graph and reports its query times
+and recall@k against the exact results.
+
+Run from the repository root:
+    python benchmarks/bench_similarity.py --rows 10000 100000 --profile 3-small-512
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from licensee_enrichment.embedding_profiles import EMBEDDING_PROFILES, get_embedding_profile  # noqa: E402
+from licensee_enrichment.similarity_index import DEFAULT_COLUMN, SimilarityIndex, hnswlib  # noqa: E402
+
+# Rows added per call, as a write chunk of the pipeline would be
+ADD_CHUNK = 1000
+
+
+def clustered_vectors(rows, size, rng, clusters=200):
+    """
+    Vectors scattered around random centers, so neighbors are meaningful
+    """
+    centers = rng.standard_normal((clusters, size)).astype(np.float32)
+    return centers[rng.integers(clusters, size=rows)] + 0.5 * rng.standard_normal((rows, size)).astype(np.float32)
+
+
+def timed_queries(index, queries, k):
+    """
+    Per-query milliseconds and the results
+    """
+    times = []
+    results = []
+    for vector in queries:
+        started = time.perf_counter()
+        results.append(index.query(vector, k, DEFAULT_COLUMN))
+        times.append((time.perf_counter() - started) * 1000)
+    return np.array(times), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--profile", choices=list(EMBEDDING_PROFILES), default="ada-002")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    profile = get_embedding_profile(args.profile)
+    rng = np.random.default_rng(args.seed)
+    print(f"{profile.name}: {profile.size} dims, k={args.k}, {args.queries} queries"
+          + ("" if hnswlib else " (hnswlib not installed - exact search only)"))
+    print(f"{'rows':>8} {'add s':>7} {'open s':>7} {'MB':>7} {'exact p50':>10} {'p95 ms':>7} "
+          f"{'hnsw build s':>13} {'p50':>7} {'p95 ms':>7} {'recall':>7}")
+
+    for rows in args.rows:
+        vectors = clustered_vectors(rows, profile.size, rng)
+        queries = clustered_vectors(args.queries, profile.size, rng)
+        with tempfile.TemporaryDirectory() as directory:
+            index = SimilarityIndex(profile, directory=directory, kind="exact")
+            started = time.perf_counter()
+            for start in range(0, rows, ADD_CHUNK):
+                index.add([(f"uid-{row}", {DEFAULT_COLUMN: vectors[row]}, None)
+                           for row in range(start, min(start + ADD_CHUNK, rows))])
+            add_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            index = SimilarityIndex(profile, directory=directory, kind="exact")
+            open_seconds = time.perf_counter() - started
+            megabytes = rows * 4 * profile.size / 2 ** 20
+
+            exact_times, exact_results = timed_queries(index, queries, args.k)
+            line = (f"{rows:>8} {add_seconds:>7.2f} {open_seconds:>7.2f} {megabytes:>7.0f} "
+                    f"{np.median(exact_times):>10.2f} {np.percentile(exact_times, 95):>7.2f}")
+
+            if hnswlib:
+                index.kind = "hnsw"
+                started = time.perf_counter()
+                index.query(queries[0], args.k, DEFAULT_COLUMN)
+                build_seconds = time.perf_counter() - started
+                graph_times, graph_results = timed_queries(index, queries, args.k)
+                recall = np.mean([len({uid for uid, _ in exact} & {uid for uid, _ in found}) / args.k
+                                  for exact, found in zip(exact_results, graph_results)])
+                line += (f" {build_seconds:>13.2f} {np.median(graph_times):>7.3f} "
+                         f"{np.percentile(graph_times, 95):>7.3f} {recall:>7.3f}")
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+"""
+Local stand-in for the OpenAI and Supabase endpoints the enrichment uses, so
+the batch code paths can be run and benchmarked without spending money.
+
+Served endpoints:
+
+    POST /v1/chat/completions            answers every field of the request's response_format schema (for
+                                         every brand of a packed request), reporting a repeated prompt prefix
+                                         as cached tokens like OpenAI's prompt cache
+    POST /v1/embeddings                  deterministic vectors derived from each input (float or base64)
+    POST /v1/files, GET /v1/files/{id}/content, POST /v1/batches, GET /v1/batches/{id}
+                                         the Batch API; batches complete after --batch-delay seconds, leaving
+                                         out a --batch-drop-rate share of their requests
+    GET/POST /rest/v1/licensees          PostgREST select by uid and upsert (only uid and input_hash are kept)
+    GET /mock/stats                      request, 429 and error counts so far
+
+Latency is drawn per request from a distribution spec ("0.2", "uniform:0.1:0.5"
+or "lognormal:0.3:0.5" for a median and sigma), and a share of OpenAI
+requests can be answered with 429s or 500s (and Supabase requests with 500s).
+Responses carry x-ratelimit-* headers so the shared RateLimiter sizes its
+budget as it would against the real API.
+
+Run from the repository root:
+    python benchmarks/mock_services.py --port 8010 --chat-latency lognormal:0.5:0.4 --rate-limit-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8010/v1 SUPABASE_URL=http://127.0.0.1:8010 licensee-enrich run input.csv
+"""
+import argparse
+import base64
+import email.parser
+import email.policy
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from licensee_enrichment.category_matcher import LICENSING_CATEGORIES  # noqa: E402
+from licensee_enrichment.prompts import MIN_CACHED_PROMPT_TOKENS, PROMPT_CACHE_STEP  # noqa: E402
+
+EMBEDDING_DIMENSIONS = 1536
+
+# Budgets advertised in the x-ratelimit-* headers
+DEFAULT_REQUESTS_PER_MINUTE = 30000
+DEFAULT_TOKENS_PER_MINUTE = 150000000
+
+# Retry-After sent with injected 429s
+RETRY_AFTER_MS = 50
+
+
+def parse_latency(spec):
+    """
+    Turn a latency spec into a function returning a delay in seconds:
+    "0.2" (fixed), "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA"
+    """
+    kind, _, params = spec.partition(":")
+    try:
+        if not params:
+            delay = float(kind)
+            return lambda rng: delay
+        values = [float(value) for value in params.split(":")]
+        if kind == "uniform" and len(values) == 2:
+            return lambda rng: rng.uniform(*values)
+        if kind == "lognormal" and len(values) == 2:
+            median, sigma = values
+            return lambda rng: median * rng.lognormvariate(0, sigma) if median > 0 else 0.0
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"invalid latency spec {spec!r}")
+
+
+def latency_spec(spec):
+    """
+    argparse type that validates a latency spec
+    """
+    parse_latency(spec)
+    return spec
+
+
+# Prompt prefixes seen so far, for reporting cached tokens
+_seen_prefixes = set()
+_seen_prefixes_lock = threading.Lock()
+
+
+def cached_tokens(body, prompt_tokens):
+    """
+    Tokens of the prompt served from cache: the static prefix (the response
+    format and every message but the last), in PROMPT_CACHE_STEP steps, once
+    the same prefix has been seen before and the prompt is long enough
+    """
+    prefix = json.dumps(body.get("response_format")) + "".join(message["content"] for message in body["messages"][:-1])
+    key = hashlib.sha256(prefix.encode("utf-8")).digest()
+    with _seen_prefixes_lock:
+        seen = key in _seen_prefixes
+        _seen_prefixes.add(key)
+    if not seen or prompt_tokens < MIN_CACHED_PROMPT_TOKENS:
+        return 0
+    return min(len(prefix) // 4, prompt_tokens) // PROMPT_CACHE_STEP * PROMPT_CACHE_STEP
+
+
+def brand_answer(fields, brand, seed):
+    """
+    An answer to every one of fields for one brand
+    """
+    categories = random.Random(seed).sample(LICENSING_CATEGORIES, 2)
+    answer = {}
+    for field in fields:
+        if field == "product_summary_text":
+            answer[field] = (f"{brand} is known for {categories[0].lower()} and {categories[1].lower()} "
+                             "sold through department stores and online marketplaces.")
+        elif field == "primary_licensing_category":
+            answer[field] = categories[0]
+        elif field == "secondary_licensing_category":
+            answer[field] = categories[1]
+        else:
+            answer[field] = f"{field.replace('_', ' ')} for {brand}"
+    return answer
+
+
+def chat_completion(body):
+    """
+    A chat completion answering every field the request's schema requires
+    """
+    schema = (body.get("response_format") or {}).get("json_schema", {}).get("schema", {})
+    prompt = body["messages"][-1]["content"]
+    if "brands" in schema.get("properties", {}):
+        # A packed request: one answer per "uid: ...\nBrand website: ...\nBrand name: ..." block
+        fields = [field for field in schema["properties"]["brands"]["items"]["required"] if field != "uid"]
+        brands = re.findall(r"uid: (.+)\nBrand website: (.+)\nBrand name: (.+)", prompt)
+        # Seeded like a single-brand request, so a brand gets the same answer either way
+        answer = {"brands": [{"uid": uid,
+                              **brand_answer(fields, brand, f"Brand website: {website}\nBrand name: {brand}")}
+                             for uid, website, brand in brands]}
+    else:
+        brand = re.search(r"Brand name: (.+)", prompt)
+        answer = brand_answer(schema.get("required", []), brand.group(1) if brand else "the brand", prompt)
+    content = json.dumps(answer)
+    prompt_tokens = (len(json.dumps(body.get("response_format")))
+                     + sum(len(message["content"]) for message in body["messages"])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens,
+                  "prompt_tokens_details": {"cached_tokens": cached_tokens(body, prompt_tokens)}}
+    }
+
+
+def embedding_vector(text, dimensions=EMBEDDING_DIMENSIONS):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).uniform(-1, 1, dimensions).astype(np.float32)
+
+
+def embeddings_response(body):
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS
+    as_base64 = body.get("encoding_format") == "base64"
+    data = []
+    for index, text in enumerate(inputs):
+        vector = embedding_vector(text, dimensions)
+        embedding = base64.b64encode(vector.tobytes()).decode("ascii") if as_base64 else vector.tolist()
+        data.append({"object": "embedding", "index": index, "embedding": embedding})
+    tokens = sum(len(text) // 4 for text in inputs)
+    return {
+        "object": "list",
+        "model": body.get("model", "text-embedding-ada-002"),
+        "data": data,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }
+
+
+RESPONDERS = {
+    "/v1/chat/completions": chat_completion,
+    "/v1/embeddings": embeddings_response
+}
+
+
+class MockConfig:
+    """
+    Latency and fault injection settings
+    """
+
+    def __init__(self, chat_latency="0", embed_latency="0", db_latency="0", rate_limit_rate=0.0,
+                 error_rate=0.0, db_error_rate=0.0, batch_delay=1.0, batch_drop_rate=0.0,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 seed=None):
+        self.latency = {
+            "/v1/chat/completions": parse_latency(chat_latency),
+            "/v1/embeddings": parse_latency(embed_latency),
+            "db": parse_latency(db_latency)
+        }
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.db_error_rate = db_error_rate
+        self.batch_delay = batch_delay
+        self.batch_drop_rate = batch_drop_rate
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    def draw(self, fn):
+        with self.rng_lock:
+            return fn(self.rng)
+
+    def delay(self, endpoint):
+        return self.draw(self.latency[endpoint])
+
+    def chance(self, rate):
+        return rate > 0 and self.draw(lambda rng: rng.random()) < rate
+
+
+class MockState:
+    """
+    Uploaded files, batches and licensee rows, shared by the request handlers
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.files = {}
+        self.batches = {}
+        self.licensees = {}
+        self.counts = {"chat": 0, "embeddings": 0, "rate_limited": 0, "errors": 0, "db_reads": 0, "db_writes": 0}
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def add_file(self, content, filename, purpose):
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.files[file_id] = {
+                "content": content,
+                "info": {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                         "filename": filename, "purpose": purpose, "status": "processed"}
+            }
+        return self.files[file_id]["info"]
+
+    def create_batch(self, input_file_id, endpoint, completion_window, metadata=None):
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": endpoint, "input_file_id": input_file_id,
+            "completion_window": completion_window, "status": "validating", "created_at": int(time.time()),
+            "output_file_id": None, "error_file_id": None, "metadata": metadata,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0}
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._process, args=(batch_id,), daemon=True).start()
+        return batch
+
+    def _process(self, batch_id):
+        batch = self.batches[batch_id]
+        lines = self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+        batch["status"] = "in_progress"
+        batch["request_counts"]["total"] = len(lines)
+        time.sleep(self.config.batch_delay)
+
+        output = []
+        for line in lines:
+            request = json.loads(line)
+            if self.config.chance(self.config.batch_drop_rate):
+                # Left out of the output file, as for a batch that expires partway through
+                continue
+            responder = RESPONDERS.get(request["url"])
+            if responder is None:
+                response = {"status_code": 404, "body": {"error": {"message": f"Unknown endpoint {request['url']}"}}}
+            elif self.config.chance(self.config.error_rate):
+                response = {"status_code": 500, "body": {"error": {"message": "Injected server error"}}}
+            else:
+                response = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": responder(request["body"])}
+            batch["request_counts"]["completed" if response["status_code"] == 200 else "failed"] += 1
+            output.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                                      "response": response, "error": None}))
+
+        batch["output_file_id"] = self.add_file(("\n".join(output) + "\n").encode("utf-8"),
+                                                f"{batch_id}_output.jsonl", "batch_output")["id"]
+        batch["completed_at"] = int(time.time())
+        batch["status"] = "completed"
+
+    def upsert_licensees(self, records):
+        with self.lock:
+            for record in records:
+                self.licensees[str(record["uid"])] = {"uid": record["uid"], "input_hash": record.get("input_hash")}
+
+    def select_licensees(self, uids, columns):
+        with self.lock:
+            rows = [self.licensees[uid] for uid in uids if uid in self.licensees]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+
+# The keys of each upserted record. Pulled out with a regex because parsing whole
+# chunks of records with their embeddings would hold the GIL for a second or
+# more and stall every other request the stand-in is serving.
+_RECORD_KEYS = re.compile(r'"uid":\s*("(?:[^"\\]|\\.)*"|[^,}\s]+)|"input_hash":\s*("[0-9a-f]*"|null)')
+
+
+def upserted_keys(body):
+    """
+    (uid, input_hash) of each record in a PostgREST upsert body, for records
+    that list uid before input_hash as build_licensee_record does
+    """
+    records = []
+    for uid, input_hash in _RECORD_KEYS.findall(body.decode("utf-8")):
+        if uid:
+            records.append({"uid": json.loads(uid), "input_hash": None})
+        elif records:
+            records[-1]["input_hash"] = json.loads(input_hash)
+    return records
+
+
+def _in_filter(value):
+    # PostgREST "in.(a,b,"c,d")" filter values
+    inner = value[len("in.("):-1] if value.startswith("in.(") else ""
+    return [item[1:-1] if item.startswith('"') else item for item in re.findall(r'"[^"]*"|[^,]+', inner)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path
+        if path == "/rest/v1/licensees":
+            return self._select(parse_qs(url.query))
+        if path == "/mock/stats":
+            return self._send_json(200, dict(self.state.counts))
+        match = re.fullmatch(r"/v1/files/([^/]+)/content", path)
+        if match and match.group(1) in self.state.files:
+            return self._send(200, self.state.files[match.group(1)]["content"], "application/octet-stream")
+        match = re.fullmatch(r"/v1/batches/([^/]+)", path)
+        if match and match.group(1) in self.state.batches:
+            return self._send_json(200, self.state.batches[match.group(1)])
+        self._send_json(404, {"error": {"message": f"Not found: {path}"}})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._body()
+        if path in RESPONDERS:
+            return self._api_call(path, json.loads(body))
+        if path == "/rest/v1/licensees":
+            return self._upsert(body)
+        if path == "/v1/files":
+            return self._upload(body)
+        if path == "/v1/batches":
+            request = json.loads(body)
+            if request["input_file_id"] not in self.state.files:
+                return self._send_json(400, {"error": {"message": "Unknown input_file_id"}})
+            return self._send_json(200, self.state.create_batch(request["input_file_id"], request["endpoint"],
+                                                                request["completion_window"], request.get("metadata")))
+        self._send_json(404, {"error": {"message": f"Not found: {path}"}})
+
+    def _api_call(self, endpoint, body):
+        config = self.state.config
+        self.state.count("chat" if endpoint == "/v1/chat/completions" else "embeddings")
+        time.sleep(config.delay(endpoint))
+
+        headers = {
+            "x-ratelimit-limit-requests": str(config.requests_per_minute),
+            "x-ratelimit-remaining-requests": str(config.requests_per_minute - 1),
+            "x-ratelimit-limit-tokens": str(config.tokens_per_minute),
+            "x-ratelimit-remaining-tokens": str(config.tokens_per_minute - 1)
+        }
+        if config.chance(config.rate_limit_rate):
+            self.state.count("rate_limited")
+            return self._send_json(429, {"error": {"message": "Rate limit reached (injected)", "type": "requests",
+                                                   "code": "rate_limit_exceeded"}},
+                                   {**headers, "retry-after-ms": str(RETRY_AFTER_MS)})
+        if config.chance(config.error_rate):
+            self.state.count("errors")
+            return self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}}, headers)
+        self._send_json(200, RESPONDERS[endpoint](body), headers)
+
+    def _db_fault(self):
+        config = self.state.config
+        time.sleep(config.delay("db"))
+        if config.chance(config.db_error_rate):
+            self.state.count("errors")
+            self._send_json(500, {"message": "Injected database error", "code": "XX000"})
+            return True
+        return False
+
+    def _select(self, query):
+        self.state.count("db_reads")
+        if self._db_fault():
+            return
+        columns = [column.strip() for column in query.get("select", ["*"])[0].split(",")]
+        if columns == ["*"]:
+            columns = ["uid", "input_hash"]
+        uids = _in_filter(query.get("uid", [""])[0])
+        self._send_json(200, self.state.select_licensees(uids, columns))
+
+    def _upsert(self, body):
+        self.state.count("db_writes")
+        if self._db_fault():
+            return
+        records = upserted_keys(body)
+        self.state.upsert_licensees(records)
+        # Echo only the keys, not the embeddings, to keep responses small
+        self._send_json(201, [{"uid": record["uid"]} for record in records])
+
+    def _upload(self, body):
+        # Multipart form: a "purpose" field and the "file" itself
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + self.headers["Content-Type"].encode("latin-1") + b"\r\n\r\n" + body
+        )
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        upload = fields["file"]
+        info = self.state.add_file(upload.get_payload(decode=True), upload.get_filename() or "upload.jsonl",
+                                   fields["purpose"].get_content().strip())
+        self._send_json(200, info)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Client pools open many keep-alive connections at once
+    request_queue_size = 256
+
+
+def start_server(port=0, config=None):
+    """
+    Start the stand-in on a background thread and return (server, root_url).
+    The OpenAI base_url is root_url + "/v1" and the Supabase URL is root_url.
+    """
+    handler = type("Handler", (MockHandler,), {"state": MockState(config or MockConfig())})
+    server = MockServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--chat-latency", type=latency_spec, default="0", metavar="SPEC",
+                        help="chat completion latency, e.g. 0.5, uniform:0.2:1 or lognormal:0.5:0.4")
+    parser.add_argument("--embed-latency", type=latency_spec, default="0", metavar="SPEC",
+                        help="embeddings latency")
+    parser.add_argument("--db-latency", type=latency_spec, default="0", metavar="SPEC",
+                        help="PostgREST latency")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of OpenAI requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of OpenAI requests answered with 500")
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="share of PostgREST requests answered with 500")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="seconds before a batch completes")
+    parser.add_argument("--batch-drop-rate", type=float, default=0.0,
+                        help="share of Batch API requests left out of the output file")
+    parser.add_argument("--seed", type=int, help="seed for latency and fault draws")
+
+
+def config_from_args(args):
+    return MockConfig(chat_latency=args.chat_latency, embed_latency=args.embed_latency, db_latency=args.db_latency,
+                      rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+                      db_error_rate=args.db_error_rate, batch_delay=args.batch_delay,
+                      batch_drop_rate=args.batch_drop_rate, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8010, help="port to listen on (0 picks a free one)")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server, root_url = start_server(args.port, config_from_args(args))
+    # The first line is read by benchmarks/bench_pipeline.py to find the port
+    print(root_url, flush=True)
+    print(f"OpenAI base URL {root_url}/v1, Supabase URL {root_url} (Ctrl+C to stop)", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""
+Licensee enrichment without the UI.
+
+The Streamlit apps and the licensee-enrich command line tool are both thin
+frontends over this package; nothing here imports Streamlit.
+"""
+from .clients import create_openai_client, create_supabase_client
+from .category_matcher import LICENSING_CATEGORIES
+from .licensee import process_licensee
+from .pipeline import LicenseePipeline, enrich_rows
+from .similarity_index import SimilarityIndex, get_similarity_index
+
+__all__ = [
+    "create_openai_client",
+    "create_supabase_client",
+    "LICENSING_CATEGORIES",
+    "process_licensee",
+    "enrich_rows",
+    "LicenseePipeline",
+    "SimilarityIndex",
+    "get_similarity_index",
+]
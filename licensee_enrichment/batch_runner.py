@@ -0,0 +1,40 @@
+"""
+Per-row batch outcomes and concurrency limits shared by the batch paths.
+
+Every row of a batch ends with an outcome (uid, brand name, status,
+whether it was enriched and the tokens and estimated cost it used), whether
+it was processed, skipped or failed.
+"""
+from .usage import USAGE_FIELDS
+
+# Default and maximum number of rows enriched at the same time
+DEFAULT_CONCURRENCY = 8
+MAX_CONCURRENCY = 64
+
+
+def make_outcome(uid, brand_name, status, enriched, usage=None):
+    """
+    Build the minimal per-row result shown in the batch results table.
+    usage is the row's usage dict (see usage.py); rows that made no calls have none.
+    """
+    outcome = {
+        "uid": uid,
+        "brand_name": brand_name,
+        "status": status,
+        "enriched": enriched
+    }
+    for name in USAGE_FIELDS:
+        outcome[name] = usage[name] if usage else 0
+    outcome["cost"] = round(outcome["cost"], 6)
+    return outcome
+
+
+def outcome_kind(outcome):
+    """
+    "succeeded", "failed" or "skipped" - the bucket an outcome is counted in
+    """
+    if outcome["enriched"]:
+        return "succeeded"
+    if str(outcome["status"]).startswith("Skipped"):
+        return "skipped"
+    return "failed"
@@ -0,0 +1,166 @@
+"""
+Embedding-based licensing category matching.
+
+Every category in the list is embedded once and stored as an L2-normalized
+float32 NumPy matrix on disk, keyed by a hash of the category list and model.
+A record is ranked against all categories with one matrix-vector product of
+the matrix and its product_summary_text embedding; a batch of records is
+scored with one matrix-matrix product.
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from .category_matcher import get_category_matcher
+from .embeddings import EMBEDDING_MODEL, embed_texts
+
+DEFAULT_INDEX_DIR = os.path.join(".cache", "category_embeddings")
+
+# keyword: count category names in the summary (default)
+# embedding: rank categories by cosine similarity to the summary embedding
+# hybrid: keyword matching, with embeddings filling in whatever keywords didn't find
+CATEGORY_MODES = ("keyword", "embedding", "hybrid")
+
+
+def category_list_hash(category_list, model):
+    joined = "\x1f".join([model] + list(category_list))
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class CategoryEmbeddingIndex:
+    """
+    Category names with their normalized embedding matrix (one row per category)
+    """
+
+    def __init__(self, categories, matrix):
+        self.categories = list(categories)
+        self.matrix = normalize_rows(matrix)
+
+    @classmethod
+    def load_or_build(cls, category_list, embed_fn=None, model=EMBEDDING_MODEL, directory=DEFAULT_INDEX_DIR):
+        """
+        Load the matrix for this category list from disk, embedding the
+        categories (and saving the matrix) only if the list has changed
+        """
+        path = os.path.join(directory, f"{category_list_hash(category_list, model)}.npy")
+        if os.path.exists(path):
+            matrix = np.load(path)
+            if matrix.shape[0] == len(category_list):
+                return cls(category_list, matrix)
+
+        embed_fn = embed_fn or (lambda texts: embed_texts(texts, model=model))
+        vectors = embed_fn(list(category_list))
+        if any(vector is None for vector in vectors):
+            raise ValueError("Every category needs a non-empty name to be embedded")
+        index = cls(category_list, vectors)
+
+        # Write to a temporary file first so a concurrent reader never sees a partial matrix
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        np.save(temp_path, index.matrix)
+        os.replace(temp_path, path)
+        return index
+
+    def scores(self, vector):
+        """
+        Cosine similarity of one embedding to every category
+        """
+        return self.matrix @ normalize_rows(vector)
+
+    def scores_many(self, vectors):
+        """
+        Cosine similarities for a batch of embeddings, shape (len(vectors), len(categories))
+        """
+        return normalize_rows(vectors) @ self.matrix.T
+
+    def rank(self, vector):
+        """
+        Categories with their similarity scores, most similar first
+        """
+        scores = self.scores(vector)
+        return [(self.categories[i], float(scores[i])) for i in np.argsort(-scores, kind="stable")]
+
+    def top_two(self, vector):
+        return self._top_two(self.scores(vector))
+
+    def top_two_many(self, vectors):
+        return [self._top_two(scores) for scores in self.scores_many(vectors)]
+
+    def _top_two(self, scores):
+        order = np.argsort(-scores, kind="stable")[:2]
+        categories = [self.categories[i] for i in order] + [None, None]
+        return categories[0], categories[1]
+
+
+# Indexes are shared by every session and worker, one per category list and model
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_category_index(category_list, embed_fn=None, model=EMBEDDING_MODEL):
+    """
+    Process-wide CategoryEmbeddingIndex for a category list, built once per list
+    """
+    key = category_list_hash(category_list, model)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = CategoryEmbeddingIndex.load_or_build(category_list, embed_fn, model)
+        return _indexes[key]
+
+
+def match_categories(summary_text, category_list, mode="keyword", embed_fn=None):
+    """
+    Pick (primary, secondary) licensing categories for a product summary.
+    Either may be None when nothing matched; embed_fn embeds a list of texts.
+    """
+    return match_categories_many([summary_text], category_list, mode, embed_fn)[0]
+
+
+def match_categories_many(summary_texts, category_list, mode="keyword", embed_fn=None):
+    """
+    match_categories for a batch of summaries, with one keyword pass and a
+    single call to embed_fn for every summary that needs its embedding
+    """
+    if mode not in CATEGORY_MODES:
+        raise ValueError(f"Unknown category matching mode: {mode}")
+
+    if mode == "embedding":
+        categories = [(None, None)] * len(summary_texts)
+    else:
+        categories = get_category_matcher(category_list).top_two_many(summary_texts)
+        if mode == "keyword":
+            return categories
+
+    # Summaries with a slot keyword matching left empty (every one, in embedding mode)
+    pending = [i for i, (text, (_, secondary)) in enumerate(zip(summary_texts, categories))
+               if secondary is None and (text or "").strip()]
+    if not pending:
+        return categories
+
+    embed_fn = embed_fn or embed_texts
+    vectors = embed_fn([summary_texts[i] for i in pending])
+    embedded = [(i, vector) for i, vector in zip(pending, vectors) if vector is not None]
+    if not embedded:
+        return categories
+
+    # Fill the empty slots with the most similar categories other than the keyword match
+    index = get_category_index(category_list, embed_fn)
+    categories = list(categories)
+    for (i, _), top_two in zip(embedded, index.top_two_many([vector for _, vector in embedded])):
+        primary, secondary = categories[i]
+        candidates = [category for category in top_two if category is not None and category != primary]
+        if primary is None:
+            primary = candidates.pop(0) if candidates else None
+        if secondary is None:
+            secondary = candidates[0] if candidates else None
+        categories[i] = (primary, secondary)
+    return categories
@@ -0,0 +1,170 @@
+"""
+Keyword-based licensing category matcher.
+
+All categories are compiled once into a single trie-shaped regex, so one scan
+of a product summary counts every category hit. Counts and the primary /
+secondary ranking are identical to running one
+(?:^|\W)category(?:$|\W) findall per category.
+"""
+import bisect
+import re
+from functools import lru_cache
+
+# Licensing categories used for matching (from the original enrichment script)
+LICENSING_CATEGORIES = ["Accessories", "Sunglasses", "Scarves", "Belts", "Baseball Caps", "Beanies", "Tote Bags", "Backpacks", "Clutches",
+    "Crossbody Bags", "Bags", "Mini Backpacks", "Wallets", "Lunch Bags / Lunch Kits", "Hair Accessories", "Hats",
+    "Keychains", "Jewelry", "Temporary Tattoos", "Body Jewelry", "Buckles & Accessories", "Ties / Bowties", "Gloves",
+    "Kids Socks", "Adults Socks", "Optical Glasses", "Kids Underwear", "Adult Underwear", "Kids Watches", "Adult Watches",
+    "Watch Accessories", "Kids Luggage", "Adult Luggage", "Travel Accessories", "Pins", "Umbrellas", "Iron-On Patches",
+    "Apparel", "Men's T-Shirts", "Men's Shirts", "Men's Jeans", "Men's Jackets", "Men's Suits", "Men's Activewear",
+    "Women's Dresses", "Women's Tops", "Women's Skirts", "Women's Leggings", "Women's Blazers", "Women's Maternity Wear",
+    "Boys' Apparel", "Girls' Apparel", "School Uniforms", "Kids Activewear", "Women's Activewear", "Boy's Pajamas",
+    "Girl's Pajamas", "Women's Pajamas", "Men's Pajamas", "Kids Jackets", "Kids Onesies", "Adult Onesies",
+    "Women's Jackets", "Men's Pants", "Kids Sweaters", "Adult Sweaters", "Kids Hoodies", "Adult Hoodies",
+    "Boy's Swimwear", "Girl's Swimwear", "Women's Swimwear", "Men's Swimwear", "Kids Bathrobes", "Adult Bathrobes",
+    "Kids Raincoats", "Adult Raincoats", "Scrubs", "Domestics", "Bed Sheets", "Duvet Covers", "Pillowcases",
+    "Comforters", "Bath Towels", "Hand Towels", "Beach Towels", "Bath Mats", "Outdoor Rugs", "Bedding Sets",
+    "Blankets / Throws", "Weighted Blankets", "Throw Pillows", "Body Pillows", "Shower Curtains", "Cushions",
+    "Bathroom Accessories", "Indoor Rugs", "Curtains", "Electronics & Accessories", "Phone cases", "Wall Chargers",
+    "Wireless Chargers", "Car Chargers", "Portable chargers", "Backpack", "Messenger Bags", "Briefcases",
+    "Rolling Laptop Bags", "Tablet Cases & Sleeves", "Laptop Cases & Sleeves", "Laptop Accessories", "Laptop Bags",
+    "Kids Tablets", "Smartwatches", "Fitness Trackers", "Wearable Tech", "Speakers", "Gaming Accessories",
+    "Gaming Controllers", "USB Memory Sticks", "Headphones", "Electronic Cables", "Footwear", "Men's Sneakers",
+    "Men's Dress Shoes", "Men's Boots", "Men's Sandals", "Women's Flats", "Women's Heels", "Women's Sandals",
+    "Women's Athletic Shoes", "Kids Sneakers", "Kids School Shoes", "Kids Boots", "Kids Sandals", "Women's Sneakers",
+    "Men's Athletic Shoes", "Women's Boots", "Kids Athletic Shoes", "Men's Slippers", "Women's Slippers",
+    "Kids Slippers", "Men's Flipflops", "Women's Flipflops", "Kids Flipflops", "Kids Rain Boots", "Adult Rain Boots"]
+
+
+def _trie_pattern(node):
+    """
+    Regex for the strings stored in a character trie. Longer continuations are
+    tried first, so a lookahead around it captures the longest match.
+    """
+    terminal = "" in node
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    if len(branches) == 1 and not terminal:
+        return branches[0]
+    body = "|".join(branches)
+    return f"(?:{body})?" if terminal else f"(?:{body})"
+
+
+class CategoryMatcher:
+    """
+    Counts occurrences of every category in a text in a single regex pass
+    """
+
+    def __init__(self, category_list):
+        self.categories = list(category_list)
+
+        # Categories sharing a lowercase form are all credited for the same hit
+        self.indexes = {}
+        for index, category in enumerate(self.categories):
+            self.indexes.setdefault(category.lower(), []).append(index)
+
+        # When a longer category matches, any category that is a whole-word prefix of it matches at the same spot
+        self.implied = {}
+        for longer in self.indexes:
+            self.implied[longer] = [
+                shorter for shorter in self.indexes
+                if shorter != longer and longer.startswith(shorter) and not re.match(r"\w", longer[len(shorter)])
+            ]
+
+        trie = {}
+        for term in self.indexes:
+            if not term:
+                continue
+            node = trie
+            for char in term:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        # Zero-width lookahead, so overlapping hits of different categories are all found
+        self.pattern = re.compile(r"(?<!\w)(?=(" + _trie_pattern(trie) + r")(?!\w))") if trie else None
+
+    def _count_spans(self, text, starts, counts):
+        # findall on (?:^|\W)cat(?:$|\W) consumes the boundary characters, so a
+        # repeat separated from the previous hit by a single character is not counted
+        last_end = {}
+        for start, term in starts:
+            for matched in [term] + self.implied[term]:
+                if start > 0 and start - 1 < last_end.get(matched, 0):
+                    continue
+                end = start + len(matched)
+                last_end[matched] = end + 1 if end < len(text) else end
+                for index in self.indexes[matched]:
+                    counts[index] += 1
+
+    def count(self, text):
+        """
+        Return the hit count of each category (same order as category_list)
+        """
+        counts = [0] * len(self.categories)
+        if self.pattern is None:
+            return counts
+        text = (text or "").lower()
+        starts = [(match.start(), match.group(1)) for match in self.pattern.finditer(text)]
+        self._count_spans(text, starts, counts)
+        return counts
+
+    def count_many(self, texts):
+        """
+        Count categories in a batch of texts with one scan over all of them
+        """
+        texts = [(text or "").lower() for text in texts]
+        results = [[0] * len(self.categories) for _ in texts]
+        if self.pattern is None or not texts:
+            return results
+
+        # Categories never contain a newline, so no match can span two texts
+        offsets = []
+        position = 0
+        for text in texts:
+            offsets.append(position)
+            position += len(text) + 1
+
+        starts = [[] for _ in texts]
+        for match in self.pattern.finditer("\n".join(texts)):
+            text_index = bisect.bisect_right(offsets, match.start()) - 1
+            starts[text_index].append((match.start() - offsets[text_index], match.group(1)))
+
+        for text, text_starts, counts in zip(texts, starts, results):
+            self._count_spans(text, text_starts, counts)
+        return results
+
+    def rank(self, counts):
+        """
+        Categories with their counts, highest first (ties keep category_list order)
+        """
+        scores = [{"category": category, "count": count} for category, count in zip(self.categories, counts)]
+        scores.sort(key=lambda x: x["count"], reverse=True)
+        return scores
+
+    def top_two(self, text):
+        """
+        (primary, secondary) category for a text; None where there were no hits
+        """
+        return self._top_two(self.count(text))
+
+    def top_two_many(self, texts):
+        return [self._top_two(counts) for counts in self.count_many(texts)]
+
+    def _top_two(self, counts):
+        scores = self.rank(counts)
+        primary = scores[0]["category"] if scores and scores[0]["count"] > 0 else None
+        secondary = scores[1]["category"] if len(scores) > 1 and scores[1]["count"] > 0 else None
+        return primary, secondary
+
+
+@lru_cache(maxsize=8)
+def _cached_matcher(categories):
+    return CategoryMatcher(categories)
+
+
+def get_category_matcher(category_list):
+    """
+    Matcher for a category list, compiled once and reused while the list is unchanged
+    """
+    return _cached_matcher(tuple(category_list))
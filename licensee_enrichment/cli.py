@@ -0,0 +1,431 @@
+"""
+Command-line entry point for headless enrichment runs, e.g. from cron:
+
+    licensee-enrich run input.csv --concurrency 32 --output results.csv
+
+or, for large overnight loads, through the OpenAI Batch API:
+
+    licensee-enrich batch input.csv --output results.csv
+
+Credentials are read from OPENAI_API_KEY, SUPABASE_URL and SUPABASE_KEY (a
+.env file in the working directory is loaded first). Progress is written to
+stderr as one JSON object per line, and per-row outcomes can be saved as a
+CSV. The exit status is 0 when every row succeeded or was skipped, 1 when
+any row failed and 2 for bad input or missing credentials.
+
+Each outcome records the row's prompt, completion and embedding tokens and
+estimated cost, and --budget pauses the run before its estimated spend
+passes a ceiling in USD.
+
+The summary embeddings are made and stored as set by --embedding-profile
+(or the EMBEDDING_PROFILE environment variable), and a table's stored
+vectors are moved to another profile with:
+
+    licensee-enrich migrate-embeddings --to 3-small-512-int8 --sql        # print the SQL to run first
+    licensee-enrich migrate-embeddings --to 3-small-512-int8
+    licensee-enrich migrate-embeddings --to 3-small-512-int8 --swap-sql   # once every row is migrated
+
+Licensees similar to a stored one, or to a description, are looked up in a
+local index of the stored embeddings (see similarity_index.py):
+
+    licensee-enrich similar --uid 1234 --k 10 --refresh
+    licensee-enrich similar --text "eco-friendly kids apparel"
+
+Stage timings can be exported as OpenMetrics text (--metrics-file, rewritten
+with every progress line, or scraped from --metrics-port) and each stage call
+logged to a JSONL trace (--trace).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from .batch_runner import outcome_kind, DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+from .category_embeddings import CATEGORY_MODES
+from .clients import create_openai_client, create_supabase_client, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+from .csv_stream import read_csv_columns, missing_required_columns, count_csv_rows, iter_csv_rows
+from .embedding_cache import get_shared_cache
+from .embedding_migration import (migrate_embeddings, migration_sql, unmigrated_rows, DEFAULT_PAGE_SIZE,
+                                  DEFAULT_WORKERS)
+from .embedding_profiles import EMBEDDING_PROFILES, get_embedding_profile
+from .enrichment import MAX_PACK_SIZE
+from .licensee import EMBEDDING_COLUMNS
+from .openai_batch import BatchEnrichment, DEFAULT_POLL_INTERVAL, DEFAULT_WORK_DIR
+from .pipeline import LicenseePipeline, DEFAULT_EMBED_BATCH_SIZE, DEFAULT_EMBED_WORKERS
+from .similarity_index import SimilarityIndex, DEFAULT_COLUMN, DEFAULT_K, INDEX_KINDS
+from .supabase_writer import DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE
+from .telemetry import get_tracer
+from .usage import USAGE_FIELDS, cached_share, metering
+
+OUTCOME_FIELDS = ["uid", "brand_name", "status", "enriched", *USAGE_FIELDS]
+
+# Seconds between progress lines
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
+
+def emit(event, **fields):
+    """
+    Write one machine-readable progress line to stderr
+    """
+    print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}), file=sys.stderr, flush=True)
+
+
+def bounded_int(low, high):
+    def parse(value):
+        number = int(value)
+        if not low <= number <= high:
+            raise argparse.ArgumentTypeError(f"must be between {low} and {high}")
+        return number
+    return parse
+
+
+def add_common_arguments(parser):
+    """
+    Input, output and client options shared by every command
+    """
+    parser.add_argument("input", help="CSV with uid, brand_name and website columns (contact, email and headquarters optional)")
+    parser.add_argument("--chunk-size", type=bounded_int(1, MAX_CHUNK_SIZE), default=DEFAULT_CHUNK_SIZE,
+                        help=f"records upserted to Supabase per request (default {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip rows whose inputs are unchanged since they were last enriched")
+    parser.add_argument("--force-refresh", action="store_true",
+                        help="ignore cached enrichments and call the model again")
+    parser.add_argument("--category-mode", choices=CATEGORY_MODES, default="keyword",
+                        help="how licensing categories are matched (default keyword)")
+    parser.add_argument("--output", help="write each row's outcome to this CSV")
+    parser.add_argument("--budget", type=float,
+                        help="pause before the estimated API cost of the run passes this many USD")
+    parser.add_argument("--embedding-profile", choices=list(EMBEDDING_PROFILES),
+                        help="embeddings model and storage format (default $EMBEDDING_PROFILE or ada-002)")
+    parser.add_argument("--progress-interval", type=float, default=DEFAULT_PROGRESS_INTERVAL,
+                        help="seconds between progress lines on stderr (0 for every row)")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help="HTTP connections per API client")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="HTTP request timeout in seconds")
+    parser.add_argument("--metrics-file", help="write stage timing histograms to this file in OpenMetrics text format")
+    parser.add_argument("--metrics-port", type=bounded_int(1, 65535),
+                        help="serve the OpenMetrics text at http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--trace", help="append one JSON line per stage call (uids, duration, retries, bytes) to this file")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="licensee-enrich", description="Enrich licensees without the Streamlit UI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Enrich every row of a CSV and upsert the records to Supabase")
+    add_common_arguments(run_parser)
+    run_parser.add_argument("--concurrency", type=bounded_int(1, MAX_CONCURRENCY), default=DEFAULT_CONCURRENCY,
+                            help=f"licensees enriched in parallel (default {DEFAULT_CONCURRENCY})")
+    run_parser.add_argument("--embed-batch-size", type=bounded_int(1, 256), default=DEFAULT_EMBED_BATCH_SIZE,
+                            help=f"records embedded per embeddings request (default {DEFAULT_EMBED_BATCH_SIZE})")
+    run_parser.add_argument("--embed-workers", type=bounded_int(1, 16), default=DEFAULT_EMBED_WORKERS,
+                            help=f"embedding requests in flight (default {DEFAULT_EMBED_WORKERS})")
+    run_parser.add_argument("--pack-size", type=bounded_int(1, MAX_PACK_SIZE), default=1,
+                            help="brands enriched together in one chat request (default 1, not packed)")
+    run_parser.set_defaults(func=run)
+
+    batch_parser = commands.add_parser("batch", help="Enrich a CSV through the OpenAI Batch API (slower, cheaper)")
+    add_common_arguments(batch_parser)
+    batch_parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                              help=f"seconds between batch status checks (default {DEFAULT_POLL_INTERVAL:g})")
+    batch_parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR,
+                              help=f"where batch request and result files are kept (default {DEFAULT_WORK_DIR})")
+    batch_parser.set_defaults(func=batch)
+
+    migrate_parser = commands.add_parser("migrate-embeddings",
+                                         help="Move the stored embeddings to another embedding profile")
+    migrate_parser.add_argument("--to", dest="target", required=True, choices=list(EMBEDDING_PROFILES),
+                                help="profile to migrate to")
+    migrate_parser.add_argument("--from", dest="source", choices=list(EMBEDDING_PROFILES),
+                                help="profile the table is stored in now (default $EMBEDDING_PROFILE or ada-002)")
+    migrate_parser.add_argument("--sql", action="store_true",
+                                help="print the SQL that adds the new columns, then exit")
+    migrate_parser.add_argument("--swap-sql", action="store_true",
+                                help="check that every row is migrated and up to date, then print the SQL that "
+                                     "swaps the new columns in")
+    migrate_parser.add_argument("--all", action="store_true",
+                                help="redo rows that are already migrated from their current values")
+    migrate_parser.add_argument("--page-size", type=bounded_int(1, MAX_CHUNK_SIZE), default=DEFAULT_PAGE_SIZE,
+                                help=f"rows read and embedded at a time (default {DEFAULT_PAGE_SIZE})")
+    migrate_parser.add_argument("--workers", type=bounded_int(1, 64), default=DEFAULT_WORKERS,
+                                help=f"row updates in flight (default {DEFAULT_WORKERS})")
+    migrate_parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                                help="HTTP connections per API client")
+    migrate_parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                                help="HTTP request timeout in seconds")
+    migrate_parser.set_defaults(func=migrate)
+
+    similar_parser = commands.add_parser("similar", help="Find the licensees most similar to one, or to a text")
+    query = similar_parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--uid", help="uid of a stored licensee")
+    query.add_argument("--text", help="description to embed and search for")
+    similar_parser.add_argument("--k", type=bounded_int(1, 1000), default=DEFAULT_K,
+                                help=f"neighbors returned (default {DEFAULT_K})")
+    similar_parser.add_argument("--column", choices=EMBEDDING_COLUMNS, default=DEFAULT_COLUMN,
+                                help=f"embedding compared (default {DEFAULT_COLUMN})")
+    similar_parser.add_argument("--embedding-profile", choices=list(EMBEDDING_PROFILES),
+                                help="profile the table's embeddings are stored in "
+                                     "(default $EMBEDDING_PROFILE or ada-002)")
+    similar_parser.add_argument("--index", choices=INDEX_KINDS, default="auto",
+                                help="exact search, an HNSW graph (needs hnswlib) or HNSW on large tables only "
+                                     "(default auto)")
+    similar_parser.add_argument("--refresh", action="store_true",
+                                help="bring the local index up to date with Supabase first "
+                                     "(always done when it is empty)")
+    similar_parser.add_argument("--full", action="store_true",
+                                help="with --refresh, fetch every row's embeddings again instead of only changed rows")
+    similar_parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                                help="HTTP connections per API client")
+    similar_parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                                help="HTTP request timeout in seconds")
+    similar_parser.set_defaults(func=similar)
+    return parser
+
+
+def run(args):
+    """
+    Enrich through the staged pipeline
+    """
+    return enrich_csv(args, lambda openai_client, supabase_client: LicenseePipeline(
+        openai_client, supabase_client, concurrency=args.concurrency, chunk_size=args.chunk_size,
+        force_refresh=args.force_refresh, category_mode=args.category_mode,
+        embed_batch_size=args.embed_batch_size, embed_workers=args.embed_workers, budget=args.budget,
+        pack_size=args.pack_size, embedding_profile=args.embedding_profile
+    ), concurrency=args.concurrency, pack_size=args.pack_size)
+
+
+def batch(args):
+    """
+    Enrich through the OpenAI Batch API
+    """
+    return enrich_csv(args, lambda openai_client, supabase_client: BatchEnrichment(
+        openai_client, supabase_client, chunk_size=args.chunk_size, force_refresh=args.force_refresh,
+        category_mode=args.category_mode, poll_interval=args.poll_interval, work_dir=args.work_dir, on_event=emit,
+        budget=args.budget, embedding_profile=args.embedding_profile
+    ), mode="batch")
+
+
+def migrate(args):
+    """
+    Fill the new embedding columns of a migration to another profile (see
+    embedding_migration.py), or print the SQL before and after it
+    """
+    target = get_embedding_profile(args.target)
+    source = get_embedding_profile(args.source)
+    if args.sql:
+        print(f"-- Before migrate-embeddings: add the {target.name} columns\n{migration_sql(target, source)['expand']}")
+        print("-- Once every row is migrated and writers are stopped, get the swap SQL with --swap-sql")
+        return 0
+
+    # Only a change of model or dimensions needs OpenAI; a new storage format is re-encoded locally
+    reencode = target.same_vectors(source)
+    names = ("SUPABASE_URL", "SUPABASE_KEY")
+    if not (reencode or args.swap_sql):
+        names = ("OPENAI_API_KEY", *names)
+    credentials = {name: os.environ.get(name) for name in names}
+    missing = [name for name, value in credentials.items() if not value]
+    if missing:
+        emit("error", message=f"Missing environment variables: {', '.join(missing)}")
+        return 2
+
+    supabase_client = create_supabase_client(credentials["SUPABASE_URL"], credentials["SUPABASE_KEY"],
+                                             pool_size=args.pool_size, timeout=args.timeout)
+    if args.swap_sql:
+        # Dropping the old columns while any row lacks its new vectors would lose them
+        try:
+            pending = unmigrated_rows(supabase_client, target, source, page_size=args.page_size)
+        except Exception as e:
+            emit("error", message=str(e))
+            return 2
+        if pending:
+            emit("error", message=f"{len(pending)} rows are not migrated or changed since; run migrate-embeddings "
+                                  "again before swapping", uids=pending[:20])
+            return 1
+        print(f"-- Replace the {source.name} columns with the {target.name} ones\n"
+              f"{migration_sql(target, source)['swap']}")
+        return 0
+
+    openai_client = None if reencode else create_openai_client(credentials["OPENAI_API_KEY"],
+                                                               pool_size=args.pool_size, timeout=args.timeout)
+
+    emit("start", source=source.name, target=target.name, reembed=not reencode)
+    counts = Counter()
+    started = time.monotonic()
+    try:
+        with metering() as usage:
+            for page in migrate_embeddings(supabase_client, target, source, openai_client, page_size=args.page_size,
+                                           workers=args.workers, only_missing=not args.all):
+                counts.update(rows=page["rows"], skipped=page["skipped"], updated=page["updated"],
+                              failed=len(page["failed"]))
+                for uid, error in page["failed"]:
+                    emit("row_failed", uid=uid, message=error)
+                emit("progress", rows=counts["rows"], skipped=counts["skipped"], updated=counts["updated"],
+                     failed=counts["failed"], last_uid=page["last_uid"], cost=round(usage["cost"], 4))
+    except Exception as e:
+        # e.g. the expand SQL hasn't been run, so the new columns don't exist
+        emit("error", message=str(e), rows=counts["rows"])
+        return 2
+
+    emit("done", rows=counts["rows"], skipped=counts["skipped"], updated=counts["updated"], failed=counts["failed"],
+         seconds=round(time.monotonic() - started, 3),
+         usage={name: round(usage[name], 6) if name == "cost" else usage[name] for name in USAGE_FIELDS})
+    return 1 if counts["failed"] else 0
+
+
+def similar(args):
+    """
+    Print the nearest licensees as one JSON object per line on stdout, most similar first
+    """
+    try:
+        index = SimilarityIndex(args.embedding_profile, kind=args.index)
+    except ValueError as e:
+        emit("error", message=str(e))
+        return 2
+
+    if args.refresh or not len(index):
+        names = ("SUPABASE_URL", "SUPABASE_KEY")
+        credentials = {name: os.environ.get(name) for name in names}
+        missing = [name for name, value in credentials.items() if not value]
+        if missing:
+            emit("error", message=f"Missing environment variables: {', '.join(missing)}")
+            return 2
+        supabase_client = create_supabase_client(credentials["SUPABASE_URL"], credentials["SUPABASE_KEY"],
+                                                 pool_size=args.pool_size, timeout=args.timeout)
+        started = time.monotonic()
+        try:
+            counts = index.refresh(supabase_client, full=args.full)
+        except Exception as e:
+            emit("error", message=str(e))
+            return 2
+        emit("refreshed", seconds=round(time.monotonic() - started, 3), **counts)
+
+    openai_client = None
+    if args.text:
+        if not os.environ.get("OPENAI_API_KEY"):
+            emit("error", message="Missing environment variables: OPENAI_API_KEY")
+            return 2
+        openai_client = create_openai_client(os.environ["OPENAI_API_KEY"], pool_size=args.pool_size,
+                                             timeout=args.timeout)
+
+    started = time.monotonic()
+    try:
+        if args.uid:
+            neighbors = index.similar_to(args.uid, args.k, args.column)
+        else:
+            neighbors = index.search_text(args.text, args.k, args.column, client=openai_client)
+    except ValueError as e:
+        emit("error", message=str(e))
+        return 2
+    elapsed = time.monotonic() - started
+
+    for rank, (uid, score) in enumerate(neighbors, start=1):
+        print(json.dumps({"rank": rank, "uid": uid, "score": round(score, 6)}))
+    emit("done", results=len(neighbors), indexed=len(index), query_ms=round(elapsed * 1000, 3),
+         hnsw=args.column in index.stats()["hnsw"])
+    return 0
+
+
+def enrich_csv(args, make_runner, **start_fields):
+    """
+    Check the credentials and input, then enrich the CSV with the runner
+    make_runner(openai_client, supabase_client) returns (a LicenseePipeline
+    or BatchEnrichment), recording each outcome and writing progress lines.
+    """
+    credentials = {name: os.environ.get(name) for name in ("OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY")}
+    missing = [name for name, value in credentials.items() if not value]
+    if missing:
+        emit("error", message=f"Missing environment variables: {', '.join(missing)}")
+        return 2
+
+    try:
+        source = open(args.input, "rb")
+    except OSError as e:
+        emit("error", message=str(e))
+        return 2
+
+    with source:
+        try:
+            columns = read_csv_columns(source)
+        except (pd.errors.EmptyDataError, ValueError) as e:
+            # An empty file, no header row or undecodable text
+            emit("error", message=f"Can't read the CSV header: {e}")
+            return 2
+        missing_columns = missing_required_columns(columns)
+        if missing_columns:
+            emit("error", message=f"Missing required columns: {', '.join(missing_columns)}")
+            return 2
+        total_rows = count_csv_rows(source)
+
+        openai_client = create_openai_client(credentials["OPENAI_API_KEY"], pool_size=args.pool_size,
+                                             timeout=args.timeout)
+        supabase_client = create_supabase_client(credentials["SUPABASE_URL"], credentials["SUPABASE_KEY"],
+                                                 pool_size=args.pool_size, timeout=args.timeout)
+        runner = make_runner(openai_client, supabase_client)
+
+        tracer = get_tracer()
+        if args.trace:
+            tracer.open_trace(args.trace)
+        metrics_server = tracer.serve(args.metrics_port) if args.metrics_port else None
+
+        output = open(args.output, "w", newline="", encoding="utf-8") if args.output else None
+        writer = None
+        if output:
+            writer = csv.DictWriter(output, fieldnames=OUTCOME_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+
+        counts = Counter()
+        usage = Counter()
+        started = time.monotonic()
+        last_progress = None
+
+        def record(outcome):
+            nonlocal last_progress
+            counts[outcome_kind(outcome)] += 1
+            usage.update({name: outcome[name] for name in USAGE_FIELDS})
+            if writer:
+                writer.writerow(outcome)
+            now = time.monotonic()
+            if last_progress is None or now - last_progress >= args.progress_interval:
+                emit("progress", processed=sum(counts.values()), total=total_rows, succeeded=counts["succeeded"],
+                     failed=counts["failed"], skipped=counts["skipped"], cost=round(usage["cost"], 4))
+                if args.metrics_file:
+                    tracer.write_openmetrics(args.metrics_file)
+                last_progress = now
+
+        emit("start", input=args.input, total=total_rows, **start_fields)
+        try:
+            for outcome in runner.run(iter_csv_rows(source), incremental=args.incremental):
+                record(outcome)
+        finally:
+            if output:
+                output.close()
+            tracer.close_trace()
+            if args.metrics_file:
+                tracer.write_openmetrics(args.metrics_file)
+            if metrics_server:
+                metrics_server.shutdown()
+
+    elapsed = time.monotonic() - started
+    processed = sum(counts.values())
+    if runner.paused:
+        emit("paused", message=f"Stopped at the budget ceiling of ${args.budget:.2f}", processed=processed,
+             total=total_rows)
+    emit("done", processed=processed, total=total_rows, succeeded=counts["succeeded"], failed=counts["failed"],
+         skipped=counts["skipped"], seconds=round(elapsed, 3),
+         rows_per_second=round(processed / elapsed, 3) if elapsed else None,
+         usage={name: round(usage[name], 6) if name == "cost" else usage[name] for name in USAGE_FIELDS},
+         cached_share=round(cached_share(usage), 3),
+         embedding_cache=get_shared_cache().stats(), stages=runner.metrics(), timings=tracer.summary())
+    return 1 if counts["failed"] else 0
+
+
+def main(argv=None):
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    sys.exit(args.func(args))
@@ -0,0 +1,67 @@
+"""
+Pooled OpenAI and Supabase clients.
+
+Each factory builds a client on top of an httpx connection pool with
+keep-alive, so concurrent workers reuse open TLS connections instead of
+handshaking on every row. The apps cache one client per process (see
+st.cache_resource in the app scripts); both clients are safe to share
+between threads.
+"""
+import httpx
+import openai
+from supabase import create_client, ClientOptions
+
+from .telemetry import record_request, record_response
+
+DEFAULT_POOL_SIZE = 64
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+KEEPALIVE_EXPIRY = 30.0
+
+
+def create_http_client(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                       connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+    """
+    httpx client with a keep-alive connection pool of pool_size connections.
+    Every request and response is counted on the current telemetry span.
+    """
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        event_hooks={"request": [record_request], "response": [record_response]}
+    )
+
+
+def create_openai_client(api_key, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                         connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+    """
+    OpenAI client over a pooled httpx client.
+    Retries are left to the shared RateLimiter so backoff is coordinated across workers.
+    """
+    return openai.OpenAI(
+        api_key=api_key,
+        http_client=create_http_client(pool_size, timeout, connect_timeout),
+        max_retries=0
+    )
+
+
+def create_supabase_client(supabase_url, supabase_key, pool_size=DEFAULT_POOL_SIZE,
+                           timeout=DEFAULT_TIMEOUT, connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+    """
+    Supabase client whose PostgREST requests share a pooled httpx client
+    """
+    client = create_client(
+        supabase_url,
+        supabase_key,
+        options=ClientOptions(
+            postgrest_client_timeout=timeout,
+            httpx_client=create_http_client(pool_size, timeout, connect_timeout)
+        )
+    )
+    # The PostgREST client is created lazily; build it now so concurrent workers don't race to do it
+    client.postgrest
+    return client
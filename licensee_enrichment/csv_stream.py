@@ -0,0 +1,55 @@
+"""
+Streaming CSV ingestion for batch enrichment.
+
+Large supplier files are read in fixed-size chunks and handed to the batch
+runner one row at a time, so only a chunk of the input is in memory at once
+instead of the whole DataFrame.
+"""
+import pandas as pd
+
+REQUIRED_COLUMNS = ["uid", "brand_name", "website"]
+
+# Rows parsed per pd.read_csv chunk
+CSV_CHUNK_SIZE = 1000
+
+
+def read_csv_columns(source):
+    """
+    Column names from the header row; rewinds source afterwards
+    """
+    columns = list(pd.read_csv(source, nrows=0).columns)
+    source.seek(0)
+    return columns
+
+
+def missing_required_columns(columns):
+    return [col for col in REQUIRED_COLUMNS if col not in columns]
+
+
+def count_csv_rows(source):
+    """
+    Approximate number of data rows (lines after the header), for progress
+    reporting only. Counts newlines without parsing, then rewinds source.
+    """
+    newlines = 0
+    last = b""
+    while True:
+        block = source.read(1 << 20)
+        if not block:
+            break
+        if isinstance(block, str):
+            block = block.encode("utf-8")
+        newlines += block.count(b"\n")
+        last = block[-1:]
+    source.seek(0)
+    # A final line without a trailing newline is still a row
+    lines = newlines + (1 if last and last != b"\n" else 0)
+    return max(0, lines - 1)
+
+
+def iter_csv_rows(source, chunksize=CSV_CHUNK_SIZE):
+    """
+    Yield the rows of a CSV as dicts, parsing chunksize rows at a time
+    """
+    for chunk in pd.read_csv(source, chunksize=chunksize):
+        yield from chunk.to_dict("records")
@@ -0,0 +1,172 @@
+"""
+Moving the licensees table's stored embeddings to another embedding profile.
+
+A migration expands, backfills and swaps, so the table stays readable
+throughout:
+
+1. Run the expand SQL from migration_sql in the Supabase SQL editor. It adds
+   a {column}_next column of the target profile's type (and a
+   {column}_scale_next column for int8) beside each embedding column, and an
+   embedding_source_hash_next column.
+2. Fill the new columns with migrate_embeddings (licensee-enrich
+   migrate-embeddings). When the source and target profiles share a model
+   and dimensions, so only the storage format changes, the stored vectors
+   are read back and re-encoded without calling OpenAI. Otherwise the
+   stored summary texts are embedded again with the target profile. Each
+   migrated row is stamped with a hash of the values its new vectors were
+   made from, so a re-run skips rows that are done and redoes rows that
+   failed or were rewritten since. It can be stopped and re-run.
+3. Stop any batch jobs and run the backfill once more for rows written in
+   the meantime. Then get the swap SQL (licensee-enrich migrate-embeddings
+   --swap-sql), which is only given out once unmigrated_rows finds every
+   row migrated and up to date. It drops the old columns and renames the
+   new ones. Set EMBEDDING_PROFILE to the target and restart the apps.
+"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from .embedding_profiles import get_embedding_profile
+from .embeddings import embed_fields_many, profile_embed_fn
+from .licensee import EMBEDDING_COLUMNS, embedding_text_fields
+from .supabase_writer import LICENSEES_TABLE
+
+DEFAULT_PAGE_SIZE = 200
+DEFAULT_WORKERS = 8
+
+# Suffix of the columns a migration fills in before the swap
+NEXT_SUFFIX = "_next"
+
+# Hash of the source values a row's new vectors were made from; dropped by the swap
+SOURCE_HASH_COLUMN = f"embedding_source_hash{NEXT_SUFFIX}"
+
+
+def migration_sql(target, source=None, table=LICENSEES_TABLE):
+    """
+    The SQL for moving table from the source profile's columns to the
+    target's, as {"expand": ..., "swap": ...}
+    """
+    target = get_embedding_profile(target)
+    source = get_embedding_profile(source)
+    expand = []
+    drops = []
+    renames = []
+    for column in EMBEDDING_COLUMNS:
+        for name, column_type in target.column_types(column).items():
+            expand.append(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name}{NEXT_SUFFIX} {column_type};")
+            renames.append(f"ALTER TABLE {table} RENAME COLUMN {name}{NEXT_SUFFIX} TO {name};")
+        drops.extend(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {name};" for name in source.column_types(column))
+    expand.append(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {SOURCE_HASH_COLUMN} text;")
+    drops.append(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {SOURCE_HASH_COLUMN};")
+    return {
+        "expand": "\n".join(expand),
+        "swap": "\n".join(["BEGIN;", *drops, *renames, "COMMIT;"])
+    }
+
+
+class _Plan:
+    """
+    What a migration reads from each row and how it makes the new vectors
+    """
+
+    def __init__(self, target, source, openai_client=None):
+        self.target = get_embedding_profile(target)
+        self.source = get_embedding_profile(source)
+        self.reencode = self.target.same_vectors(self.source)
+        if self.reencode:
+            self.columns = [name for column in EMBEDDING_COLUMNS for name in self.source.column_types(column)]
+        else:
+            self.columns = [field_name for field_name, _ in embedding_text_fields({})]
+            self.embed_fn = profile_embed_fn(self.target, openai_client)
+
+    def source_hash(self, row):
+        values = json.dumps([row.get(name) for name in self.columns])
+        return hashlib.sha256(values.encode("utf-8")).hexdigest()
+
+    def expected(self, row):
+        """
+        Embedding columns that must get a vector: those with a stored vector or a non-blank text
+        """
+        if self.reencode:
+            return [column for column in EMBEDDING_COLUMNS if row.get(column) is not None]
+        return [f"{name}_embedding" for name in self.columns if (row.get(name) or "").strip()]
+
+    def vectors(self, rows):
+        if self.reencode:
+            return [{column: self.source.decode_record(row, column) for column in EMBEDDING_COLUMNS} for row in rows]
+        return embed_fields_many([[(name, row.get(name) or "") for name in self.columns] for row in rows],
+                                 self.embed_fn)
+
+
+def _pages(supabase_client, columns, page_size):
+    last_uid = None
+    while True:
+        query = supabase_client.table(LICENSEES_TABLE).select(",".join(["uid", *columns]))
+        if last_uid is not None:
+            query = query.gt("uid", last_uid)
+        rows = query.order("uid").limit(page_size).execute().data
+        if not rows:
+            return
+        last_uid = rows[-1]["uid"]
+        yield rows
+
+
+def _update(supabase_client, uid, values):
+    try:
+        supabase_client.table(LICENSEES_TABLE).update(values).eq("uid", uid).execute()
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def migrate_embeddings(supabase_client, target, source=None, openai_client=None, page_size=DEFAULT_PAGE_SIZE,
+                       workers=DEFAULT_WORKERS, only_missing=True):
+    """
+    Fill the {column}_next columns of the licensees table with the target
+    profile's vectors, a page of rows at a time in uid order. Rows already
+    migrated from their current values are skipped unless only_missing is
+    False. openai_client is only needed when the texts are embedded again.
+    A row is only written when it has every vector it should; otherwise it
+    is reported as failed and left for the next run.
+
+    Yields one dict per page: "rows" read, "skipped", "updated", "failed"
+    (a list of (uid, error) pairs) and "last_uid".
+    """
+    plan = _Plan(target, source, openai_client)
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="migrate") as executor:
+        for rows in _pages(supabase_client, [*plan.columns, SOURCE_HASH_COLUMN], page_size):
+            hashes = [plan.source_hash(row) for row in rows]
+            stale = [(row, row_hash) for row, row_hash in zip(rows, hashes)
+                     if not only_missing or row.get(SOURCE_HASH_COLUMN) != row_hash]
+
+            failed = []
+            updates = []
+            try:
+                vectors = plan.vectors([row for row, _ in stale])
+            except Exception as e:
+                # e.g. the embeddings endpoint is down; nothing on this page is written
+                failed = [(row["uid"], f"Embeddings: {e}") for row, _ in stale]
+                vectors = []
+            for (row, row_hash), record_vectors in zip(stale, vectors):
+                missing = [column for column in plan.expected(row) if record_vectors.get(column) is None]
+                if missing:
+                    failed.append((row["uid"], f"No vector for {', '.join(missing)}"))
+                    continue
+                values = {f"{name}{NEXT_SUFFIX}": value
+                          for name, value in plan.target.encode_embeddings(record_vectors).items()}
+                updates.append((row["uid"], {**values, SOURCE_HASH_COLUMN: row_hash}))
+
+            errors = executor.map(lambda update: _update(supabase_client, *update), updates)
+            failed.extend((uid, error) for (uid, _), error in zip(updates, errors) if error)
+            yield {"rows": len(rows), "skipped": len(rows) - len(stale), "updated": len(stale) - len(failed),
+                   "failed": failed, "last_uid": rows[-1]["uid"]}
+
+
+def unmigrated_rows(supabase_client, target, source=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    uids whose new columns are missing, failed or older than the row's
+    current values. The swap is only safe once this is empty.
+    """
+    plan = _Plan(target, source)
+    return [row["uid"] for rows in _pages(supabase_client, [*plan.columns, SOURCE_HASH_COLUMN], page_size)
+            for row in rows if row.get(SOURCE_HASH_COLUMN) != plan.source_hash(row)]
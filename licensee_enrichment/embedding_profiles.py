@@ -0,0 +1,174 @@
+"""
+Embedding profiles: which model embeds the summary texts, and how the
+vectors are stored in the licensees table.
+
+A profile names the embeddings model, an optional reduced dimensions value
+(the text-embedding-3 models can return shorter vectors, still normalized)
+and the storage format of each embedding column:
+
+    float32  pgvector vector(n), the full vectors as the API returns them
+    float16  pgvector halfvec(n), half the size, sent as short decimal text
+    int8     bytea of n signed bytes, with the vector's scale factor in a
+             real {column}_scale column (value = byte * scale)
+
+The apps and the command line use the profile named by the EMBEDDING_PROFILE
+environment variable, or ada-002 - the original 1536-dim float32 vectors -
+when it is unset. A table is moved from one profile to another with
+embedding_migration.py.
+"""
+import json
+import os
+
+import numpy as np
+
+DEFAULT_EMBEDDING_PROFILE = "ada-002"
+
+# Environment variable naming the profile used when none is given
+PROFILE_ENV_VAR = "EMBEDDING_PROFILE"
+
+# Vector length each model returns when no dimensions are requested
+MODEL_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072
+}
+
+STORAGE_FORMATS = ("float32", "float16", "int8")
+
+# Largest magnitude of an int8 component; -128 is left unused so the range is symmetric
+INT8_MAX = 127
+
+
+def quantize_int8(vector):
+    """
+    Scale a vector so its largest component is +-127 and round it to int8.
+    Returns (values, scale); values * scale approximates the vector.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    peak = float(np.abs(vector).max()) if vector.size else 0.0
+    scale = peak / INT8_MAX if peak else 1.0
+    values = np.clip(np.rint(vector / scale), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return values, scale
+
+
+def dequantize_int8(values, scale):
+    return np.asarray(values, dtype=np.int8).astype(np.float32) * np.float32(scale)
+
+
+class EmbeddingProfile:
+    """
+    An embeddings model, its requested dimensions and the storage format of the vectors
+    """
+
+    def __init__(self, name, model, dimensions=None, storage="float32"):
+        if storage not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown embedding storage {storage!r}; expected one of {', '.join(STORAGE_FORMATS)}")
+        self.name = name
+        self.model = model
+        self.dimensions = dimensions
+        self.storage = storage
+
+    def __repr__(self):
+        return f"EmbeddingProfile({self.name!r})"
+
+    @property
+    def size(self):
+        """
+        Length of the vectors
+        """
+        return self.dimensions or MODEL_DIMENSIONS[self.model]
+
+    def column_types(self, column):
+        """
+        The table columns an embedding column is stored in, with their Postgres types
+        """
+        if self.storage == "int8":
+            return {column: "bytea", f"{column}_scale": "real"}
+        return {column: f"vector({self.size})" if self.storage == "float32" else f"halfvec({self.size})"}
+
+    @property
+    def bytes_per_vector(self):
+        """
+        Stored size of one vector, including its scale factor
+        """
+        return {"float32": 4 * self.size, "float16": 2 * self.size, "int8": self.size + 4}[self.storage]
+
+    def same_vectors(self, other):
+        """
+        True if both profiles embed with the same model and dimensions, so
+        vectors can be converted between them without calling the API
+        """
+        return self.model == other.model and self.size == other.size
+
+    def encode(self, column, vector):
+        """
+        The column values storing vector (None when it is missing) under column
+        """
+        if vector is None:
+            return dict.fromkeys(self.column_types(column))
+        if self.storage == "float32":
+            # Sent as the API returned it, as before profiles existed
+            return {column: vector if isinstance(vector, list) else np.asarray(vector, dtype=np.float32).tolist()}
+        if self.storage == "float16":
+            # pgvector parses the text form; half precision needs only a few digits per component
+            return {column: "[" + ",".join(str(value) for value in np.asarray(vector, dtype=np.float16)) + "]"}
+        values, scale = quantize_int8(vector)
+        # PostgREST takes bytea as hex text
+        return {column: "\\x" + values.tobytes().hex(), f"{column}_scale": scale}
+
+    def encode_embeddings(self, embeddings):
+        """
+        Record columns for a dict of embedding column -> vector
+        """
+        record = {}
+        for column, vector in embeddings.items():
+            record.update(self.encode(column, vector))
+        return record
+
+    def decode(self, value, scale=None):
+        """
+        A stored value (as written by encode or read back through PostgREST)
+        as a float32 array, or None
+        """
+        if value is None:
+            return None
+        if self.storage == "int8":
+            if isinstance(value, str):
+                value = bytes.fromhex(value[2:] if value.startswith("\\x") else value)
+            return dequantize_int8(np.frombuffer(value, dtype=np.int8), 1.0 if scale is None else scale)
+        if isinstance(value, str):
+            # pgvector columns come back from PostgREST as "[0.1,0.2,...]"
+            value = json.loads(value)
+        return np.asarray(value, dtype=np.float32)
+
+    def decode_record(self, record, column):
+        """
+        The vector stored under column in a record read from the table
+        """
+        return self.decode(record.get(column), record.get(f"{column}_scale"))
+
+
+EMBEDDING_PROFILES = {profile.name: profile for profile in (
+    EmbeddingProfile("ada-002", "text-embedding-ada-002"),
+    EmbeddingProfile("ada-002-float16", "text-embedding-ada-002", storage="float16"),
+    EmbeddingProfile("ada-002-int8", "text-embedding-ada-002", storage="int8"),
+    EmbeddingProfile("3-small", "text-embedding-3-small"),
+    EmbeddingProfile("3-small-512", "text-embedding-3-small", dimensions=512),
+    EmbeddingProfile("3-small-512-float16", "text-embedding-3-small", dimensions=512, storage="float16"),
+    EmbeddingProfile("3-small-512-int8", "text-embedding-3-small", dimensions=512, storage="int8"),
+    EmbeddingProfile("3-small-256-int8", "text-embedding-3-small", dimensions=256, storage="int8")
+)}
+
+
+def get_embedding_profile(profile=None):
+    """
+    Resolve a profile given as an EmbeddingProfile, a name from
+    EMBEDDING_PROFILES or None (the EMBEDDING_PROFILE environment variable,
+    else the default)
+    """
+    if isinstance(profile, EmbeddingProfile):
+        return profile
+    name = profile or os.environ.get(PROFILE_ENV_VAR) or DEFAULT_EMBEDDING_PROFILE
+    if name not in EMBEDDING_PROFILES:
+        raise ValueError(f"Unknown embedding profile {name!r}; expected one of {', '.join(EMBEDDING_PROFILES)}")
+    return EMBEDDING_PROFILES[name]
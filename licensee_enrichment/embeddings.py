@@ -0,0 +1,138 @@
+"""
+Embedding stage for the licensee enrichment pipeline.
+
+The embeddings endpoint accepts a list of inputs, so all of a record's summary
+fields go out in one request, and in batch mode the embed stage sends the
+texts of a whole batch of records together (embed_fields_many). Texts already
+in the on-disk embedding cache are never sent again.
+
+Which model embeds the texts, at how many dimensions, and how the vectors are
+stored is set by an embedding profile (see embedding_profiles.py).
+"""
+import functools
+
+import openai
+
+from .rate_limiter import get_shared_limiter, estimate_tokens
+from .embedding_cache import get_shared_cache
+from .usage import record_usage
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Request limits of the embeddings endpoint
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300000
+
+
+def pack_requests(texts, max_inputs=MAX_INPUTS_PER_REQUEST, max_tokens=MAX_TOKENS_PER_REQUEST):
+    """
+    Split texts into groups of indexes that each fit in one embeddings request
+    """
+    group = []
+    group_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if group and (len(group) >= max_inputs or group_tokens + tokens > max_tokens):
+            yield group
+            group = []
+            group_tokens = 0
+        group.append(index)
+        group_tokens += tokens
+    if group:
+        yield group
+
+
+def cache_model(model, dimensions=None):
+    """
+    The model name vectors are cached under; shortened vectors are kept apart from full-length ones
+    """
+    return f"{model}@{dimensions}" if dimensions else model
+
+
+def embed_texts(texts, model=EMBEDDING_MODEL, limiter=None, cache=None, client=None, dimensions=None):
+    """
+    Embed a list of texts with as few requests as the endpoint limits allow.
+    Cached vectors are reused and only unseen texts are sent to OpenAI.
+    dimensions asks a text-embedding-3 model for shorter vectors.
+    Returns one vector per text, in order; blank texts get None and are not sent.
+    """
+    client = client or openai
+    limiter = limiter or get_shared_limiter()
+    cache = cache or get_shared_cache()
+    cached_as = cache_model(model, dimensions)
+    options = {"dimensions": dimensions} if dimensions else {}
+    vectors = [None] * len(texts)
+
+    # Only look up non-empty texts
+    indexes = [i for i, text in enumerate(texts) if text and text.strip()]
+    cached = cache.get_many(cached_as, [texts[i] for i in indexes])
+
+    # Send each distinct uncached text once
+    inputs = []
+    positions = {}
+    for i in indexes:
+        text = texts[i]
+        if text in cached:
+            vectors[i] = cached[text]
+            continue
+        if text not in positions:
+            positions[text] = []
+            inputs.append(text)
+        positions[text].append(i)
+
+    for group in pack_requests(inputs):
+        batch = [inputs[i] for i in group]
+        response = limiter.call(
+            client.embeddings.with_raw_response.create,
+            estimated_tokens=sum(estimate_tokens(text) for text in batch),
+            model=model,
+            input=batch,
+            **options
+        )
+        record_usage(model, response.usage, embedding=True)
+        # Map each returned vector back to every position of its text
+        fetched = []
+        for item in response.data:
+            text = batch[item.index]
+            fetched.append((text, item.embedding))
+            for i in positions[text]:
+                vectors[i] = item.embedding
+        cache.put_many(cached_as, fetched)
+
+    return vectors
+
+
+def embed_fields(text_fields, embed_fn=None, client=None):
+    """
+    Embed a record's (field_name, text) pairs in one call to embed_fn
+    (embed_texts with the given OpenAI client by default).
+    Returns a dict of {field_name}_embedding -> vector (None if the text is empty).
+    """
+    return embed_fields_many([text_fields], embed_fn, client)[0]
+
+
+def profile_embed_fn(profile, client=None):
+    """
+    embed_texts with the model and dimensions of an embedding profile
+    """
+    return functools.partial(embed_texts, model=profile.model, dimensions=profile.dimensions, client=client)
+
+
+def embed_fields_many(records_text_fields, embed_fn=None, client=None):
+    """
+    embed_fields for several records with a single call to embed_fn.
+    Returns one {field_name}_embedding -> vector dict per record. A failed
+    request raises, so no record is ever stored without its embeddings.
+    """
+    embed_fn = embed_fn or functools.partial(embed_texts, client=client)
+    texts = [text for text_fields in records_text_fields for _, text in text_fields]
+    vectors = embed_fn(texts)
+
+    # Hand each record back its own slice of vectors
+    results = []
+    position = 0
+    for text_fields in records_text_fields:
+        names = [f"{field_name}_embedding" for field_name, _ in text_fields]
+        results.append(dict(zip(names, vectors[position:position + len(names)])))
+        position += len(names)
+    return results
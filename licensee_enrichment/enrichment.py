@@ -0,0 +1,457 @@
+"""
+Brand enrichment stage: builds the GPT-4o prompt, calls the model with a JSON
+schema as the response format and validates the returned object into the raw
+enrichment map.
+
+The prompts are registered templates (see prompts.py) whose instructions
+form a fixed prefix shared by every brand, with the brand's website and name
+at the end, so OpenAI's prompt caching serves most of each prompt from cache.
+
+Several brands can also be packed into one request (enrich_brands), which
+pays for the instructions once per pack instead of once per brand. The model
+answers with a "brands" array of one object per uid; brands it leaves out
+or that can't be parsed, or every brand of a packed request that fails, are
+enriched on their own.
+
+Any field the model leaves out or empty (or loses when the response is cut
+off at max_tokens) is asked for again in one short follow-up request that
+covers only the missing fields, instead of re-running the whole prompt.
+
+Parsed results are cached per normalized domain, brand name, prompt version
+and model, so re-processing an unchanged licensee skips the chat completion.
+A result with no usable fields (empty or all N/A) is never cached, and the
+row it belongs to is failed rather than stored.
+"""
+import json
+import re
+
+import openai
+
+from .rate_limiter import get_shared_limiter, estimate_tokens
+from .category_matcher import LICENSING_CATEGORIES
+from .clients import DEFAULT_TIMEOUT
+from .enrichment_cache import get_shared_enrichment_cache
+from .prompts import PromptTemplate, register_prompt, get_prompt
+from .telemetry import note_error
+from .usage import BudgetExceeded, record_usage, reserving
+
+ENRICHMENT_MODEL = "gpt-4o"
+ENRICHMENT_MAX_TOKENS = 500
+
+# Most brands packed into one request; each adds ENRICHMENT_MAX_TOKENS to its max_tokens
+MAX_PACK_SIZE = 10
+
+# A packed answer is generated brand by brand, so its request is given this many seconds per brand
+PACKED_SECONDS_PER_BRAND = 15.0
+
+# Tokens allowed per field in a follow-up request for missing fields
+REASK_TOKENS_PER_FIELD = 120
+
+# Answers the model gives for a field it knows nothing about
+PLACEHOLDER_VALUES = frozenset({"n/a", "na", "none", "unknown", "not available", "not applicable", "-"})
+
+# Outcome message of a row whose enrichment came back with nothing to store
+EMPTY_ENRICHMENT_ERROR = "Enrichment returned no usable fields"
+
+# The fields of the raw enrichment map, with the instruction for each
+ENRICHMENT_FIELDS = {
+    "business_category": "What type of business are they in? (e.g., Fashion, Sportswear, Consumer Goods, Tech)",
+    "age_group": "Classify their main buyer by age range (e.g., 18–25, 25–35, etc.)",
+    "audience_description": "Describe the brand's audience and its most ravenous buyers in one sentence",
+    "industry_classification": "NAICS or SIC-style classification (write the industry name, not the number)",
+    "popular_products_or_services": "List the top two most purchased or known-for products/services",
+    "price_positioning": "Budget, Mid-Tier, Premium, or Luxury",
+    "brand_affinity_competitors": "Who is their biggest competitor or most similar brand?",
+    "retail_distribution_channels": "List the top retail or distribution channels (e.g., Amazon, Walmart, DTC)",
+    "countries_distributed": "Choose the top 3 countries they sell into from this list ONLY: USA, Canada, China, Mexico, United Kingdom, France, Germany, Taiwan",
+    "primary_licensing_category": "From their product types, what is the single strongest licensing category (1 only)?",
+    "secondary_licensing_category": "From their product types, what is the next most relevant licensing category (1 only)?",
+    "known_licensing_agreements": "Name up to 3 known licensing agreements the brand has been involved in — where the brand either (1) licensed its name to another company to create products, or (2) licensed another brand/IP to put onto their own products. These must be real brand-to-brand licensing agreements and should only include products that were actually sold.",
+    "product_summary_text": "Write one paragraph summarizing the types of products they are known for and where they are being sold most effectively. This will be used to match categories."
+}
+
+
+def _field_lines(fields):
+    return "\n".join(f"{name}: {ENRICHMENT_FIELDS[name]}" for name in fields)
+
+
+# The analysis asked of every brand, shared by the single and packed prompts
+_ANALYSIS_INSTRUCTIONS = """TASK 1: ANALYZE COMPANY INFORMATION
+First, provide a detailed analysis of the brand based on the website and your knowledge.
+
+TASK 2: DETERMINE HEADQUARTERS LOCATION
+Based on the website domain, your knowledge of the brand, and any context clues, determine the most likely headquarters location for this company. If the headquarters location is not specified in the input, you must make your best educated guess. Consider:
+- Domain TLD (.com, .co.uk, etc.)
+- Company history
+- Known locations of similar brands
+- Industry trends
+
+IMPORTANT: DO NOT return an error message. Instead, use your training knowledge about this website and brand. You have been trained on vast amounts of internet data up until your knowledge cutoff, so use that knowledge to analyze this brand rather than trying to access the live website.
+
+You MUST provide substantive answers for all fields based on your prior knowledge, even if you cannot currently browse the website. If it's a known brand or website, provide detailed information from your training. If it's completely unknown, provide reasonable guesses based on the domain name, brand name, and any other contextual clues.
+
+For primary_licensing_category and secondary_licensing_category, answer with categories from this list of licensing categories:
+""" + ", ".join(LICENSING_CATEGORIES)
+
+# Everything the same for every brand, sent first so it is served from the prompt cache
+ENRICHMENT_INSTRUCTIONS = """You are analyzing a brand based on its official website. Prioritize extracting insights from the website before relying on the brand name. The brand's website and name are given in the user message.
+
+""" + _ANALYSIS_INSTRUCTIONS + """
+
+Based on this information, return a JSON object with the following keys, each a string answering the instruction after it. Do not skip any fields. Do not add commentary.
+
+""" + _field_lines(ENRICHMENT_FIELDS)
+
+PACKED_INSTRUCTIONS = """You are analyzing several brands, each based on its official website. Prioritize extracting insights from the website before relying on the brand name. Each brand's uid, website and name are given in the user message. Analyze every brand on its own.
+
+""" + _ANALYSIS_INSTRUCTIONS + """
+
+Based on this information, return a JSON object whose "brands" array has one object for every brand in the user message, holding the brand's uid and the following keys, each a string answering the instruction after it. Do not skip any brands or fields. Do not add commentary.
+
+""" + _field_lines(ENRICHMENT_FIELDS)
+
+ENRICHMENT_PROMPT = register_prompt(PromptTemplate(
+    "enrichment", "2",
+    system=ENRICHMENT_INSTRUCTIONS,
+    user="Brand website: {website}\nBrand name: {brand_name}"
+))
+
+PACKED_PROMPT = register_prompt(PromptTemplate(
+    "enrichment-packed", "1",
+    system=PACKED_INSTRUCTIONS,
+    user="{brands}"
+))
+
+REASK_PROMPT = register_prompt(PromptTemplate(
+    "enrichment-reask", "2",
+    system="You are analyzing a brand. Use your training knowledge of the brand; if it is unknown, make reasonable "
+           "guesses from the domain and brand name. Do not return an error message. Return a JSON object with only "
+           "the keys listed in the user message, each a string answering the instruction after it.",
+    user="Brand website: {website}\nBrand name: {brand_name}\n\n{fields}"
+))
+
+# Identifies the current enrichment prompt in cache keys, so results from an older prompt are not reused.
+# Packed requests ask the same questions, so their results are cached under it too.
+PROMPT_VERSION = get_prompt("enrichment").version_id
+
+# A complete "key": "string" pair, for salvaging fields from a truncated response
+_COMPLETE_PAIR = re.compile(r'"([a-z_]+)"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def enrichment_schema(fields):
+    """
+    Strict JSON schema response format requiring every one of fields as a string
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "licensee_enrichment",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {name: {"type": "string"} for name in fields},
+                "required": list(fields),
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def packed_schema(fields):
+    """
+    Strict JSON schema response format for a "brands" array of objects holding a uid and every one of fields
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "licensee_enrichment_packed",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "brands": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"uid": {"type": "string"}, **{name: {"type": "string"} for name in fields}},
+                            "required": ["uid", *fields],
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["brands"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def enrichment_request(website, brand_name):
+    """
+    Chat completion arguments for enriching one brand
+    """
+    prompt = get_prompt("enrichment")
+    return {
+        "model": ENRICHMENT_MODEL,
+        "messages": prompt.messages(website=website, brand_name=brand_name),
+        "temperature": 0.7,
+        "max_tokens": ENRICHMENT_MAX_TOKENS,
+        "response_format": enrichment_schema(ENRICHMENT_FIELDS),
+        # Requests sharing a key are routed together, which keeps the prefix cache warm
+        "prompt_cache_key": prompt.version_id
+    }
+
+
+def packed_enrichment_request(brands):
+    """
+    Chat completion arguments for enriching several brands, a list of (uid, website, brand_name), in one request
+    """
+    prompt = get_prompt("enrichment-packed")
+    brand_lines = "\n\n".join(f"uid: {uid}\nBrand website: {website}\nBrand name: {brand_name}"
+                               for uid, website, brand_name in brands)
+    return {
+        "model": ENRICHMENT_MODEL,
+        "messages": prompt.messages(brands=brand_lines),
+        "temperature": 0.7,
+        "max_tokens": ENRICHMENT_MAX_TOKENS * len(brands),
+        "response_format": packed_schema(ENRICHMENT_FIELDS),
+        "prompt_cache_key": prompt.version_id,
+        # Sent as the request's timeout rather than in its body
+        "timeout": max(DEFAULT_TIMEOUT, PACKED_SECONDS_PER_BRAND * len(brands))
+    }
+
+
+def reask_request(website, brand_name, fields):
+    """
+    Chat completion arguments asking only for the given missing fields
+    """
+    prompt = get_prompt("enrichment-reask")
+    return {
+        "model": ENRICHMENT_MODEL,
+        "messages": prompt.messages(website=website, brand_name=brand_name, fields=_field_lines(fields)),
+        "temperature": 0.7,
+        "max_tokens": REASK_TOKENS_PER_FIELD * len(fields),
+        "response_format": enrichment_schema(fields),
+        "prompt_cache_key": prompt.version_id
+    }
+
+
+def prompt_tokens(request):
+    """
+    Estimated prompt tokens of a chat request
+    """
+    return sum(estimate_tokens(message["content"]) for message in request["messages"])
+
+
+def parse_enrichment_output(raw_text, fields=ENRICHMENT_FIELDS):
+    """
+    Validate the model's JSON object into a raw map of the non-empty string
+    fields. A response cut off mid-object keeps the fields that were complete.
+    """
+    raw_text = (raw_text or "").strip()
+    try:
+        parsed = json.loads(raw_text)
+    except ValueError:
+        # Truncated at max_tokens - keep every complete "key": "value" pair
+        parsed = {key: json.loads(value) for key, value in _COMPLETE_PAIR.findall(raw_text)}
+    return _raw_map(parsed, fields)
+
+
+def _raw_map(parsed, fields):
+    if not isinstance(parsed, dict):
+        return {}
+
+    raw_map = {}
+    for name in fields:
+        value = parsed.get(name)
+        if isinstance(value, str) and value.strip():
+            raw_map[name] = value.strip()
+    return raw_map
+
+
+def _complete_brands(raw_text):
+    """
+    The brand objects that were complete before a packed response was cut off
+    """
+    start = raw_text.find("[", raw_text.find('"brands"'))
+    if start < 0:
+        return []
+    decoder = json.JSONDecoder()
+    brands = []
+    position = start + 1
+    while True:
+        while position < len(raw_text) and raw_text[position] in " \t\r\n,":
+            position += 1
+        try:
+            brand, position = decoder.raw_decode(raw_text, position)
+        except ValueError:
+            return brands
+        brands.append(brand)
+
+
+def parse_packed_output(raw_text, uids, fields=ENRICHMENT_FIELDS):
+    """
+    Map each of uids to the raw map of its object in a packed response.
+    Brands the response left out, answered with no usable fields or lost
+    when it was cut off are missing from the result.
+    """
+    raw_text = (raw_text or "").strip()
+    try:
+        parsed = json.loads(raw_text)
+        brands = parsed.get("brands") if isinstance(parsed, dict) else None
+    except ValueError:
+        brands = _complete_brands(raw_text)
+    if not isinstance(brands, list):
+        return {}
+
+    wanted = {str(uid) for uid in uids}
+    raw_maps = {}
+    for brand in brands:
+        uid = str(brand.get("uid", "")).strip() if isinstance(brand, dict) else ""
+        # The first answer for a uid wins; unknown uids are ignored
+        if uid in wanted and uid not in raw_maps:
+            raw_map = _raw_map(brand, fields)
+            if raw_map:
+                raw_maps[uid] = raw_map
+    return raw_maps
+
+
+def missing_fields(raw_map):
+    """
+    Enrichment fields the raw map has no value for
+    """
+    return [name for name in ENRICHMENT_FIELDS if not raw_map.get(name)]
+
+
+def usable_enrichment(raw_map):
+    """
+    Whether raw_map has at least one field with a real value rather than a
+    placeholder like N/A. Only usable results are cached or stored, so a row
+    enriched with nothing is retried by the next incremental run.
+    """
+    values = [(raw_map or {}).get(name) for name in ENRICHMENT_FIELDS]
+    return any(value.strip().lower() not in PLACEHOLDER_VALUES for value in values if value)
+
+
+def _complete(request, limiter, client):
+    estimated_prompt_tokens = prompt_tokens(request)
+    # Held against the run's budget at its worst case until the actual usage is known
+    with reserving(request["model"], estimated_prompt_tokens, request["max_tokens"]):
+        response = limiter.call(
+            client.chat.completions.with_raw_response.create,
+            estimated_tokens=estimated_prompt_tokens + request["max_tokens"],
+            **request
+        )
+        record_usage(request["model"], response.usage)
+    return response.choices[0].message.content
+
+
+def request_enrichment(website, brand_name, client=None, limiter=None):
+    """
+    Ask the model to enrich one brand and return the parsed raw map.
+    Fields missing from the answer are asked for once more in a short
+    follow-up request. client is an OpenAI client; defaults to the
+    module-level openai client.
+    """
+    client = client or openai
+    limiter = limiter or get_shared_limiter()
+
+    raw_map = parse_enrichment_output(_complete(enrichment_request(website, brand_name), limiter, client))
+    return complete_missing_fields(website, brand_name, raw_map, client, limiter)
+
+
+def complete_missing_fields(website, brand_name, raw_map, client=None, limiter=None):
+    """
+    Fill the fields missing from raw_map with one follow-up request for just those fields
+    """
+    missing = missing_fields(raw_map)
+    # Nothing usable came back at all - leave it to the caller rather than re-asking for everything
+    if not missing or len(missing) == len(ENRICHMENT_FIELDS):
+        return raw_map
+
+    client = client or openai
+    limiter = limiter or get_shared_limiter()
+    try:
+        content = _complete(reask_request(website, brand_name, missing), limiter, client)
+    except (openai.OpenAIError, BudgetExceeded) as e:
+        # Keep the fields already paid for
+        print(f"Error requesting missing fields {', '.join(missing)}: {e}")
+        note_error(f"Missing fields re-ask: {e}")
+        return raw_map
+    return {**raw_map, **parse_enrichment_output(content, missing)}
+
+
+def enrich_brand(website, brand_name, force_refresh=False, client=None, cache=None, limiter=None):
+    """
+    Return (raw_map, cached) for a brand, using the enrichment cache unless
+    force_refresh is set. Fresh results are written back to the cache.
+    """
+    cache = cache or get_shared_enrichment_cache()
+
+    if not force_refresh:
+        raw_map = cache.get(website, brand_name, PROMPT_VERSION, ENRICHMENT_MODEL)
+        if raw_map is not None and usable_enrichment(raw_map):
+            return raw_map, True
+
+    raw_map = request_enrichment(website, brand_name, client, limiter)
+
+    # Don't cache empty, all-N/A or unparseable responses
+    if usable_enrichment(raw_map):
+        cache.put(website, brand_name, PROMPT_VERSION, ENRICHMENT_MODEL, raw_map)
+
+    return raw_map, False
+
+
+def enrich_brands(brands, force_refresh=False, client=None, cache=None, limiter=None):
+    """
+    Return a (raw_map, cached, error) triple for each of brands, a list of
+    (uid, website, brand_name). Brands not in the enrichment cache (all of
+    them if force_refresh is set) are enriched together in one packed
+    request. Any the packed response leaves out or garbles, or all of them
+    if the packed request fails, get a request of their own, and ones
+    missing only some fields get the usual follow-up for those. error is the
+    exception that stopped a brand from being enriched (a BudgetExceeded
+    included), so one brand's failure never fails the others.
+    """
+    cache = cache or get_shared_enrichment_cache()
+    client = client or openai
+    limiter = limiter or get_shared_limiter()
+
+    results = [None] * len(brands)
+    pending = []
+    for index, (uid, website, brand_name) in enumerate(brands):
+        raw_map = None if force_refresh else cache.get(website, brand_name, PROMPT_VERSION, ENRICHMENT_MODEL)
+        if raw_map is not None and usable_enrichment(raw_map):
+            results[index] = (raw_map, True, None)
+        else:
+            pending.append(index)
+
+    packed = {}
+    if len(pending) > 1:
+        try:
+            content = _complete(packed_enrichment_request([brands[index] for index in pending]), limiter, client)
+            packed = parse_packed_output(content, [brands[index][0] for index in pending])
+        except (openai.OpenAIError, BudgetExceeded) as e:
+            # A timeout or server error loses the whole pack; single requests are smaller and reserve less
+            print(f"Packed enrichment of {len(pending)} brands failed, enriching them one by one: {e}")
+            note_error(f"Packed enrichment: {e}")
+
+    for index in pending:
+        uid, website, brand_name = brands[index]
+        raw_map = packed.get(str(uid))
+        try:
+            if raw_map:
+                raw_map = complete_missing_fields(website, brand_name, raw_map, client, limiter)
+            else:
+                # Missing from the packed answer (or the only brand to enrich) - ask for it on its own
+                raw_map = request_enrichment(website, brand_name, client, limiter)
+        except Exception as e:
+            results[index] = (None, False, e)
+            continue
+
+        # Don't cache empty, all-N/A or unparseable responses
+        if usable_enrichment(raw_map):
+            cache.put(website, brand_name, PROMPT_VERSION, ENRICHMENT_MODEL, raw_map)
+        results[index] = (raw_map, False, None)
+
+    return results
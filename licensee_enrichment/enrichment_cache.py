@@ -0,0 +1,157 @@
+"""
+Cache of parsed GPT-4o enrichment results.
+
+Entries are keyed by the normalized website domain, the normalized brand name,
+the prompt version and the model, so a re-uploaded CSV or a re-processed UID
+reuses the earlier raw_map instead of paying for another chat completion.
+Entries expire after a TTL and can be invalidated by domain or cleared.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "enrichment.sqlite3")
+
+# Enrichment answers change slowly; refresh them monthly
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+
+
+def normalize_domain(website):
+    """
+    Reduce a website to its bare domain: "https://WWW.Example.com/shop" -> "example.com"
+    """
+    website = (website or "").strip().lower()
+    if "://" not in website:
+        website = "//" + website
+    host = urlsplit(website).hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    return host.rstrip(".")
+
+
+def normalize_brand(brand_name):
+    """
+    Case- and whitespace-insensitive brand name
+    """
+    return " ".join(str(brand_name or "").split()).casefold()
+
+
+def cache_key(website, brand_name, prompt_version, model):
+    parts = [normalize_domain(website), normalize_brand(brand_name), prompt_version, model]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class EnrichmentCache:
+    """
+    Thread-safe SQLite store of parsed enrichment maps with a TTL
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # A cache can afford to lose its last writes on power loss; skip the fsync on every commit
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS enrichments (
+                cache_key TEXT PRIMARY KEY,
+                domain TEXT NOT NULL,
+                brand_name TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                model TEXT NOT NULL,
+                raw_map TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS enrichments_domain ON enrichments (domain)")
+        self.conn.commit()
+
+    def get(self, website, brand_name, prompt_version, model):
+        """
+        Return the cached raw_map, or None if missing or older than the TTL
+        """
+        key = cache_key(website, brand_name, prompt_version, model)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT raw_map, created_at FROM enrichments WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, website, brand_name, prompt_version, model, raw_map):
+        key = cache_key(website, brand_name, prompt_version, model)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO enrichments "
+                "(cache_key, domain, brand_name, prompt_version, model, raw_map, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_domain(website), normalize_brand(brand_name),
+                 prompt_version, model, json.dumps(raw_map), time.time())
+            )
+            self.conn.commit()
+
+    def invalidate(self, website, brand_name=None):
+        """
+        Drop cached results for a website's domain (optionally only for one brand).
+        Returns the number of entries removed.
+        """
+        query = "DELETE FROM enrichments WHERE domain = ?"
+        params = [normalize_domain(website)]
+        if brand_name is not None:
+            query += " AND brand_name = ?"
+            params.append(normalize_brand(brand_name))
+        with self.lock:
+            removed = self.conn.execute(query, params).rowcount
+            self.conn.commit()
+        return removed
+
+    def clear(self, expired_only=False):
+        """
+        Remove every entry, or only the ones past the TTL. Returns the number removed.
+        """
+        with self.lock:
+            if expired_only:
+                removed = self.conn.execute(
+                    "DELETE FROM enrichments WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+                ).rowcount
+            else:
+                removed = self.conn.execute("DELETE FROM enrichments").rowcount
+            self.conn.commit()
+        return removed
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM enrichments").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+# One cache per process, shared by every session and worker
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_enrichment_cache():
+    """
+    Return the process-wide EnrichmentCache, creating it on first use
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EnrichmentCache()
+        return _shared_cache
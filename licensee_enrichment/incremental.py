@@ -0,0 +1,86 @@
+"""
+Incremental re-enrichment support.
+
+Every licensee record stores a hash of the input fields it was enriched from.
+During an incremental batch the stored hashes are fetched for the incoming
+uids in chunks, and rows whose inputs still hash the same are skipped instead
+of being sent through the OpenAI stages again.
+"""
+import hashlib
+import itertools
+
+from .batch_runner import make_outcome
+from .supabase_writer import LICENSEES_TABLE
+
+# Input columns that determine a licensee's enrichment
+INPUT_HASH_FIELDS = ("brand_name", "website", "headquarters", "contact")
+
+# uids per projected select, keeping the PostgREST URL well under common length limits
+FETCH_CHUNK_SIZE = 500
+
+
+def _normalize(value):
+    # Empty CSV cells arrive as None or NaN
+    if value is None or value != value:
+        return ""
+    return " ".join(str(value).split())
+
+
+def input_hash(brand_name, website, headquarters, contact):
+    """
+    Content hash of a row's input fields
+    """
+    values = [_normalize(value) for value in (brand_name, website, headquarters, contact)]
+    return hashlib.sha256("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def row_input_hash(row):
+    return input_hash(*(row.get(field, "") for field in INPUT_HASH_FIELDS))
+
+
+def fetch_input_hashes(supabase, uids):
+    """
+    Fetch the stored input_hash for each uid, selecting only the two columns needed.
+    Returns a dict of str(uid) -> input_hash for the uids that have a record.
+    """
+    uids = sorted({str(uid) for uid in uids if _normalize(uid)})
+    stored = {}
+    for start in range(0, len(uids), FETCH_CHUNK_SIZE):
+        chunk = uids[start:start + FETCH_CHUNK_SIZE]
+        response = supabase.table(LICENSEES_TABLE).select("uid,input_hash").in_("uid", chunk).execute()
+        for record in response.data:
+            if record.get("input_hash"):
+                stored[str(record["uid"])] = record["input_hash"]
+    return stored
+
+
+def partition_unchanged(rows, stored_hashes):
+    """
+    Split rows into (rows to process, outcomes for rows skipped as unchanged)
+    """
+    changed = []
+    skipped = []
+    for row in rows:
+        uid = row.get("uid", "")
+        if stored_hashes.get(str(uid)) == row_input_hash(row):
+            skipped.append(make_outcome(uid, row.get("brand_name", ""), "Skipped - unchanged", False))
+        else:
+            changed.append(row)
+    return changed, skipped
+
+
+def skip_unchanged(rows, supabase, on_skip):
+    """
+    Stream rows through, dropping the unchanged ones. Stored hashes are fetched
+    one chunk of rows at a time, and on_skip(outcome) is called for each skipped row.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, FETCH_CHUNK_SIZE))
+        if not chunk:
+            return
+        stored_hashes = fetch_input_hashes(supabase, [row.get("uid", "") for row in chunk])
+        changed, skipped = partition_unchanged(chunk, stored_hashes)
+        for outcome in skipped:
+            on_skip(outcome)
+        yield from changed
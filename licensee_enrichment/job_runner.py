@@ -0,0 +1,212 @@
+"""
+Background execution of batch jobs.
+
+Batches run on a process-wide worker pool instead of inside a Streamlit
+script run, so closing the tab, clicking another widget or a session timeout
+no longer kills a batch partway through. The uploaded CSV is saved next to the
+job store and streamed from disk by the worker; progress and row outcomes are
+written to the JobStore for any session to poll.
+
+A stopped job can be resumed: its saved CSV is streamed again, rows that
+already succeeded or were skipped are left out, and the rest reuse whatever
+raw_map and embeddings their checkpoints hold. A job with a budget option
+pauses when it reaches that ceiling; each resumed run may spend up to the
+ceiling again.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .csv_stream import iter_csv_rows
+from .job_store import JobStore, RowCheckpoints
+from .pipeline import LicenseePipeline, BATCH_OPTIONS
+
+DEFAULT_UPLOAD_DIR = os.path.join(".cache", "jobs")
+
+# Batches that may run at the same time; later submissions wait in the queue
+MAX_RUNNING_JOBS = 2
+
+# Row outcomes are written to the job store in groups, at least this often
+RESULTS_FLUSH_SIZE = 50
+RESULTS_FLUSH_INTERVAL = 1.0
+
+
+def _until_cancelled(rows, cancel_event):
+    # Stop handing out rows once the job is cancelled; rows already in flight still finish
+    for row in rows:
+        if cancel_event.is_set():
+            return
+        yield row
+
+
+def _without_done(rows, done_uids):
+    for row in rows:
+        if str(row.get("uid", "")) not in done_uids:
+            yield row
+
+
+class _ResultBuffer:
+    """
+    Groups row outcomes into fewer job store writes. A background thread
+    also flushes every RESULTS_FLUSH_INTERVAL, so outcomes show up while
+    the next rows are still slow to finish.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.outcomes = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_periodically, name=f"results-{job_id}", daemon=True)
+        self.flusher.start()
+
+    def add(self, outcome):
+        with self.lock:
+            self.outcomes.append(outcome)
+            due = len(self.outcomes) >= RESULTS_FLUSH_SIZE
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            outcomes, self.outcomes = self.outcomes, []
+            self.last_flush = time.monotonic()
+        self.store.add_results(self.job_id, outcomes)
+
+    def close(self):
+        """
+        Stop the background flushes and write whatever is left
+        """
+        self.closed.set()
+        self.flusher.join()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self.closed.wait(RESULTS_FLUSH_INTERVAL):
+            if time.monotonic() - self.last_flush >= RESULTS_FLUSH_INTERVAL:
+                self.flush()
+
+
+class JobRunner:
+    """
+    Runs submitted batches on a worker pool that outlives any UI session
+    """
+
+    def __init__(self, store, max_jobs=MAX_RUNNING_JOBS, upload_dir=DEFAULT_UPLOAD_DIR):
+        self.store = store
+        self.upload_dir = upload_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="batch-job")
+        self.cancel_events = {}
+        self.lock = threading.Lock()
+        os.makedirs(upload_dir, exist_ok=True)
+
+        # Jobs left running by a process that has since stopped have no worker any more
+        store.mark_interrupted()
+
+    def submit(self, csv_bytes, total_rows, openai_client, supabase_client, source="", options=None):
+        """
+        Queue a batch and return its job id.
+        options are enrich_rows settings (see BATCH_OPTIONS), stored with the job.
+        """
+        options = dict(options or {})
+        job_id = self.store.create_job(source, total_rows, options)
+        with open(self._upload_path(job_id), "wb") as f:
+            f.write(csv_bytes)
+
+        self._start(job_id, openai_client, supabase_client, options)
+        return job_id
+
+    def resume(self, job_id, openai_client, supabase_client):
+        """
+        Requeue a failed, cancelled, interrupted or paused job to finish its remaining
+        rows. Returns False if the job can't be resumed.
+        """
+        job = self.store.get_job(job_id)
+        if job is None or not os.path.exists(self._upload_path(job_id)):
+            return False
+        done_uids = self.store.prepare_resume(job_id)
+        if done_uids is None:
+            return False
+        self._start(job_id, openai_client, supabase_client, job["options"], done_uids)
+        return True
+
+    def cancel(self, job_id):
+        """
+        Ask a job to stop. Rows already being processed finish and are recorded;
+        no new rows are started. Returns False if the job was no longer active.
+        """
+        if not self.store.request_cancel(job_id):
+            return False
+        with self.lock:
+            cancel_event = self.cancel_events.get(job_id)
+        if cancel_event is not None:
+            cancel_event.set()
+        return True
+
+    def _upload_path(self, job_id):
+        return os.path.join(self.upload_dir, f"{job_id}.csv")
+
+    def _start(self, job_id, openai_client, supabase_client, options, done_uids=frozenset()):
+        cancel_event = threading.Event()
+        with self.lock:
+            self.cancel_events[job_id] = cancel_event
+        self.executor.submit(self._run, job_id, openai_client, supabase_client, options, done_uids, cancel_event)
+
+    def _run(self, job_id, openai_client, supabase_client, options, done_uids, cancel_event):
+        if cancel_event.is_set():
+            self.store.set_status(job_id, "cancelled")
+            self._forget(job_id)
+            return
+
+        self.store.set_status(job_id, "running")
+        results = _ResultBuffer(self.store, job_id)
+        settings = {name: options[name] for name in BATCH_OPTIONS if name in options}
+        try:
+            with open(self._upload_path(job_id), "rb") as source:
+                rows = iter_csv_rows(source)
+                if done_uids:
+                    rows = _without_done(rows, done_uids)
+                rows = _until_cancelled(rows, cancel_event)
+
+                # Each row's progress is checkpointed so a resumed job can reuse it
+                incremental = settings.pop("incremental", False)
+                pipeline = LicenseePipeline(openai_client, supabase_client,
+                                            checkpoint=RowCheckpoints(self.store, job_id), **settings)
+                for outcome in pipeline.run(rows, incremental=incremental):
+                    results.add(outcome)
+
+            results.close()
+            if cancel_event.is_set():
+                self.store.set_status(job_id, "cancelled")
+            elif pipeline.paused:
+                self.store.set_status(job_id, "paused")
+            else:
+                self.store.set_status(job_id, "completed")
+        except Exception as e:
+            results.close()
+            self.store.set_status(job_id, "failed", error=str(e))
+        finally:
+            self._forget(job_id)
+
+    def _forget(self, job_id):
+        with self.lock:
+            self.cancel_events.pop(job_id, None)
+
+
+# One runner per process, shared by every session
+_shared_runner = None
+_shared_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """
+    Return the process-wide JobRunner, creating it (and its store) on first use
+    """
+    global _shared_runner
+    with _shared_runner_lock:
+        if _shared_runner is None:
+            _shared_runner = JobRunner(JobStore())
+        return _shared_runner
@@ -0,0 +1,403 @@
+"""
+SQLite store of background batch jobs and their per-row outcomes.
+
+A job is created when a batch is submitted and moves through
+queued -> running -> completed / failed / cancelled / paused (at its
+budget ceiling). Outcomes are appended as
+rows finish, so any session can poll a job's progress and results, including
+after the browser tab that submitted it has gone away.
+
+Every outcome carries the tokens and estimated cost of its row, and each
+job keeps running totals of them, so the cost of a batch is known while it
+runs.
+
+Each row also gets a checkpoint recording the last stage it reached
+(enriched, embedded, persisted) with its raw_map and embeddings, so an
+interrupted job can be resumed without paying for that work again.
+
+Several processes (Streamlit workers, CLI runs) may share a store. Each job
+records the process that queued it, and a starting process only marks a
+job interrupted once that owner is no longer running. Owners are checked by
+pid, which needs a POSIX system; on Windows jobs of other processes are left
+alone.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+
+from .batch_runner import outcome_kind
+from .usage import USAGE_FIELDS
+
+DEFAULT_JOBS_PATH = os.path.join(".cache", "jobs.sqlite3")
+
+# Jobs in these states still have (or are waiting for) a worker
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+# Jobs that were active when the process stopped are marked interrupted on startup.
+# A paused job stopped at its budget ceiling.
+FINISHED_STATUSES = ("completed", "failed", "cancelled", "interrupted", "paused")
+
+JOB_FIELDS = ["id", "status", "source", "total_rows", "options", "error",
+              "succeeded", "failed", "skipped", "created_at", "started_at", "finished_at", *USAGE_FIELDS]
+RESULT_FIELDS = ["uid", "brand_name", "status", "enriched", *USAGE_FIELDS]
+
+# Jobs that stopped early and can be resumed
+RESUMABLE_STATUSES = ("failed", "cancelled", "interrupted", "paused")
+
+# Token and cost columns of the jobs and job_results tables
+_USAGE_COLUMNS = {
+    "prompt_tokens": "INTEGER NOT NULL DEFAULT 0",
+    "cached_tokens": "INTEGER NOT NULL DEFAULT 0",
+    "completion_tokens": "INTEGER NOT NULL DEFAULT 0",
+    "embedding_tokens": "INTEGER NOT NULL DEFAULT 0",
+    "cost": "REAL NOT NULL DEFAULT 0"
+}
+
+# Row stages, in order; intermediate results are dropped once a row is persisted
+CHECKPOINT_STAGES = ("enriched", "embedded", "persisted")
+
+# Owner recorded on the jobs this process runs: its pid, and a token telling it apart from an
+# earlier process that had the same pid (e.g. before a container restart)
+PROCESS_OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+
+def owner_running(owner):
+    """
+    Whether the process that recorded owner is still running
+    """
+    pid, _, token = (owner or "").partition(":")
+    if not pid.isdigit() or not token:
+        return False
+    if int(pid) == os.getpid():
+        return owner == PROCESS_OWNER
+    if os.name == "nt":
+        # Signal 0 would terminate the process there; assume it is still running
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running under another user
+        return True
+    return True
+
+
+class JobStore:
+    """
+    Thread-safe SQLite store of jobs and their row outcomes
+    """
+
+    def __init__(self, path=DEFAULT_JOBS_PATH, owner=PROCESS_OWNER):
+        self.path = path
+        self.owner = owner
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Survives a process crash or container restart without syncing every checkpoint to disk
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                source TEXT NOT NULL,
+                total_rows INTEGER NOT NULL,
+                options TEXT NOT NULL,
+                error TEXT,
+                succeeded INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT
+            )"""
+        )
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS job_results (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                uid TEXT,
+                brand_name TEXT,
+                status TEXT NOT NULL,
+                enriched INTEGER NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )"""
+        )
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS job_checkpoints (
+                job_id TEXT NOT NULL,
+                uid TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                raw_map TEXT,
+                embedding_fields TEXT,
+                embeddings BLOB,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, uid)
+            )"""
+        )
+        # Stores created before usage was tracked lack the token and cost columns
+        for table in ("jobs", "job_results"):
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in _USAGE_COLUMNS.items():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        # Stores created before jobs had owners lack the owner column
+        if "owner" not in {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self.conn.commit()
+
+    def create_job(self, source, total_rows, options):
+        """
+        Record a new queued job and return its id
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, status, source, total_rows, options, created_at, owner) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, source, total_rows, json.dumps(options), time.time(), self.owner)
+            )
+            self.conn.commit()
+        return job_id
+
+    def get_job(self, job_id):
+        """
+        The job as a dict (options decoded, plus a processed count), or None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._job(row) if row else None
+
+    def list_jobs(self, limit=20):
+        """
+        The most recently created jobs, newest first
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def set_status(self, job_id, status, error=None):
+        """
+        Move a job to a new status, stamping its start or finish time
+        """
+        now = time.time()
+        with self.lock:
+            if status == "running":
+                self.conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (status, now, job_id)
+                )
+            elif status in FINISHED_STATUSES:
+                self.conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                    (status, error, now, job_id)
+                )
+            else:
+                self.conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+            self.conn.commit()
+
+    def request_cancel(self, job_id):
+        """
+        Flag an active job as cancelling. Returns False if it had already finished.
+        """
+        with self.lock:
+            updated = self.conn.execute(
+                "UPDATE jobs SET status = 'cancelling' WHERE id = ? AND status IN ('queued', 'running')",
+                (job_id,)
+            ).rowcount
+            self.conn.commit()
+        return updated > 0
+
+    def mark_interrupted(self):
+        """
+        Mark jobs left active by a process that is no longer running as
+        interrupted. Jobs still owned by a running process are left alone.
+        Returns the number of jobs marked.
+        """
+        placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+        with self.lock:
+            active = self.conn.execute(
+                f"SELECT id, owner FROM jobs WHERE status IN ({placeholders})", ACTIVE_STATUSES
+            ).fetchall()
+            orphaned = [job_id for job_id, owner in active if not owner_running(owner)]
+            now = time.time()
+            self.conn.executemany(
+                f"UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE id = ? AND status IN ({placeholders})",
+                [(now, job_id, *ACTIVE_STATUSES) for job_id in orphaned]
+            )
+            self.conn.commit()
+        return len(orphaned)
+
+    def add_results(self, job_id, outcomes):
+        """
+        Append row outcomes to a job and update its counts
+        """
+        if not outcomes:
+            return
+        kinds = [outcome_kind(outcome) for outcome in outcomes]
+        with self.lock:
+            start = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM job_results WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            self.conn.executemany(
+                f"INSERT INTO job_results (job_id, seq, uid, brand_name, status, enriched, {', '.join(USAGE_FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in range(6 + len(USAGE_FIELDS)))})",
+                [(job_id, start + i, str(outcome["uid"]), str(outcome["brand_name"]),
+                  outcome["status"], int(bool(outcome["enriched"])),
+                  *(outcome.get(name, 0) for name in USAGE_FIELDS))
+                 for i, outcome in enumerate(outcomes, start=1)]
+            )
+            # Job totals are kept separately so spend on rows retried after a resume still counts
+            self.conn.execute(
+                "UPDATE jobs SET succeeded = succeeded + ?, failed = failed + ?, skipped = skipped + ?, "
+                f"{', '.join(f'{name} = {name} + ?' for name in USAGE_FIELDS)} WHERE id = ?",
+                (kinds.count("succeeded"), kinds.count("failed"), kinds.count("skipped"),
+                 *(sum(outcome.get(name, 0) for outcome in outcomes) for name in USAGE_FIELDS), job_id)
+            )
+            # A succeeded row has been written to Supabase; its intermediate results are no longer needed
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO job_checkpoints (job_id, uid, stage, updated_at) "
+                "VALUES (?, ?, 'persisted', ?)",
+                [(job_id, str(outcome["uid"]), time.time())
+                 for outcome, kind in zip(outcomes, kinds) if kind == "succeeded"]
+            )
+            self.conn.commit()
+
+    def results(self, job_id, limit=None, latest=False):
+        """
+        Row outcomes for a job in the order they finished: all of them, the
+        first limit, or (with latest=True) the last limit
+        """
+        query = f"SELECT {', '.join(RESULT_FIELDS)} FROM job_results WHERE job_id = ? ORDER BY seq"
+        if latest:
+            query += " DESC"
+        params = [job_id]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        if latest:
+            rows.reverse()
+        return [dict(zip(RESULT_FIELDS, row[:3] + (bool(row[3]),) + row[4:])) for row in rows]
+
+    def prepare_resume(self, job_id):
+        """
+        Requeue a stopped job, dropping its failed outcomes so those rows are
+        retried. Returns the set of uids that are already done (succeeded or
+        skipped), or None if the job can't be resumed.
+        """
+        placeholders = ", ".join("?" for _ in RESUMABLE_STATUSES)
+        with self.lock:
+            updated = self.conn.execute(
+                f"UPDATE jobs SET status = 'queued', error = NULL, failed = 0, finished_at = NULL, owner = ? "
+                f"WHERE id = ? AND status IN ({placeholders})",
+                (self.owner, job_id, *RESUMABLE_STATUSES)
+            ).rowcount
+            if not updated:
+                return None
+            self.conn.execute(
+                "DELETE FROM job_results WHERE job_id = ? AND enriched = 0 AND status NOT LIKE 'Skipped%'",
+                (job_id,)
+            )
+            done = self.conn.execute("SELECT uid FROM job_results WHERE job_id = ?", (job_id,)).fetchall()
+            self.conn.commit()
+        return {row[0] for row in done}
+
+    def save_checkpoint(self, job_id, uid, stage, raw_map=None, embeddings=None):
+        """
+        Record the stage a row reached. raw_map and embeddings (a dict of
+        field name -> vector) are kept from earlier stages unless given.
+        """
+        fields = blob = None
+        if embeddings is not None:
+            fields = json.dumps(list(embeddings))
+            blob = b"".join(array("f", vector).tobytes() for vector in embeddings.values())
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO job_checkpoints (job_id, uid, stage, raw_map, embedding_fields, embeddings, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id, uid) DO UPDATE SET stage = excluded.stage, "
+                "raw_map = COALESCE(excluded.raw_map, raw_map), "
+                "embedding_fields = COALESCE(excluded.embedding_fields, embedding_fields), "
+                "embeddings = COALESCE(excluded.embeddings, embeddings), "
+                "updated_at = excluded.updated_at",
+                (job_id, str(uid), stage, json.dumps(raw_map) if raw_map is not None else None,
+                 fields, blob, time.time())
+            )
+            self.conn.commit()
+
+    def load_checkpoint(self, job_id, uid):
+        """
+        The row's checkpoint as {"stage", "raw_map", "embeddings"}, or None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT stage, raw_map, embedding_fields, embeddings FROM job_checkpoints "
+                "WHERE job_id = ? AND uid = ?", (job_id, str(uid))
+            ).fetchone()
+        if row is None:
+            return None
+        stage, raw_map, fields, blob = row
+        embeddings = None
+        if fields is not None:
+            fields = json.loads(fields)
+            values = array("f")
+            values.frombytes(blob)
+            size = len(values) // len(fields)
+            embeddings = {field: values[i * size:(i + 1) * size].tolist() for i, field in enumerate(fields)}
+        return {
+            "stage": stage,
+            "raw_map": json.loads(raw_map) if raw_map is not None else None,
+            "embeddings": embeddings
+        }
+
+    def checkpoint_counts(self, job_id):
+        """
+        Number of rows at each checkpoint stage
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT stage, COUNT(*) FROM job_checkpoints WHERE job_id = ? GROUP BY stage", (job_id,)
+            ).fetchall()
+        counts = dict.fromkeys(CHECKPOINT_STAGES, 0)
+        counts.update(rows)
+        return counts
+
+    def _job(self, row):
+        job = dict(zip(JOB_FIELDS, row))
+        job["options"] = json.loads(job["options"])
+        job["processed"] = job["succeeded"] + job["failed"] + job["skipped"]
+        return job
+
+
+class RowCheckpoints:
+    """
+    One job's row checkpoints, as passed to the batch pipeline
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+
+    def load(self, uid):
+        return self.store.load_checkpoint(self.job_id, uid)
+
+    def enriched(self, uid, raw_map):
+        self.store.save_checkpoint(self.job_id, uid, "enriched", raw_map=raw_map)
+
+    def embedded(self, uid, embeddings):
+        self.store.save_checkpoint(self.job_id, uid, "embedded", embeddings=embeddings)
@@ -0,0 +1,220 @@
+"""
+The per-licensee steps of the enrichment pipeline.
+
+A licensee goes through GPT-4o enrichment, category matching, summary
+templating, embeddings and the Supabase upsert. The steps are separate
+functions so the batch pipeline (see pipeline.py) can run each as its own
+stage; process_licensee runs them one after another for a single entry.
+"""
+import functools
+
+from .category_embeddings import match_categories
+from .category_matcher import LICENSING_CATEGORIES
+from .embedding_profiles import get_embedding_profile
+from .embeddings import embed_texts, embed_fields, profile_embed_fn
+from .enrichment import enrich_brand, usable_enrichment, EMPTY_ENRICHMENT_ERROR
+from .incremental import input_hash
+from .supabase_writer import upsert_licensees
+from .telemetry import get_tracer
+from .usage import metering
+
+
+def normalize_website(website):
+    """
+    Prefix a bare domain with https://
+    """
+    if not website.startswith(('http://', 'https://')):
+        website = 'https://' + website
+    return website
+
+
+def apply_categories(raw_map, primary_category, secondary_category):
+    """
+    Override the model's licensing categories with the matched ones
+    """
+    if primary_category:
+        raw_map["primary_licensing_category"] = primary_category
+    if secondary_category:
+        raw_map["secondary_licensing_category"] = secondary_category
+
+
+def build_summaries(brand_name, raw_map):
+    """
+    Template the summary and commentary texts from an enrichment raw_map
+    """
+    brand_full = brand_name
+    
+    # Basic summaries
+    summaries = {
+        "audience_summary": f"This company targets {raw_map.get('age_group', 'N/A')} consumers, focusing on {raw_map.get('business_category', 'N/A')} across {raw_map.get('countries_distributed', 'N/A')}. {raw_map.get('audience_description', 'N/A')}",
+        
+        "product_summary": f"They specialize in {raw_map.get('popular_products_or_services', 'N/A')}, with licensing focus areas in {raw_map.get('primary_licensing_category', 'N/A')} and {raw_map.get('secondary_licensing_category', 'N/A')}.",
+        
+        "market_fit_summary": f"Distributed across {raw_map.get('countries_distributed', 'N/A')}, their products are positioned as {raw_map.get('price_positioning', 'N/A')} offerings through {raw_map.get('retail_distribution_channels', 'N/A')} channels.",
+        
+        "competitive_summary": f"Compared to {raw_map.get('brand_affinity_competitors', 'other players') if raw_map.get('brand_affinity_competitors') else 'other players'}, they differentiate by focusing on {raw_map.get('industry_classification', 'N/A')} with notable licensing agreements including {raw_map.get('known_licensing_agreements', 'N/A')}.",
+        
+        "combined_summary": f"{brand_name} is a company specializing in {raw_map.get('popular_products_or_services', 'N/A')} ({raw_map.get('primary_licensing_category', 'N/A')} and {raw_map.get('secondary_licensing_category', 'N/A')}) distributed across {raw_map.get('countries_distributed', 'N/A')}. They target {raw_map.get('age_group', 'N/A')} consumers ({raw_map.get('audience_description', 'N/A')}) through {raw_map.get('retail_distribution_channels', 'N/A')} channels, offering {raw_map.get('price_positioning', 'N/A')} products. Competitively, they stand out versus {raw_map.get('brand_affinity_competitors', 'N/A')} by focusing on {raw_map.get('industry_classification', 'N/A')} with key licensing agreements like {raw_map.get('known_licensing_agreements', 'N/A')}."
+    }
+    
+    # Commentary fields
+    opportunity_commentary = f"Based on {brand_full}'s focus on {raw_map.get('business_category', 'their industry')}, they show potential for licensing opportunities in the {raw_map.get('primary_licensing_category', 'primary')} and {raw_map.get('secondary_licensing_category', 'secondary')} categories. Their target demographic of {raw_map.get('age_group', 'consumers')} aligns with current market trends, and their existing distribution across {raw_map.get('countries_distributed', 'markets')} suggests capacity for expanded licensing partnerships."
+    
+    market_readiness = f"{brand_full} demonstrates market readiness through their established {raw_map.get('price_positioning', '')} positioning and presence in {raw_map.get('retail_distribution_channels', 'retail channels')}. Their experience with {raw_map.get('known_licensing_agreements', 'licensing agreements')} indicates familiarity with licensing processes. Their current position in the {raw_map.get('industry_classification', 'industry')} market provides a foundation for licensing expansion."
+    
+    audience_harmony = f"The harmony between {brand_full}'s products and their target audience of {raw_map.get('age_group', 'consumers')} is evident in their specialization in {raw_map.get('popular_products_or_services', 'products/services')}. Their understanding of {raw_map.get('audience_description', 'their audience')} enables them to create products that resonate with consumer preferences and lifestyle needs in the {raw_map.get('primary_licensing_category', 'licensing')} category."
+    
+    competitive_strength = f"In comparison to {raw_map.get('brand_affinity_competitors', 'competitors')}, {brand_full} differentiates through their focus on {raw_map.get('industry_classification', 'their classification')}. Their strength in {raw_map.get('primary_licensing_category', 'primary category')} positions them uniquely in the market. Their {raw_map.get('price_positioning', 'price point')} strategy gives them competitive advantage with their target {raw_map.get('age_group', 'demographic')} across {raw_map.get('countries_distributed', 'their markets')}."
+    
+    strategic_fit = f"{brand_full} exhibits strategic fit for licensing opportunities through their established brand identity in {raw_map.get('business_category', 'their category')}, market presence across {raw_map.get('countries_distributed', 'markets')}, and experience with {raw_map.get('known_licensing_agreements', 'licensing')}. Their focus on {raw_map.get('primary_licensing_category', 'primary')} and {raw_map.get('secondary_licensing_category', 'secondary')} categories allows for natural brand extensions that would resonate with their {raw_map.get('age_group', 'target audience')}."
+    
+    # Add to summaries
+    summaries["opportunity_alignment_commentary"] = opportunity_commentary
+    summaries["market_readiness_commentary"] = market_readiness
+    summaries["audience_harmony_analysis"] = audience_harmony
+    summaries["competitive_strength_analysis"] = competitive_strength
+    summaries["strategic_fit_commentary"] = strategic_fit
+    
+    
+    return summaries
+
+
+def embedding_text_fields(summaries):
+    """
+    (field_name, text) pairs of the summaries that get an embedding column
+    """
+    return [
+        ("combined_strategic_summary", summaries.get("combined_summary", "")),
+        ("opportunity_alignment_score_commentary", summaries.get("opportunity_alignment_commentary", "")),
+        ("market_readiness_commentary", summaries.get("market_readiness_commentary", "")),
+        ("audience_product_harmony_analysis", summaries.get("audience_harmony_analysis", "")),
+        ("competitive_strength_analysis", summaries.get("competitive_strength_analysis", "")),
+        ("strategic_fit_commentary", summaries.get("strategic_fit_commentary", ""))
+    ]
+
+
+# The embedding columns of the licensees table
+EMBEDDING_COLUMNS = tuple(f"{field_name}_embedding" for field_name, _ in embedding_text_fields({}))
+
+
+def build_licensee_record(uid, brand_name, contact_name, website, headquarters, row_input_hash,
+                          raw_map, summaries, embeddings, embedding_profile=None):
+    """
+    The licensees table row for an enriched licensee, with the embeddings
+    stored in the format of embedding_profile (see embedding_profiles.py)
+    """
+    profile = get_embedding_profile(embedding_profile)
+    return {
+        "uid": uid,
+        "brand_name": brand_name,
+        "contact": contact_name,
+        "website": website,
+        "headquarters": headquarters or "Unknown",
+        "input_hash": row_input_hash,
+        # Enriched fields
+        "business_category": raw_map.get("business_category", "N/A"),
+        "age_group": raw_map.get("age_group", "N/A"),
+        "audience_description": raw_map.get("audience_description", "N/A"),
+        "industry_classification": raw_map.get("industry_classification", "N/A"),
+        "popular_type_of_product": raw_map.get("popular_products_or_services", "N/A"),
+        "price_positioning": raw_map.get("price_positioning", "N/A"),
+        "brand_competitors": raw_map.get("brand_affinity_competitors", "N/A"),
+        "retail_distribution_channel": raw_map.get("retail_distribution_channels", "N/A"),
+        "countries_distributed": raw_map.get("countries_distributed", "N/A"),
+        "primary_licensing_category": raw_map.get("primary_licensing_category", "N/A"),
+        "secondary_licensing_category": raw_map.get("secondary_licensing_category", "N/A"),
+        "known_licensing_agreements": raw_map.get("known_licensing_agreements", "N/A"),
+        "product": raw_map.get("product_summary_text", "N/A"),
+        # Summaries
+        "audience_summary": summaries.get("audience_summary", "N/A"),
+        "product_summary": summaries.get("product_summary", "N/A"),
+        "market_fit_summary": summaries.get("market_fit_summary", "N/A"),
+        "competitive_differentiation_summary": summaries.get("competitive_summary", "N/A"),
+        "combined_strategic_summary": summaries.get("combined_summary", "N/A"),
+        # Additional commentary fields
+        "opportunity_alignment_score_commentary": summaries.get("opportunity_alignment_commentary", ""),
+        "market_readiness_commentary": summaries.get("market_readiness_commentary", ""),
+        "audience_product_harmony_analysis": summaries.get("audience_harmony_analysis", ""),
+        "competitive_strength_analysis": summaries.get("competitive_strength_analysis", ""),
+        "strategic_fit_commentary": summaries.get("strategic_fit_commentary", ""),
+        # Embeddings
+        **profile.encode_embeddings({column: embeddings.get(column) for column in EMBEDDING_COLUMNS})
+    }
+
+
+def process_licensee(uid, brand_name, contact_name, email, website, headquarters, 
+                     openai_client, supabase_client, category_list=LICENSING_CATEGORIES,
+                     force_refresh=False, category_mode="keyword", embedding_profile=None):
+    """
+    Process a single licensee entry - handles enrichment, embedding, and Supabase upload
+    openai_client and supabase_client are pooled clients from create_openai_client/create_supabase_client
+    force_refresh skips the enrichment cache and always calls the model
+    category_mode is one of CATEGORY_MODES (keyword, embedding or hybrid matching)
+    embedding_profile sets the embeddings model and storage format (see embedding_profiles.py)
+    Each step is timed as a telemetry span of the matching pipeline stage
+    Returns a dictionary with the processed data, status and token usage (see usage.py)
+    """
+    tracer = get_tracer()
+    uids = [uid]
+    # Initialize result dictionary
+    result = {
+        "success": False,
+        "message": "",
+        "data": {}
+    }
+    
+    # Tokens and estimated cost of every API call made for this licensee
+    with metering() as usage:
+        try:
+            # Hash the inputs as given, so incremental batches can tell whether this row changed
+            row_input_hash = input_hash(brand_name, website, headquarters, contact_name)
+            website = normalize_website(website)
+        
+            # Enrich the brand, reusing a cached result unless a refresh is forced
+            with tracer.span("enrich", uids):
+                raw_map, enrichment_cached = enrich_brand(website, brand_name, force_refresh=force_refresh,
+                                                          client=openai_client)
+            # Nothing to store - fail the row so its input_hash isn't written and the next run retries it
+            if not usable_enrichment(raw_map):
+                raise ValueError(EMPTY_ENRICHMENT_ERROR)
+        
+            # Category matching - keyword hits, category embeddings or both, depending on category_mode
+            with tracer.span("summarize", uids):
+                primary_category, secondary_category = match_categories(
+                    raw_map.get("product_summary_text", ""),
+                    category_list,
+                    mode=category_mode,
+                    embed_fn=functools.partial(embed_texts, client=openai_client)
+                )
+                apply_categories(raw_map, primary_category, secondary_category)
+            
+                summaries = build_summaries(brand_name, raw_map)
+        
+            # Generate all embeddings for this record in one batched request
+            with tracer.span("embed", uids):
+                profile = get_embedding_profile(embedding_profile)
+                embeddings = embed_fields(embedding_text_fields(summaries), profile_embed_fn(profile, openai_client))
+        
+            licensee_data = build_licensee_record(uid, brand_name, contact_name, website, headquarters,
+                                                  row_input_hash, raw_map, summaries, embeddings, profile)
+            with tracer.span("write", uids):
+                upsert_licensees(supabase_client, [licensee_data])
+        
+            # Record success
+            result = {
+                "success": True,
+                "message": f"Saved record with UID: {uid}",
+                "data": licensee_data,
+                "raw_enrichment": raw_map,
+                "summaries": summaries,
+                "enrichment_cached": enrichment_cached,
+                "usage": usage
+            }
+        
+            return result
+        
+        except Exception as e:
+            result["success"] = False
+            result["message"] = str(e)
+            result["usage"] = usage
+            return result
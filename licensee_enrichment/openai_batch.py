@@ -0,0 +1,402 @@
+"""
+OpenAI Batch API mode for large, non-interactive loads.
+
+Instead of one request per row, the enrichment requests of the whole input
+are written to JSONL files and submitted through the Batch API, which trades
+latency (results within the 24h completion window) for throughput and lower
+cost. Once the enrichment batches complete, categories and summaries are
+computed locally, the summary embeddings go out as a second round of batches,
+and each record is upserted as soon as its embeddings are read back.
+
+Results go through the same code as the interactive pipeline: the enrichment
+JSON is validated by parse_enrichment_output (with a short synchronous
+follow-up for missing fields), and categories, summaries, records and
+writes come from the pipeline and licensee modules. Enrichments and
+embeddings are read from and written to the usual caches, so rows already
+enriched are never batched again.
+
+The client only needs the files and batches endpoints, so the whole flow can
+be run against a local stand-in by pointing the OpenAI client's base_url at
+it (see benchmarks/mock_services.py).
+"""
+import json
+import os
+import time
+import uuid
+
+from .category_matcher import LICENSING_CATEGORIES
+from .embedding_cache import get_shared_cache
+from .embedding_profiles import get_embedding_profile
+from .embeddings import cache_model, embed_texts
+from .enrichment import (ENRICHMENT_MODEL, PROMPT_VERSION, EMPTY_ENRICHMENT_ERROR, enrichment_request,
+                         parse_enrichment_output, complete_missing_fields, prompt_tokens, usable_enrichment)
+from .enrichment_cache import get_shared_enrichment_cache
+from .incremental import input_hash, skip_unchanged
+from .licensee import normalize_website, embedding_text_fields, build_licensee_record
+from .pipeline import row_item, item_outcome, summarize_items, charge_items
+from .similarity_index import index_written
+from .supabase_writer import write_records, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE
+from .telemetry import get_tracer
+from .usage import CostBudget, add_usage, estimate_cost, metering, response_usage
+
+CHAT_ENDPOINT = "/v1/chat/completions"
+EMBEDDINGS_ENDPOINT = "/v1/embeddings"
+COMPLETION_WINDOW = "24h"
+
+# Batch API input limits, with some headroom on the file size
+MAX_REQUESTS_PER_BATCH = 50000
+MAX_BATCH_FILE_BYTES = 190 * 1024 * 1024
+
+# Seconds between batch status polls
+DEFAULT_POLL_INTERVAL = 60.0
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Request and result files are kept here until the run finishes
+DEFAULT_WORK_DIR = os.path.join(".cache", "batches")
+
+
+def write_request_files(requests, endpoint, path_prefix, max_requests=MAX_REQUESTS_PER_BATCH,
+                        max_bytes=MAX_BATCH_FILE_BYTES):
+    """
+    Write (custom_id, body) pairs as Batch API JSONL, starting a new file
+    whenever one would exceed the per-batch request or size limit.
+    Returns the paths written.
+    """
+    paths = []
+    output = None
+    count = size = 0
+    for custom_id, body in requests:
+        line = (json.dumps({"custom_id": custom_id, "method": "POST", "url": endpoint, "body": body}) + "\n").encode("utf-8")
+        if output is None or count >= max_requests or size + len(line) > max_bytes:
+            if output:
+                output.close()
+            paths.append(f"{path_prefix}-{len(paths)}.jsonl")
+            output = open(paths[-1], "wb")
+            count = size = 0
+        output.write(line)
+        count += 1
+        size += len(line)
+    if output:
+        output.close()
+    return paths
+
+
+def submit_batch(client, path, endpoint, metadata=None):
+    """
+    Upload a JSONL request file and create a batch for it
+    """
+    with open(path, "rb") as request_file:
+        uploaded = client.files.create(file=request_file, purpose="batch")
+    return client.batches.create(input_file_id=uploaded.id, endpoint=endpoint,
+                                 completion_window=COMPLETION_WINDOW, metadata=metadata)
+
+
+def wait_for_batch(client, batch_id, poll_interval=DEFAULT_POLL_INTERVAL, on_status=None, sleep=time.sleep):
+    """
+    Poll a batch until it reaches a terminal status and return it.
+    on_status(batch) is called after every poll.
+    """
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if on_status:
+            on_status(batch)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        sleep(poll_interval)
+
+
+def _download(client, file_id, path):
+    with client.files.with_streaming_response.content(file_id) as response:
+        response.stream_to_file(path)
+
+
+def iter_batch_results(client, batch, path_prefix):
+    """
+    Yield (custom_id, response_body, error) for every result of a finished
+    batch, reading the output and error files from disk line by line.
+    """
+    for kind, file_id in (("output", batch.output_file_id), ("errors", batch.error_file_id)):
+        if not file_id:
+            continue
+        path = f"{path_prefix}-{kind}.jsonl"
+        _download(client, file_id, path)
+        with open(path, encoding="utf-8") as results:
+            for line in results:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                error = result.get("error")
+                if error:
+                    yield result["custom_id"], None, error.get("message") or error.get("code") or str(error)
+                elif response.get("status_code") != 200:
+                    body = response.get("body") or {}
+                    message = (body.get("error") or {}).get("message") or f"HTTP {response.get('status_code')}"
+                    yield result["custom_id"], None, message
+                else:
+                    yield result["custom_id"], response["body"], None
+        os.remove(path)
+
+
+class BatchEnrichment:
+    """
+    Enrich a CSV's rows through the OpenAI Batch API and upsert the records.
+
+    on_event(event, **fields) is told when batches are submitted, on every
+    status poll and when each batch finishes (the CLI prints these). The
+    wait for each batch (as "enrich_batch" or "embed_batch"), the summarize
+    step and every upsert chunk are timed as spans on tracer.
+
+    budget is a ceiling in USD. Enrichment requests are only submitted while
+    their worst-case cost (at the Batch API discount) fits under it; the
+    remaining rows are reported as paused.
+
+    The summaries are embedded and stored as set by embedding_profile (see
+    embedding_profiles.py).
+    """
+
+    def __init__(self, openai_client, supabase_client, chunk_size=DEFAULT_CHUNK_SIZE, force_refresh=False,
+                 category_mode="keyword", category_list=LICENSING_CATEGORIES, poll_interval=DEFAULT_POLL_INTERVAL,
+                 work_dir=DEFAULT_WORK_DIR, on_event=None, tracer=None, budget=None, embedding_profile=None):
+        self.openai_client = openai_client
+        self.supabase_client = supabase_client
+        self.chunk_size = max(1, min(int(chunk_size), MAX_CHUNK_SIZE))
+        self.force_refresh = force_refresh
+        self.category_mode = category_mode
+        self.category_list = category_list
+        self.poll_interval = poll_interval
+        self.work_dir = work_dir
+        self.on_event = on_event or (lambda event, **fields: None)
+        self.run_id = uuid.uuid4().hex[:12]
+        self.stage_metrics = {}
+        self.tracer = tracer or get_tracer()
+        self.budget = CostBudget(budget) if budget else None
+        self.embedding_profile = get_embedding_profile(embedding_profile)
+
+    def run(self, rows, incremental=False):
+        """
+        Yield each row's outcome. Rows that are skipped or fail validation are
+        reported first; the rest once their records have been written.
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        skipped = []
+        if incremental:
+            rows = skip_unchanged(rows, self.supabase_client, on_skip=skipped.append)
+
+        items = {}
+        for index, row in enumerate(rows):
+            item = row_item(row)
+            if not item["uid"] or not item["website"]:
+                item["error"] = "Missing required fields"
+                yield item_outcome(item)
+                continue
+            item["input_hash"] = input_hash(item["brand_name"], item["website"], item["headquarters"],
+                                            item["contact_name"])
+            item["website"] = normalize_website(item["website"])
+            items[f"row-{index}"] = item
+        yield from skipped
+
+        self._enrich(items)
+
+        enriched = [item for item in items.values() if not item["error"]]
+        with self.tracer.span("summarize", [item["uid"] for item in enriched]), metering() as usage:
+            summarize_items(enriched, self.category_mode, self.category_list, self._embed_fn)
+        charge_items(enriched, usage)
+
+        # Failed rows are reported now; the rest once their embeddings are back and written
+        for custom_id in [custom_id for custom_id, item in items.items() if item["error"]]:
+            yield item_outcome(items.pop(custom_id))
+        yield from self._embed_and_write(items)
+
+    def metrics(self):
+        """
+        Batches and requests sent per stage, and how many requests failed
+        """
+        return {stage: dict(counts) for stage, counts in self.stage_metrics.items()}
+
+    @property
+    def paused(self):
+        """
+        True if rows were held back by the budget ceiling
+        """
+        return self.budget is not None and self.budget.exceeded
+
+    def _charge(self, item, usage):
+        add_usage(item["usage"], usage)
+        if self.budget:
+            self.budget.charge(usage["cost"])
+
+    def _embed_fn(self, texts):
+        return embed_texts(texts, client=self.openai_client)
+
+    def _run_batches(self, stage, endpoint, requests):
+        """
+        Submit every request file of a stage, then wait for each batch and
+        yield its (custom_id, body, error) results. All of a stage's batches
+        run at the same time.
+        """
+        prefix = os.path.join(self.work_dir, f"{self.run_id}-{stage}")
+        metrics = self.stage_metrics.setdefault(stage, {"batches": 0, "requests": 0, "failed": 0})
+        batches = []
+        for path in write_request_files(requests, endpoint, prefix):
+            batch = submit_batch(self.openai_client, path, endpoint, metadata={"stage": stage, "run": self.run_id})
+            os.remove(path)
+            self.on_event("batch_submitted", stage=stage, batch_id=batch.id)
+            batches.append(batch)
+
+        def status(batch):
+            counts = batch.request_counts
+            self.on_event("batch_status", stage=stage, batch_id=batch.id, status=batch.status,
+                          completed=counts.completed if counts else 0, failed=counts.failed if counts else 0,
+                          total=counts.total if counts else 0)
+
+        for index, batch in enumerate(batches):
+            with self.tracer.span(f"{stage}_batch") as span:
+                batch = wait_for_batch(self.openai_client, batch.id, self.poll_interval, on_status=status)
+                if batch.status != "completed":
+                    span.error(f"Batch {batch.id} {batch.status}")
+            self.on_event("batch_finished", stage=stage, batch_id=batch.id, status=batch.status)
+            counts = batch.request_counts
+            metrics["batches"] += 1
+            metrics["requests"] += counts.total if counts else 0
+            metrics["failed"] += counts.failed if counts else 0
+            yield from iter_batch_results(self.openai_client, batch, f"{prefix}-{index}")
+
+    def _enrich(self, items):
+        """
+        Fill each item's raw_map from the enrichment cache or the enrichment batches
+        """
+        cache = get_shared_enrichment_cache()
+        pending = {}
+        for custom_id, item in items.items():
+            raw_map = None if self.force_refresh else cache.get(item["website"], item["brand_name"],
+                                                                PROMPT_VERSION, ENRICHMENT_MODEL)
+            if raw_map is not None and usable_enrichment(raw_map):
+                item["raw_map"], item["enrichment_cached"] = raw_map, True
+            else:
+                pending[custom_id] = item
+
+        def requests():
+            # Only rows whose worst-case cost still fits under the budget are submitted
+            for custom_id, item in list(pending.items()):
+                request = enrichment_request(item["website"], item["brand_name"])
+                reserved = estimate_cost(request["model"], prompt_tokens(request), request["max_tokens"], batch=True)
+                if self.budget and not self.budget.try_reserve(reserved):
+                    item["error"] = f"Paused at the budget ceiling of ${self.budget.limit:.2f}"
+                    item["paused"] = True
+                    del pending[custom_id]
+                    continue
+                item["reserved_cost"] = reserved
+                yield custom_id, request
+
+        for custom_id, body, error in self._run_batches("enrich", CHAT_ENDPOINT, requests()):
+            item = pending.pop(custom_id, None)
+            if item is None:
+                continue
+            if body:
+                self._charge(item, response_usage(ENRICHMENT_MODEL, body.get("usage"), batch=True))
+            if self.budget:
+                self.budget.release(item["reserved_cost"])
+            if error:
+                item["error"] = f"Enrichment: {error}"
+                continue
+            raw_map = parse_enrichment_output(body["choices"][0]["message"]["content"])
+            # The follow-up for missing fields is a small synchronous request, covered by the
+            # worst-case reservation just released
+            with metering() as usage:
+                raw_map = complete_missing_fields(item["website"], item["brand_name"], raw_map,
+                                                  client=self.openai_client)
+            self._charge(item, usage)
+            # Nothing to store - fail the row so its input_hash isn't written and the next run retries it
+            if not usable_enrichment(raw_map):
+                item["error"] = EMPTY_ENRICHMENT_ERROR
+                continue
+            cache.put(item["website"], item["brand_name"], PROMPT_VERSION, ENRICHMENT_MODEL, raw_map)
+            item["raw_map"], item["enrichment_cached"] = raw_map, False
+
+        # Rows a batch never answered (e.g. it expired or was cancelled); nothing was spent on them
+        for item in pending.values():
+            if self.budget:
+                self.budget.release(item["reserved_cost"])
+            item["error"] = "Enrichment: no result from the batch"
+
+    def _embed_and_write(self, items):
+        """
+        Embed every item's summaries (from the cache or the embedding
+        batches) and yield outcomes as the records are written in chunks.
+        """
+        cache = get_shared_cache()
+        profile = self.embedding_profile
+        cached_as = cache_model(profile.model, profile.dimensions)
+        records = []
+        pending = {}
+
+        def finish(item, vectors):
+            item["embeddings"] = vectors
+            records.append(item)
+            if len(records) >= self.chunk_size:
+                yield from self._write(records)
+                records.clear()
+
+        # Items are dropped from items as they go, so only unwritten ones stay in memory
+        for custom_id in list(items):
+            item = items.pop(custom_id)
+            fields = embedding_text_fields(item["summaries"])
+            texts = [text for _, text in fields if text and text.strip()]
+            cached = cache.get_many(cached_as, texts)
+            item["embedding_fields"] = fields
+            missing = [text for text in dict.fromkeys(texts) if text not in cached]
+            if missing:
+                item["embedding_inputs"] = missing
+                item["cached_vectors"] = cached
+                pending[custom_id] = item
+            else:
+                yield from finish(item, self._field_vectors(fields, cached))
+
+        options = {"dimensions": profile.dimensions} if profile.dimensions else {}
+        requests = ((custom_id, {"model": profile.model, "input": item["embedding_inputs"], **options})
+                    for custom_id, item in pending.items())
+        for custom_id, body, error in self._run_batches("embed", EMBEDDINGS_ENDPOINT, requests):
+            item = pending.pop(custom_id, None)
+            if item is None:
+                continue
+            if error:
+                # Never stored without its vectors, as when an embeddings request fails in the pipeline
+                item["error"] = f"Embeddings: {error}"
+                yield item_outcome(item)
+                continue
+            self._charge(item, response_usage(profile.model, body.get("usage"), embedding=True, batch=True))
+            fetched = [(item["embedding_inputs"][entry["index"]], entry["embedding"]) for entry in body["data"]]
+            cache.put_many(cached_as, fetched)
+            vectors = {**item.pop("cached_vectors"), **dict(fetched)}
+            yield from finish(item, self._field_vectors(item["embedding_fields"], vectors))
+
+        for item in pending.values():
+            item["error"] = "Embeddings: no result from the batch"
+            yield item_outcome(item)
+        if records:
+            yield from self._write(records)
+
+    @staticmethod
+    def _field_vectors(fields, vectors):
+        return {f"{name}_embedding": vectors.get(text) for name, text in fields}
+
+    def _write(self, items):
+        records = [
+            build_licensee_record(item["uid"], item["brand_name"], item["contact_name"], item["website"],
+                                  item["headquarters"], item["input_hash"], item["raw_map"],
+                                  item["summaries"], item["embeddings"], self.embedding_profile)
+            for item in items
+        ]
+        written = []
+        with self.tracer.span("write", [item["uid"] for item in items]) as span:
+            for item, record, write in zip(items, records, write_records(self.supabase_client, records)):
+                if write["success"]:
+                    written.append(record)
+                else:
+                    item["error"] = f"Database write: {write['message']}"
+                    span.error(item["error"], item["uid"])
+        index_written(written, self.embedding_profile)
+        for item in items:
+            yield item_outcome(item)
@@ -0,0 +1,522 @@
+"""
+Staged batch pipeline for licensee enrichment.
+
+A batch flows through four stages connected by bounded queues:
+
+    enrich     GPT-4o enrichment of each brand (wide - one request per worker,
+               for one brand or, with pack_size, several packed together)
+    summarize  category matching and summary templating
+    embed      the summary embeddings of a whole batch of records at once
+    write      chunked Supabase upserts
+
+Each stage has its own worker count, batch size and metrics, so the slow
+enrichment stage can run wide while embeddings are batched and writes are
+chunked, and a slow stage only holds up the others once the queue in front
+of it is full. Rows that fail at any stage skip the rest and are reported
+straight away.
+"""
+import functools
+import queue
+import threading
+import time
+
+from .batch_runner import make_outcome, DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+from .category_embeddings import match_categories_many
+from .category_matcher import LICENSING_CATEGORIES
+from .embedding_profiles import get_embedding_profile
+from .embeddings import embed_texts, embed_fields_many, profile_embed_fn
+from .enrichment import enrich_brand, enrich_brands, usable_enrichment, EMPTY_ENRICHMENT_ERROR, MAX_PACK_SIZE
+from .incremental import input_hash, skip_unchanged
+from .licensee import (normalize_website, apply_categories, build_summaries, embedding_text_fields,
+                       build_licensee_record)
+from .similarity_index import index_written
+from .supabase_writer import write_records, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE
+from .telemetry import get_tracer
+from .usage import BudgetExceeded, CostBudget, add_usage, empty_usage, metering, split_usage
+
+# Records whose summaries are embedded together (six texts each)
+DEFAULT_EMBED_BATCH_SIZE = 32
+DEFAULT_EMBED_WORKERS = 2
+
+# Seconds a stage waits for more items to fill a batch before running it anyway
+DEFAULT_MAX_WAIT = 0.05
+WRITE_MAX_WAIT = 1.0
+
+# Items queued in front of a stage, per worker and batch slot
+QUEUED_PER_SLOT = 2
+
+# Batch settings accepted by enrich_rows, as stored with a job's options
+BATCH_OPTIONS = ("concurrency", "chunk_size", "incremental", "force_refresh", "category_mode",
+                 "embed_batch_size", "embed_workers", "budget", "pack_size", "embedding_profile")
+
+# Marks the end of the input on a stage's queue
+_STOP = object()
+
+
+def _cell(row, name):
+    # Empty CSV cells arrive as NaN
+    value = row.get(name, "")
+    return "" if value is None or value != value else value
+
+
+def row_item(row):
+    """
+    The work item that carries a row through the stages
+    """
+    return {
+        "uid": _cell(row, "uid"),
+        "brand_name": _cell(row, "brand_name"),
+        "contact_name": _cell(row, "contact"),
+        "email": _cell(row, "email"),
+        "website": _cell(row, "website"),
+        "headquarters": _cell(row, "headquarters"),
+        "error": None,
+        "usage": empty_usage()
+    }
+
+
+def item_outcome(item):
+    if item["error"]:
+        # A row held back by the budget ceiling says so rather than reporting a failure
+        status = item["error"] if item.get("paused") else f"Failed - {item['error']}"
+        return make_outcome(item["uid"], item["brand_name"], status, False, item["usage"])
+    status = "Success (cached enrichment)" if item.get("enrichment_cached") else "Success"
+    return make_outcome(item["uid"], item["brand_name"], status, True, item["usage"])
+
+
+def charge_items(items, usage, weights=None):
+    """
+    Add a batch's usage to its items, split in proportion to weights (evenly by default)
+    """
+    for item, share in zip(items, split_usage(usage, weights or [1] * len(items))):
+        add_usage(item["usage"], share)
+
+
+def summarize_items(items, category_mode, category_list, embed_fn):
+    """
+    Match categories for enriched items and template their summaries, in place
+    """
+    # One keyword pass over the whole batch, and one embeddings request for the summaries that need it
+    summary_texts = [item["raw_map"].get("product_summary_text", "") for item in items]
+    categories = match_categories_many(summary_texts, category_list, mode=category_mode, embed_fn=embed_fn)
+
+    for item, (primary_category, secondary_category) in zip(items, categories):
+        apply_categories(item["raw_map"], primary_category, secondary_category)
+        item["summaries"] = build_summaries(item["brand_name"], item["raw_map"])
+
+
+def _each(fn):
+    """
+    Run fn on every item of a batch, recording a failure on the item instead of failing the batch
+    """
+    def run(items):
+        for item in items:
+            try:
+                fn(item)
+            except Exception as e:
+                item["error"] = str(e)
+    return run
+
+
+class StageMetrics:
+    """
+    Counters for one stage, updated by its workers
+    """
+
+    def __init__(self):
+        self.items = 0
+        self.failed = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.lock = threading.Lock()
+
+    def record(self, items, failed, seconds):
+        with self.lock:
+            self.items += items
+            self.failed += failed
+            self.batches += 1
+            self.busy_seconds += seconds
+
+    def observe_queue(self, depth):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def as_dict(self, workers, elapsed):
+        with self.lock:
+            return {
+                "workers": workers,
+                "items": self.items,
+                "failed": self.failed,
+                "batches": self.batches,
+                "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "busy_seconds": round(self.busy_seconds, 3),
+                # Share of the workers' time spent processing rather than waiting for input
+                "utilization": round(self.busy_seconds / (elapsed * workers), 3) if elapsed else 0.0,
+                "max_queue_depth": self.max_queue_depth
+            }
+
+
+class Stage:
+    """
+    A pool of workers that take batches of items from a bounded queue,
+    process them and pass them on.
+
+    process_batch(items) works on a list of item dicts in place, setting
+    item["error"] for any item that failed. Failed items, and every item of
+    the last stage, go to the output; the rest go to the next stage. Each
+    batch runs in a telemetry span of the stage.
+    """
+
+    def __init__(self, name, process_batch, workers=1, batch_size=1, max_wait=DEFAULT_MAX_WAIT, queue_size=None,
+                 tracer=None):
+        self.name = name
+        self.tracer = tracer or get_tracer()
+        self.process_batch = process_batch
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max_wait
+        self.inbox = queue.Queue(maxsize=queue_size or self.workers * self.batch_size * QUEUED_PER_SLOT)
+        self.metrics = StageMetrics()
+        self.threads = []
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def start(self, downstream, finish, output):
+        """
+        Start the workers. downstream is the next Stage (None for the last);
+        output(item) receives finished items and finish() is called once
+        every worker has stopped.
+        """
+        self.running = self.workers
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(downstream, finish, output),
+                                      name=f"pipeline-{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _next_batch(self):
+        """
+        Up to batch_size items, waiting at most max_wait for the batch to fill.
+        Returns (items, stopping).
+        """
+        item = self.inbox.get()
+        if item is _STOP:
+            return [], True
+        self.metrics.observe_queue(self.inbox.qsize() + 1)
+
+        items = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.inbox.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _work(self, downstream, finish, output):
+        while True:
+            items, stopping = self._next_batch()
+            if items:
+                started = time.monotonic()
+                with self.tracer.span(self.name, [item["uid"] for item in items]) as span:
+                    try:
+                        self.process_batch(items)
+                    except Exception as e:
+                        for item in items:
+                            item["error"] = item["error"] or str(e)
+                    for item in items:
+                        if item["error"]:
+                            span.error(item["error"], item["uid"])
+                failed = sum(1 for item in items if item["error"])
+                self.metrics.record(len(items), failed, time.monotonic() - started)
+
+                for item in items:
+                    if item["error"] or downstream is None:
+                        output(item)
+                    else:
+                        downstream.inbox.put(item)
+
+            if stopping:
+                # Let the other workers see the end of the input too
+                self.inbox.put(_STOP)
+                break
+
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last:
+            # The queue still holds the _STOP this worker re-queued; clear it for a clean shutdown
+            self.inbox.get()
+            finish()
+
+
+class LicenseePipeline:
+    """
+    The enrich -> summarize -> embed -> write pipeline for a batch of rows.
+
+    concurrency is the number of enrichment workers and chunk_size the
+    number of records per upsert. checkpoint (a job's RowCheckpoints)
+    records each row's progress and supplies results saved by an earlier,
+    interrupted run of the same job. Stage spans go to tracer (the
+    process-wide one by default). budget is a ceiling in USD on what the run
+    may spend on API calls; when it is reached the run pauses - no new rows
+    are started and rows waiting to be enriched are reported as paused.
+    pack_size brands (1 for none) are enriched together in one chat request
+    by each enrichment worker, and share its usage evenly.
+    embedding_profile (a name from EMBEDDING_PROFILES, or the
+    EMBEDDING_PROFILE default) sets the model that embeds the summaries and
+    how the vectors are stored.
+    """
+
+    def __init__(self, openai_client, supabase_client, concurrency=DEFAULT_CONCURRENCY,
+                 chunk_size=DEFAULT_CHUNK_SIZE, force_refresh=False, category_mode="keyword",
+                 category_list=LICENSING_CATEGORIES, embed_batch_size=DEFAULT_EMBED_BATCH_SIZE,
+                 embed_workers=DEFAULT_EMBED_WORKERS, checkpoint=None, tracer=None, budget=None, pack_size=1,
+                 embedding_profile=None):
+        self.openai_client = openai_client
+        self.supabase_client = supabase_client
+        self.force_refresh = force_refresh
+        self.category_mode = category_mode
+        self.category_list = category_list
+        self.checkpoint = checkpoint
+        self.budget = CostBudget(budget) if budget else None
+        # Category matching keeps to its own model; the summaries are embedded with the profile's
+        self.embed_fn = functools.partial(embed_texts, client=openai_client)
+        self.embedding_profile = get_embedding_profile(embedding_profile)
+        self.profile_embed_fn = profile_embed_fn(self.embedding_profile, openai_client)
+
+        concurrency = max(1, min(int(concurrency), MAX_CONCURRENCY))
+        chunk_size = max(1, min(int(chunk_size), MAX_CHUNK_SIZE))
+        pack_size = max(1, min(int(pack_size or 1), MAX_PACK_SIZE))
+        tracer = tracer or get_tracer()
+        self.stages = [
+            Stage("enrich", self._enrich_pack if pack_size > 1 else _each(self._enrich), workers=concurrency,
+                  batch_size=pack_size, tracer=tracer),
+            # Embedding and hybrid category matching call the embeddings endpoint for each summary
+            Stage("summarize", self._summarize, workers=1 if category_mode == "keyword" else embed_workers,
+                  batch_size=embed_batch_size, tracer=tracer),
+            Stage("embed", self._embed, workers=embed_workers, batch_size=embed_batch_size, tracer=tracer),
+            Stage("write", self._write, workers=1, batch_size=chunk_size, max_wait=WRITE_MAX_WAIT, tracer=tracer)
+        ]
+        self.output = queue.Queue()
+        self.started = None
+        self.finished = None
+        self.stopped = threading.Event()
+
+    def emit(self, outcome):
+        """
+        Report an outcome for a row that never entered the stages (e.g. skipped as unchanged)
+        """
+        self.output.put(outcome)
+
+    def run(self, rows, incremental=False):
+        """
+        Feed rows (an iterable of CSV row dicts) through the stages, yielding
+        each row's outcome once its record has been written or it has failed.
+        Only the rows queued in front of each stage are held in memory.
+        In incremental mode rows unchanged since their last enrichment are
+        skipped and yielded as skipped outcomes.
+        """
+        if incremental:
+            rows = skip_unchanged(rows, self.supabase_client, on_skip=self.emit)
+
+        self.started = time.monotonic()
+        done = object()
+        for stage, downstream in zip(self.stages, self.stages[1:] + [None]):
+            if downstream is None:
+                finish = functools.partial(self.output.put, done)
+            else:
+                finish = functools.partial(downstream.inbox.put, _STOP)
+            stage.start(downstream, finish, self._finish_item)
+
+        feed_error = []
+        feeder = threading.Thread(target=self._feed, args=(rows, feed_error), name="pipeline-feed", daemon=True)
+        feeder.start()
+        try:
+            while True:
+                outcome = self.output.get()
+                if outcome is done:
+                    break
+                yield outcome
+        finally:
+            # Stop reading input if the caller stopped early; queued rows still drain
+            self.stopped.set()
+        feeder.join()
+        self.finished = time.monotonic()
+        if feed_error:
+            raise feed_error[0]
+
+    @property
+    def paused(self):
+        """
+        True once the run has stopped at its budget ceiling
+        """
+        return self.budget is not None and self.budget.exceeded
+
+    def metrics(self):
+        """
+        Per-stage counters, keyed by stage name
+        """
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0.0
+        return {stage.name: stage.metrics.as_dict(stage.workers, elapsed) for stage in self.stages}
+
+    def _feed(self, rows, feed_error):
+        first = self.stages[0]
+        try:
+            for row in rows:
+                if self.stopped.is_set():
+                    break
+                item = row_item(row)
+                if not item["uid"] or not item["website"]:
+                    item["error"] = "Missing required fields"
+                    self._finish_item(item)
+                else:
+                    first.inbox.put(item)
+        except Exception as e:
+            # Reading the input failed; rows already queued still finish
+            feed_error.append(e)
+        finally:
+            first.inbox.put(_STOP)
+
+    def _finish_item(self, item):
+        self.output.put(item_outcome(item))
+
+    def _enrich(self, item):
+        try:
+            with metering(self.budget) as usage:
+                self._enrich_item(item)
+        except BudgetExceeded as e:
+            item["error"], item["paused"] = str(e), True
+            # Start no more rows; the ones already queued are reported as paused
+            self.stopped.set()
+        finally:
+            add_usage(item["usage"], usage)
+
+    def _enrich_item(self, item):
+        if self._restore(item):
+            return
+        # Enrich the brand, reusing a cached result unless a refresh is forced
+        item["raw_map"], item["enrichment_cached"] = enrich_brand(
+            item["website"], item["brand_name"], force_refresh=self.force_refresh, client=self.openai_client
+        )
+        self._enriched(item)
+
+    def _enrich_pack(self, items):
+        pending = [item for item in items if not self._restore(item)]
+        if not pending:
+            return
+        results = None
+        try:
+            with metering(self.budget) as usage:
+                results = enrich_brands([(item["uid"], item["website"], item["brand_name"]) for item in pending],
+                                        force_refresh=self.force_refresh, client=self.openai_client)
+        except BudgetExceeded as e:
+            for item in pending:
+                item["error"], item["paused"] = str(e), True
+            # Start no more rows; the ones already queued are reported as paused
+            self.stopped.set()
+        finally:
+            # Brands answered from the cache cost nothing; the rest share the requests evenly
+            requested = pending if results is None else [item for item, (_, cached, _) in zip(pending, results)
+                                                         if not cached]
+            charge_items(requested, usage)
+
+        # Each brand succeeds or fails on its own; cache hits and restored rows are never held back by the others
+        for item, (raw_map, cached, error) in zip(pending, results or ()):
+            if isinstance(error, BudgetExceeded):
+                item["error"], item["paused"] = str(error), True
+                self.stopped.set()
+            elif error is not None:
+                item["error"] = str(error)
+            else:
+                item["raw_map"], item["enrichment_cached"] = raw_map, cached
+                self._enriched(item)
+
+    def _restore(self, item):
+        """
+        Prepare an item for enrichment, returning True if an earlier run of the job already enriched it
+        """
+        # Hash the inputs as given, so incremental batches can tell whether this row changed
+        item["input_hash"] = input_hash(item["brand_name"], item["website"], item["headquarters"],
+                                        item["contact_name"])
+        item["website"] = normalize_website(item["website"])
+
+        # Results saved by an earlier run of this batch job
+        saved = self.checkpoint.load(item["uid"]) if self.checkpoint else None
+        item["saved_embeddings"] = saved["embeddings"] if saved else None
+        if saved and saved["raw_map"] is not None:
+            item["raw_map"], item["enrichment_cached"] = saved["raw_map"], True
+            return True
+        return False
+
+    def _enriched(self, item):
+        # Nothing to store - fail the row so its input_hash isn't written and the next run retries it
+        if not usable_enrichment(item["raw_map"]):
+            item["error"] = EMPTY_ENRICHMENT_ERROR
+        elif self.checkpoint:
+            self.checkpoint.enriched(item["uid"], item["raw_map"])
+
+    def _summarize(self, items):
+        # Embedding and hybrid category matching embed the batch's summaries in one request
+        with metering() as usage:
+            summarize_items(items, self.category_mode, self.category_list, self.embed_fn)
+        charge_items(items, usage)
+
+    def _embed(self, items):
+        pending = []
+        for item in items:
+            if item["saved_embeddings"] is not None:
+                item["embeddings"] = item["saved_embeddings"]
+            else:
+                pending.append(item)
+
+        # All summary fields of the batch go out together; each record is charged for its share of the text
+        records_text_fields = [embedding_text_fields(item["summaries"]) for item in pending]
+        try:
+            with metering() as usage:
+                embeddings = embed_fields_many(records_text_fields, self.profile_embed_fn)
+        except Exception as e:
+            # Only the records in the failed request fail; rows with saved embeddings still go on to be written
+            for item in pending:
+                item["error"] = f"Embeddings: {e}"
+            return
+        finally:
+            charge_items(pending, usage, [sum(len(text) for _, text in text_fields)
+                                          for text_fields in records_text_fields])
+        for item, vectors in zip(pending, embeddings):
+            item["embeddings"] = vectors
+            if self.checkpoint and all(vector is not None for vector in vectors.values()):
+                self.checkpoint.embedded(item["uid"], vectors)
+
+    def _write(self, items):
+        records = [
+            build_licensee_record(item["uid"], item["brand_name"], item["contact_name"], item["website"],
+                                  item["headquarters"], item["input_hash"], item["raw_map"],
+                                  item["summaries"], item["embeddings"], self.embedding_profile)
+            for item in items
+        ]
+        written = []
+        for item, record, write in zip(items, records, write_records(self.supabase_client, records)):
+            if write["success"]:
+                written.append(record)
+            else:
+                item["error"] = f"Database write: {write['message']}"
+        # Keep an open similarity index current with the new records
+        index_written(written, self.embedding_profile)
+
+
+def enrich_rows(rows, openai_client, supabase_client, incremental=False, **settings):
+    """
+    Enrich an iterator of CSV row dicts through a LicenseePipeline, yielding
+    each row's outcome (see batch_runner.make_outcome). settings are the
+    LicenseePipeline options (concurrency, chunk_size, force_refresh, ...).
+    """
+    pipeline = LicenseePipeline(openai_client, supabase_client, **settings)
+    yield from pipeline.run(rows, incremental=incremental)
@@ -0,0 +1,83 @@
+"""
+Versioned prompt templates.
+
+OpenAI caches prompt prefixes it has recently seen (once a prompt is at
+least 1,024 tokens long, in steps of 128 tokens) and bills the cached input
+tokens at a discount, with lower latency. A template therefore keeps
+everything that is the same for every brand - the instructions and the field
+list - in a fixed system message, and only the per-brand variables go in a
+short user message at the end, so every request of a batch shares one long
+prefix.
+
+Templates are registered by name and version, and requests are built from
+the current version of each. A template's version_id changes with its text,
+and the enrichment cache is keyed on it, so results produced by an older
+prompt are not reused.
+"""
+import hashlib
+
+# OpenAI only caches prompts at least this long, in steps of PROMPT_CACHE_STEP tokens
+MIN_CACHED_PROMPT_TOKENS = 1024
+PROMPT_CACHE_STEP = 128
+
+_templates = {}
+_current = {}
+
+
+class PromptTemplate:
+    """
+    A fixed system message followed by a user message filled in per request
+    """
+
+    def __init__(self, name, version, system, user):
+        self.name = name
+        self.version = version
+        self.system = system
+        self.user = user
+
+    @property
+    def version_id(self):
+        """
+        name, version and a fingerprint of the text, e.g. enrichment-2-1a2b3c4d5e6f
+        """
+        fingerprint = hashlib.sha256((self.system + "\0" + self.user).encode("utf-8")).hexdigest()[:12]
+        return f"{self.name}-{self.version}-{fingerprint}"
+
+    def messages(self, **variables):
+        """
+        Chat messages for one request: the static prefix first, the variables last
+        """
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**variables)}
+        ]
+
+
+def register_prompt(template, current=True):
+    """
+    Add a template to the registry, making it the current version of its name unless current is False
+    """
+    key = (template.name, template.version)
+    if key in _templates:
+        raise ValueError(f"Prompt {template.name} version {template.version} is already registered")
+    _templates[key] = template
+    if current:
+        _current[template.name] = template
+    return template
+
+
+def get_prompt(name, version=None):
+    """
+    The current template registered under name, or the given version of it
+    """
+    try:
+        return _current[name] if version is None else _templates[(name, version)]
+    except KeyError:
+        raise KeyError(f"No prompt {name}" + (f" version {version}" if version is not None else "")) from None
+
+
+def prompt_versions(name):
+    """
+    Versions registered under name, in registration order
+    """
+    return [version for template_name, version in _templates if template_name == name]
@@ -0,0 +1,215 @@
+"""
+Shared OpenAI rate limiter.
+
+Tracks the account's requests-per-minute and tokens-per-minute budgets as two
+token buckets. The buckets are resized from the x-ratelimit-* response headers
+OpenAI returns on every call, so batches run as fast as the account allows,
+and all workers back off together (with jitter) on 429/503 responses.
+"""
+import random
+import re
+import threading
+import time
+
+import openai
+
+from .telemetry import note_retry
+
+# Conservative starting budgets until the first response headers arrive
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30000
+
+# Status codes that mean "slow down and try again"
+RETRYABLE_STATUS_CODES = (429, 503)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def estimate_tokens(text):
+    """
+    Rough token estimate (about 4 characters per token) used to reserve
+    tokens-per-minute budget before a request is sent
+    """
+    return max(1, len(text or "") // 4)
+
+
+def parse_reset_duration(value):
+    """
+    Parse an x-ratelimit-reset-* header such as "20ms", "1s" or "6m0s" into seconds.
+    Returns None if the value can't be parsed.
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """
+    A per-minute budget that refills continuously
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / 60.0)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """
+        Seconds until `amount` is available (0 if it already is)
+        """
+        # Requests larger than the whole bucket only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def consume(self, amount):
+        self.tokens -= amount
+
+    def update(self, limit, remaining, now):
+        """
+        Resize the bucket from the server's view of the budget
+        """
+        self.refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            # Our local count also covers requests still in flight, so never
+            # raise it above what we already have
+            self.tokens = min(self.tokens, float(remaining))
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter shared by every worker in the process.
+    Use call() to send an OpenAI request through the limiter.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until one request and `tokens` tokens fit in the budget, then reserve them
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(
+                    self.blocked_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(tokens)
+                )
+                if wait <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    return
+            time.sleep(min(wait, self.max_delay))
+
+    def update_from_headers(self, headers):
+        """
+        Update both buckets from the x-ratelimit-* headers of a response
+        """
+        if not headers:
+            return
+
+        def header_int(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        with self.lock:
+            now = time.monotonic()
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = header_int(f"x-ratelimit-limit-{kind}")
+                remaining = header_int(f"x-ratelimit-remaining-{kind}")
+                bucket.update(limit, remaining, now)
+
+                # Budget exhausted - hold everyone until the server says it resets
+                if remaining == 0:
+                    reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset:
+                        self.blocked_until = max(self.blocked_until, now + reset)
+
+    def backoff(self, attempt, headers=None):
+        """
+        Pause all workers after a 429/503 and return the delay used.
+        Honors Retry-After when present, otherwise exponential backoff with full jitter.
+        """
+        delay = None
+        if headers:
+            retry_after_ms = headers.get("retry-after-ms")
+            retry_after = headers.get("retry-after")
+            try:
+                if retry_after_ms:
+                    delay = float(retry_after_ms) / 1000.0
+                elif retry_after:
+                    delay = float(retry_after)
+            except ValueError:
+                delay = None
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, create_fn, estimated_tokens=1, **kwargs):
+        """
+        Send a request through the limiter and return the parsed response.
+        create_fn must be a with_raw_response method, e.g.
+        openai.chat.completions.with_raw_response.create, so the rate limit
+        headers can be read.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens)
+            try:
+                raw_response = create_fn(**kwargs)
+            except openai.APIStatusError as e:
+                if e.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                    raise
+                note_retry()
+                self.update_from_headers(e.response.headers)
+                self.backoff(attempt, e.response.headers)
+                continue
+            self.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
+
+# One limiter per process - every session and worker shares the account's budget
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_shared_limiter():
+    """
+    Return the process-wide RateLimiter, creating it on first use
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
@@ -0,0 +1,436 @@
+"""
+In-process similarity search over the licensees' stored embeddings.
+
+Each indexed embedding column is an L2-normalized float32 matrix with one row
+per licensee, kept in a memory-mapped file under
+.cache/similarity_index/<profile>. Opening the index does not read the
+matrices into memory, and processes on the same machine share them through
+the page cache. The row and input_hash of each uid are stored in a SQLite
+file beside the matrices.
+
+A query scores every row with one matrix-vector product and takes the top k
+with argpartition, which is a few milliseconds for tens of thousands of
+licensees. On larger tables an HNSW graph gives approximate answers instead,
+in well under a millisecond. The graph needs hnswlib, which is installed
+separately.
+
+refresh() brings the index up to date with the table. It reads only uid and
+input_hash for every row, and fetches embeddings only for rows that are new
+or changed. A pipeline or batch run in the same process adds its records as
+they are written (see index_written).
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from .category_embeddings import normalize_rows
+from .embedding_profiles import get_embedding_profile
+from .embeddings import profile_embed_fn
+from .licensee import EMBEDDING_COLUMNS
+from .supabase_writer import LICENSEES_TABLE
+from .telemetry import note_error
+
+try:
+    import hnswlib
+except ImportError:
+    # Optional: only needed for approximate search on large tables
+    hnswlib = None
+
+DEFAULT_INDEX_DIR = os.path.join(".cache", "similarity_index")
+
+# Column searched when none is given: the embedding of the whole combined summary
+DEFAULT_COLUMN = "combined_strategic_summary_embedding"
+
+DEFAULT_K = 10
+
+# exact: score every row
+# hnsw: search an HNSW graph (needs hnswlib)
+# auto: HNSW once a column has HNSW_MIN_ROWS vectors and hnswlib is installed, exact below that
+INDEX_KINDS = ("auto", "exact", "hnsw")
+HNSW_MIN_ROWS = 20000
+
+# Graph settings: links per node, and candidates kept while building and searching
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 200
+
+# Rows the matrices are sized for when created; they double as they fill up
+INITIAL_CAPACITY = 1024
+
+# Rows per request when reading uid/input_hash pairs and when fetching embeddings
+HASH_PAGE_SIZE = 1000
+FETCH_CHUNK_SIZE = 100
+
+
+class SimilarityIndex:
+    """
+    Memory-mapped embedding matrices of the licensees table for one embedding
+    profile, with the uid of each row
+    """
+
+    def __init__(self, embedding_profile=None, directory=DEFAULT_INDEX_DIR, kind="auto"):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind {kind!r}; expected one of {', '.join(INDEX_KINDS)}")
+        if kind == "hnsw" and hnswlib is None:
+            raise ValueError("HNSW search needs the hnswlib package (pip install hnswlib)")
+
+        self.profile = get_embedding_profile(embedding_profile)
+        # Every embedding column is indexed, so a refresh never leaves one behind the others
+        self.columns = EMBEDDING_COLUMNS
+        self.kind = kind
+        self.directory = os.path.join(directory, self.profile.name)
+        self.lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS rows (
+                uid TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                input_hash TEXT
+            )"""
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+        # Removed uids leave their row empty, so the rows of other uids and their HNSW labels never move
+        self.rows = {}
+        self.hashes = {}
+        self.uids = []
+        for uid, row, row_input_hash in self.conn.execute("SELECT uid, row, input_hash FROM rows ORDER BY row"):
+            self.uids.extend([None] * (row + 1 - len(self.uids)))
+            self.uids[row] = uid
+            self.rows[uid] = row
+            self.hashes[uid] = row_input_hash
+        self.count = len(self.uids)
+
+        row_bytes = 4 * self.profile.size
+        capacity = max([INITIAL_CAPACITY, self.count] + [
+            os.path.getsize(self._path(column, ".f32")) // row_bytes
+            for column in self.columns if os.path.exists(self._path(column, ".f32"))
+        ])
+        self.matrices = {column: self._open_matrix(column, capacity) for column in self.columns}
+        self.present = {column: self._present_rows(self.matrices[column]) for column in self.columns}
+        self.graphs = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, uid):
+        return str(uid) in self.rows
+
+    def _path(self, column, extension):
+        return os.path.join(self.directory, f"{column}{extension}")
+
+    def _open_matrix(self, column, capacity):
+        path = self._path(column, ".f32")
+        size = capacity * self.profile.size * 4
+        with open(path, "ab"):
+            pass
+        if os.path.getsize(path) < size:
+            os.truncate(path, size)
+        return np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self.profile.size))
+
+    def _present_rows(self, matrix):
+        # Rows without a vector are all zeros; scan in blocks so loading never copies a whole matrix
+        present = np.zeros(len(matrix), dtype=bool)
+        for start in range(0, self.count, 8192):
+            end = min(start + 8192, self.count)
+            present[start:end] = np.any(matrix[start:end] != 0, axis=1)
+        return present
+
+    def _reserve(self, rows):
+        capacity = len(self.matrices[self.columns[0]])
+        if rows <= capacity:
+            return
+        capacity = max(rows, 2 * capacity)
+        for column in self.columns:
+            self.matrices[column].flush()
+            self.matrices[column] = self._open_matrix(column, capacity)
+            self.present[column] = np.concatenate(
+                [self.present[column], np.zeros(capacity - len(self.present[column]), dtype=bool)]
+            )
+            if column in self.graphs:
+                self.graphs[column].resize_index(capacity)
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _commit(self, upserted=(), removed=()):
+        # Vectors reach the files before the rows that point at them
+        for matrix in self.matrices.values():
+            matrix.flush()
+        self.conn.executemany("INSERT OR REPLACE INTO rows (uid, row, input_hash) VALUES (?, ?, ?)", upserted)
+        self.conn.executemany("DELETE FROM rows WHERE uid = ?", [(uid,) for uid in removed])
+        self._set_meta("version", int(self._meta("version") or 0) + 1)
+        self.conn.commit()
+
+    def _vector(self, uid, column, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.profile.size,):
+            raise ValueError(f"{column} of {uid} has {vector.size} dimensions; the {self.profile.name} profile "
+                             f"stores {self.profile.size}")
+        return normalize_rows(vector)
+
+    def add(self, entries):
+        """
+        Index (uid, {column: vector}, input_hash) entries, replacing the
+        vectors of uids already indexed. A missing or None vector leaves the
+        uid out of that column's results.
+        """
+        # Check every vector before any row changes
+        prepared = {}
+        for uid, vectors, row_input_hash in entries:
+            uid = str(uid)
+            normalized = {}
+            for column in self.columns:
+                vector = vectors.get(column)
+                normalized[column] = None if vector is None else self._vector(uid, column, vector)
+            prepared[uid] = (normalized, row_input_hash)
+        if not prepared:
+            return
+
+        with self.lock:
+            self._reserve(self.count + sum(1 for uid in prepared if uid not in self.rows))
+            upserted = []
+            for uid, (vectors, row_input_hash) in prepared.items():
+                row = self.rows.get(uid)
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    self.uids.append(uid)
+                    self.rows[uid] = row
+                self.hashes[uid] = row_input_hash
+                upserted.append((uid, row, row_input_hash))
+                for column, vector in vectors.items():
+                    self._set_row(column, row, vector)
+            self._commit(upserted=upserted)
+
+    def _set_row(self, column, row, vector):
+        graph = self.graphs.get(column)
+        if vector is None:
+            # Rows without a vector are already zero; leaving them untouched keeps unused file pages sparse
+            if not self.present[column][row]:
+                return
+            if graph is not None:
+                graph.mark_deleted(row)
+            self.matrices[column][row] = 0
+            self.present[column][row] = False
+            return
+        self.matrices[column][row] = vector
+        self.present[column][row] = True
+        if graph is not None:
+            graph.add_items(vector[np.newaxis], [row])
+
+    def add_records(self, records):
+        """
+        Index licensee records as built by build_licensee_record or read
+        back from the table, with their vectors stored in this index's profile
+        """
+        self.add([(record["uid"], {column: self.profile.decode_record(record, column) for column in self.columns},
+                   record.get("input_hash")) for record in records])
+
+    def remove(self, uids):
+        """
+        Drop uids from the index. Their rows stay empty until the index is rebuilt.
+        """
+        with self.lock:
+            removed = [str(uid) for uid in uids if str(uid) in self.rows]
+            for uid in removed:
+                row = self.rows.pop(uid)
+                del self.hashes[uid]
+                self.uids[row] = None
+                for column in self.columns:
+                    self._set_row(column, row, None)
+            if removed:
+                self._commit(removed=removed)
+
+    def refresh(self, supabase_client, page_size=FETCH_CHUNK_SIZE, full=False):
+        """
+        Bring the index up to date with the licensees table. Every row's
+        input_hash is read to find the rows added or changed since they were
+        indexed, and only their embeddings are fetched. uids no longer in the
+        table are removed. full fetches every row's embeddings again, e.g.
+        after rows were re-enriched from unchanged inputs in another process.
+        Returns counts of "rows", "added", "updated" and "removed".
+        """
+        stored = {}
+        last_uid = None
+        while True:
+            query = supabase_client.table(LICENSEES_TABLE).select("uid,input_hash")
+            if last_uid is not None:
+                query = query.gt("uid", last_uid)
+            page = query.order("uid").limit(HASH_PAGE_SIZE).execute().data
+            if not page:
+                break
+            for record in page:
+                stored[str(record["uid"])] = record.get("input_hash")
+            last_uid = page[-1]["uid"]
+
+        with self.lock:
+            stale = [uid for uid, row_input_hash in stored.items()
+                     if full or uid not in self.rows or self.hashes.get(uid) != row_input_hash]
+            added = sum(1 for uid in stale if uid not in self.rows)
+            gone = [uid for uid in self.rows if uid not in stored]
+
+        columns = ["uid", "input_hash", *[name for column in self.columns
+                                          for name in self.profile.column_types(column)]]
+        for start in range(0, len(stale), page_size):
+            chunk = stale[start:start + page_size]
+            response = supabase_client.table(LICENSEES_TABLE).select(",".join(columns)).in_("uid", chunk).execute()
+            self.add_records(response.data)
+        self.remove(gone)
+        self.save()
+        return {"rows": len(stored), "added": added, "updated": len(stale) - added, "removed": len(gone)}
+
+    def _use_graph(self, column):
+        if self.kind == "exact" or hnswlib is None:
+            return False
+        return self.kind == "hnsw" or int(self.present[column][:self.count].sum()) >= HNSW_MIN_ROWS
+
+    def _graph(self, column):
+        """
+        The column's HNSW graph, loaded from disk if it was saved at the
+        current version of the index, otherwise built from the matrix
+        """
+        graph = self.graphs.get(column)
+        if graph is not None:
+            return graph
+        matrix = self.matrices[column]
+        graph = hnswlib.Index(space="ip", dim=self.profile.size)
+        path = self._path(column, ".hnsw")
+        if os.path.exists(path) and self._meta(f"hnsw_version:{column}") == self._meta("version"):
+            graph.load_index(path, max_elements=len(matrix))
+        else:
+            graph.init_index(max_elements=len(matrix), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            rows = np.flatnonzero(self.present[column][:self.count])
+            for start in range(0, len(rows), 10000):
+                chunk = rows[start:start + 10000]
+                graph.add_items(matrix[chunk], chunk)
+        self.graphs[column] = graph
+        return graph
+
+    def query(self, vector, k=DEFAULT_K, column=DEFAULT_COLUMN, exclude=()):
+        """
+        The k indexed licensees most similar to vector in column, as (uid,
+        cosine similarity) pairs with the most similar first. uids in exclude
+        are left out.
+        """
+        if column not in self.matrices:
+            raise ValueError(f"{column} is not indexed")
+        vector = self._vector("the query", column, vector)
+        with self.lock:
+            skip = [self.rows[str(uid)] for uid in exclude if str(uid) in self.rows]
+            if self._use_graph(column):
+                return self._query_graph(column, vector, k, skip)
+            return self._query_exact(column, vector, k, skip)
+
+    def _query_exact(self, column, vector, k, skip):
+        scores = self.matrices[column][:self.count] @ vector
+        scores[~self.present[column][:self.count]] = -np.inf
+        scores[skip] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.uids[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+    def _query_graph(self, column, vector, k, skip):
+        graph = self._graph(column)
+        candidates = min(k + len(skip), int(self.present[column][:self.count].sum()))
+        if candidates <= 0:
+            return []
+        graph.set_ef(max(HNSW_EF_SEARCH, candidates))
+        labels, distances = graph.knn_query(vector, k=candidates)
+        skip = set(skip)
+        # Inner-product distance is 1 - similarity
+        return [(self.uids[row], float(1 - distance)) for row, distance in zip(labels[0], distances[0])
+                if row not in skip][:k]
+
+    def similar_to(self, uid, k=DEFAULT_K, column=DEFAULT_COLUMN):
+        """
+        The k licensees most similar to an indexed one, leaving it out
+        """
+        with self.lock:
+            row = self.rows.get(str(uid))
+            if row is None or not self.present[column][row]:
+                raise ValueError(f"No {column} indexed for {uid}")
+            vector = np.array(self.matrices[column][row])
+        return self.query(vector, k, column, exclude=[uid])
+
+    def search_text(self, text, k=DEFAULT_K, column=DEFAULT_COLUMN, client=None):
+        """
+        The k licensees most similar to a text, embedded with the index's profile
+        """
+        vector = profile_embed_fn(self.profile, client)([text])[0]
+        if vector is None:
+            raise ValueError("Nothing to search for")
+        return self.query(vector, k, column)
+
+    def save(self):
+        """
+        Write the matrices and any HNSW graphs to disk, so the next open
+        doesn't rebuild the graphs
+        """
+        with self.lock:
+            for matrix in self.matrices.values():
+                matrix.flush()
+            version = self._meta("version")
+            for column, graph in self.graphs.items():
+                graph.save_index(self._path(column, ".hnsw"))
+                self._set_meta(f"hnsw_version:{column}", version)
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "licensees": len(self.rows),
+                "profile": self.profile.name,
+                "vectors": {column: int(self.present[column][:self.count].sum()) for column in self.columns},
+                "hnsw": [column for column in self.columns if self._use_graph(column)],
+                "bytes": self.count * 4 * self.profile.size * len(self.columns)
+            }
+
+
+# Indexes are shared by every session and worker, one per embedding profile
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_similarity_index(embedding_profile=None):
+    """
+    Process-wide SimilarityIndex for an embedding profile, opened on first use
+    """
+    profile = get_embedding_profile(embedding_profile)
+    with _indexes_lock:
+        if profile.name not in _indexes:
+            _indexes[profile.name] = SimilarityIndex(profile)
+        return _indexes[profile.name]
+
+
+def index_written(records, embedding_profile=None):
+    """
+    Add records just written to the licensees table to the process-wide
+    index of their profile, if one has been opened. A record that can't be
+    indexed is reported, and refresh() picks it up later; the write itself
+    has already succeeded.
+    """
+    profile = get_embedding_profile(embedding_profile)
+    with _indexes_lock:
+        index = _indexes.get(profile.name)
+    if index is None or not records:
+        return
+    try:
+        index.add_records(records)
+    except Exception as e:
+        print(f"Error indexing written records: {e}")
+        note_error(f"Similarity index: {e}")
@@ -0,0 +1,54 @@
+"""
+Persistence stage: writes licensee records to Supabase.
+
+Records are upserted on the uid column, so a write is one round trip with no
+select beforehand. In batch mode the write stage upserts finished records in
+chunks with write_records, which reports the outcome of every row.
+"""
+from postgrest.types import ReturnMethod
+
+LICENSEES_TABLE = "licensees"
+
+DEFAULT_CHUNK_SIZE = 200
+MAX_CHUNK_SIZE = 1000
+
+
+def upsert_licensees(supabase, records):
+    """
+    Insert or update records by uid in a single request.
+    Requires a unique constraint on licensees.uid.
+    """
+    supabase.table(LICENSEES_TABLE).upsert(
+        records,
+        on_conflict="uid",
+        returning=ReturnMethod.minimal
+    ).execute()
+
+
+def make_write_outcome(uid, success, message=""):
+    return {"uid": uid, "success": success, "message": message}
+
+
+def write_records(supabase, records):
+    """
+    Upsert a chunk of records, returning one write outcome per record.
+    If the chunk is rejected, rows are retried one by one so only the bad
+    rows are reported as failed.
+    """
+    # Postgres rejects an upsert that touches the same uid twice, so keep the latest record per uid
+    latest = {}
+    for record in records:
+        latest[record["uid"]] = record
+
+    try:
+        upsert_licensees(supabase, list(latest.values()))
+        return [make_write_outcome(record["uid"], True) for record in records]
+    except Exception:
+        results = {}
+        for uid, record in latest.items():
+            try:
+                upsert_licensees(supabase, [record])
+                results[uid] = make_write_outcome(uid, True)
+            except Exception as e:
+                results[uid] = make_write_outcome(uid, False, str(e))
+        return [results[record["uid"]] for record in records]
@@ -0,0 +1,289 @@
+"""
+Timing spans and metrics for the enrichment stages.
+
+Each stage call runs inside a span that records the stage, the uids it
+worked on, its duration, the HTTP requests it made (with bytes sent and
+received, counted by hooks on the pooled httpx clients), the retries the rate
+limiter needed and any errors. Finished spans are aggregated per stage into
+duration histograms and counters, which can be exported as OpenMetrics text
+(to a file or over HTTP), and optionally appended to a JSONL trace log.
+
+The current span is tracked per thread, so code deep inside a stage (the rate
+limiter, the HTTP hooks, error handlers) can add to it without passing it
+around.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the stage duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Counters kept per stage, with their OpenMetrics help text
+COUNTERS = {
+    "spans": "Stage calls",
+    "records": "Records processed",
+    "errors": "Errors recorded, one per failed record",
+    "requests": "HTTP requests sent",
+    "retries": "Requests retried after a 429 or 503",
+    "sent_bytes": "HTTP request bytes sent",
+    "received_bytes": "HTTP response bytes received"
+}
+
+_local = threading.local()
+
+
+class Span:
+    """
+    One timed call of a stage
+    """
+
+    def __init__(self, stage, uids):
+        self.stage = stage
+        self.uids = [str(uid) for uid in uids]
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.requests = 0
+        self.retries = 0
+        self.sent_bytes = 0
+        self.received_bytes = 0
+        self.errors = []
+
+    def error(self, message, uid=None):
+        self.errors.append({"uid": uid, "error": str(message)} if uid is not None else {"error": str(message)})
+
+    def as_dict(self):
+        return {
+            "time": round(self.started_at, 6),
+            "stage": self.stage,
+            "uids": self.uids,
+            "duration": round(self.duration, 6),
+            "requests": self.requests,
+            "retries": self.retries,
+            "sent_bytes": self.sent_bytes,
+            "received_bytes": self.received_bytes,
+            "errors": self.errors
+        }
+
+
+def current_span():
+    """
+    The span running on this thread, or None
+    """
+    return getattr(_local, "span", None)
+
+
+def note_retry():
+    span = current_span()
+    if span:
+        span.retries += 1
+
+
+def note_error(message, uid=None):
+    span = current_span()
+    if span:
+        span.error(message, uid)
+
+
+def _header_bytes(headers):
+    try:
+        return int(headers.get("content-length") or 0)
+    except ValueError:
+        return 0
+
+
+def record_request(request):
+    """
+    httpx request hook: count the request and its body size on the current span
+    """
+    span = current_span()
+    if span:
+        span.requests += 1
+        span.sent_bytes += _header_bytes(request.headers)
+
+
+def record_response(response):
+    """
+    httpx response hook: count the response body size on the current span
+    """
+    span = current_span()
+    if span:
+        span.received_bytes += _header_bytes(response.headers)
+
+
+class StageStats:
+    """
+    Duration histogram and counters of one stage
+    """
+
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+
+class Tracer:
+    """
+    Collects finished spans into per-stage stats and, when a trace file is
+    open, writes each one as a JSON line. Thread-safe.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.stages = {}
+        self.trace_file = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, uids=()):
+        """
+        Time the block as a call of stage. An exception escaping the block is
+        recorded as an error on the span and re-raised.
+        """
+        span = Span(stage, uids)
+        parent = current_span()
+        _local.span = span
+        try:
+            yield span
+        except Exception as e:
+            span.error(e)
+            raise
+        finally:
+            _local.span = parent
+            span.duration = time.perf_counter() - span.started
+            self.finish(span)
+
+    def finish(self, span):
+        with self.lock:
+            stats = self.stages.get(span.stage)
+            if stats is None:
+                stats = self.stages[span.stage] = StageStats(self.buckets)
+            for index, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    stats.bucket_counts[index] += 1
+                    break
+            stats.count += 1
+            stats.sum += span.duration
+            counters = stats.counters
+            counters["spans"] += 1
+            counters["records"] += len(span.uids)
+            counters["errors"] += len(span.errors)
+            counters["requests"] += span.requests
+            counters["retries"] += span.retries
+            counters["sent_bytes"] += span.sent_bytes
+            counters["received_bytes"] += span.received_bytes
+            if self.trace_file:
+                self.trace_file.write(json.dumps(span.as_dict()) + "\n")
+
+    def open_trace(self, path):
+        """
+        Append every span finished from now on to a JSONL file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            self.trace_file = open(path, "a", encoding="utf-8")
+
+    def close_trace(self):
+        with self.lock:
+            if self.trace_file:
+                self.trace_file.close()
+                self.trace_file = None
+
+    def summary(self):
+        """
+        Per-stage call count, total and mean duration and counters
+        """
+        with self.lock:
+            return {
+                stage: {"calls": stats.count, "seconds": round(stats.sum, 3),
+                        "mean_seconds": round(stats.sum / stats.count, 4) if stats.count else 0.0,
+                        **stats.counters}
+                for stage, stats in self.stages.items()
+            }
+
+    def openmetrics(self):
+        """
+        The stage stats in the OpenMetrics text format
+        """
+        lines = [
+            "# TYPE licensee_stage_duration_seconds histogram",
+            "# UNIT licensee_stage_duration_seconds seconds",
+            "# HELP licensee_stage_duration_seconds Duration of each stage call"
+        ]
+        with self.lock:
+            stages = sorted(self.stages.items())
+            for stage, stats in stages:
+                cumulative = 0
+                for bound, count in zip(self.buckets, stats.bucket_counts):
+                    cumulative += count
+                    lines.append(f'licensee_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'licensee_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+                lines.append(f'licensee_stage_duration_seconds_count{{stage="{stage}"}} {stats.count}')
+                lines.append(f'licensee_stage_duration_seconds_sum{{stage="{stage}"}} {stats.sum:.6f}')
+            for name, help_text in COUNTERS.items():
+                lines.append(f"# TYPE licensee_stage_{name} counter")
+                lines.append(f"# HELP licensee_stage_{name} {help_text}")
+                for stage, stats in stages:
+                    lines.append(f'licensee_stage_{name}_total{{stage="{stage}"}} {stats.counters[name]}')
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_openmetrics(self, path):
+        """
+        Write the OpenMetrics text to path, replacing it atomically so scrapers never read half a file
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as output:
+            output.write(self.openmetrics())
+        os.replace(temp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serve the OpenMetrics text at http://host:port/metrics on a background thread.
+        Returns the server; call shutdown() on it to stop.
+        """
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.openmetrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+
+# One tracer per process, shared by every pipeline and session
+_shared_tracer = None
+_shared_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """
+    Return the process-wide Tracer, creating it on first use
+    """
+    global _shared_tracer
+    with _shared_tracer_lock:
+        if _shared_tracer is None:
+            _shared_tracer = Tracer()
+        return _shared_tracer
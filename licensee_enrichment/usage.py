@@ -0,0 +1,233 @@
+"""
+Token and cost accounting, and budget ceilings.
+
+Chat and embedding calls report the usage block of each response
+(record_usage) to the meter open on the calling thread, so a pipeline stage
+can attribute prompt, completion and embedding tokens, and their estimated
+dollar cost, to the records it is working on without passing counters down
+through every call. Prompt tokens served from OpenAI's prompt cache are
+counted separately (cached_tokens, part of prompt_tokens) and billed at the
+cached input price. Dollars are estimated from MODEL_PRICES.
+
+A CostBudget caps what one run may spend. Every enrichment request reserves
+its worst-case cost (estimated prompt plus max_tokens) before it is sent and
+settles to its actual cost when the usage comes back. Near the ceiling,
+requests wait for the ones in flight to settle instead of going out
+together, so the run slows down; once a request would not fit even with
+nothing in flight, BudgetExceeded is raised and the run pauses. Embeddings
+are counted but never held back, so rows already paid for are still saved.
+"""
+import threading
+from contextlib import contextmanager
+
+# Estimated prices in USD per million tokens: (input, cached input, output)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "text-embedding-ada-002": (0.10, 0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.13, 0.0)
+}
+
+# Batch API requests are billed at half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+# Usage counted per record, as added to row outcomes
+USAGE_FIELDS = ("prompt_tokens", "cached_tokens", "completion_tokens", "embedding_tokens", "cost")
+
+_local = threading.local()
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised instead of sending a request that would take a run over its budget
+    """
+
+
+def empty_usage():
+    return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "embedding_tokens": 0, "cost": 0.0}
+
+
+def add_usage(total, usage):
+    """
+    Add usage into total in place and return total
+    """
+    for name in USAGE_FIELDS:
+        total[name] += usage[name]
+    return total
+
+
+def estimate_cost(model, input_tokens, output_tokens=0, batch=False, cached_tokens=0):
+    """
+    Estimated USD cost of a request to model. cached_tokens of the input_tokens came from the prompt cache.
+    """
+    input_price, cached_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0, 0.0))
+    cost = ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + output_tokens * output_price) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+def cached_share(usage):
+    """
+    Share of the prompt tokens in usage that were served from the prompt cache
+    """
+    return usage["cached_tokens"] / usage["prompt_tokens"] if usage["prompt_tokens"] else 0.0
+
+
+def _count(usage, name):
+    # Usage arrives as an SDK object from the API or as a dict from Batch API result files
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return value or 0
+
+
+def response_usage(model, usage, embedding=False, batch=False):
+    """
+    The usage block of a chat or embeddings response as a usage dict with its cost
+    """
+    prompt_tokens = _count(usage, "prompt_tokens") if usage else 0
+    completion_tokens = _count(usage, "completion_tokens") if usage else 0
+    details = _count(usage, "prompt_tokens_details") if usage else None
+    cached_tokens = _count(details, "cached_tokens") if details else 0
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, batch, cached_tokens)
+    if embedding:
+        return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "embedding_tokens": prompt_tokens,
+                "cost": cost}
+    return {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens, "completion_tokens": completion_tokens,
+            "embedding_tokens": 0, "cost": cost}
+
+
+def split_usage(usage, weights):
+    """
+    Divide usage between records in proportion to weights. Token counts stay
+    whole numbers and the shares add up to the original.
+    """
+    total = sum(weights)
+    if not total:
+        weights = [1] * len(weights)
+        total = len(weights)
+    shares = []
+    cumulative = 0
+    previous = dict.fromkeys(USAGE_FIELDS, 0)
+    for weight in weights:
+        cumulative += weight
+        share = {}
+        for name in USAGE_FIELDS:
+            upto = usage[name] * cumulative / total
+            if name != "cost":
+                upto = round(upto)
+            share[name] = upto - previous[name]
+            previous[name] = upto
+        shares.append(share)
+    return shares
+
+
+class CostBudget:
+    """
+    A ceiling in USD on what a run may spend, shared by all of its workers
+    """
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.spent = 0.0
+        self.reserved = 0.0
+        self.in_flight = 0
+        self.exceeded = False
+        self.condition = threading.Condition()
+
+    def reserve(self, cost):
+        """
+        Hold cost for a request about to be sent, waiting while requests in
+        flight might free enough room. Raises BudgetExceeded if it can't fit.
+        """
+        with self.condition:
+            while not self.exceeded and self.spent + self.reserved + cost > self.limit:
+                if not self.in_flight:
+                    self.exceeded = True
+                    self.condition.notify_all()
+                    break
+                self.condition.wait()
+            if self.exceeded:
+                raise BudgetExceeded(f"Paused at the budget ceiling of ${self.limit:.2f} (${self.spent:.4f} spent)")
+            self.reserved += cost
+            self.in_flight += 1
+
+    def try_reserve(self, cost):
+        """
+        Hold cost without waiting; False if it would go over the ceiling
+        """
+        with self.condition:
+            if self.spent + self.reserved + cost > self.limit:
+                self.exceeded = True
+                return False
+            self.reserved += cost
+            self.in_flight += 1
+            return True
+
+    def release(self, cost):
+        """
+        Give back a reservation once its request has finished and its usage been charged
+        """
+        with self.condition:
+            self.reserved -= cost
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def charge(self, cost):
+        with self.condition:
+            self.spent += cost
+
+
+class _Meter:
+    def __init__(self, budget):
+        self.usage = empty_usage()
+        self.budget = budget
+
+
+@contextmanager
+def metering(budget=None):
+    """
+    Collect the usage of every call made on this thread inside the block into
+    the usage dict it yields. Requests are held to budget (a CostBudget), or
+    to the budget of an enclosing meter.
+    """
+    parent = getattr(_local, "meter", None)
+    meter = _Meter(budget if budget is not None else (parent.budget if parent else None))
+    _local.meter = meter
+    try:
+        yield meter.usage
+    finally:
+        _local.meter = parent
+        if parent:
+            add_usage(parent.usage, meter.usage)
+
+
+def record_usage(model, usage, embedding=False, batch=False):
+    """
+    Charge a response's usage to the current meter and its budget. Returns the usage dict.
+    """
+    used = response_usage(model, usage, embedding, batch)
+    meter = getattr(_local, "meter", None)
+    if meter:
+        add_usage(meter.usage, used)
+        if meter.budget:
+            meter.budget.charge(used["cost"])
+    return used
+
+
+@contextmanager
+def reserving(model, input_tokens, output_tokens=0):
+    """
+    Reserve the worst-case cost of one request against the current meter's
+    budget while the block sends it. Raises BudgetExceeded if it won't fit.
+    """
+    meter = getattr(_local, "meter", None)
+    budget = meter.budget if meter else None
+    if budget is None:
+        yield
+        return
+    cost = estimate_cost(model, input_tokens, output_tokens)
+    budget.reserve(cost)
+    try:
+        yield
+    finally:
+        budget.release(cost)
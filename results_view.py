@@ -0,0 +1,138 @@
+"""
+Progress and results display for background batch jobs.
+
+Batches run in the JobRunner, so the page polls the JobStore instead of
+redrawing after every row. An active job is re-read every POLL_INTERVAL
+seconds in a fragment, showing its progress and only the most recent row
+outcomes; the full results table is rendered once the job has finished, and
+built once per finished run rather than on every rerun of the page.
+"""
+import pandas as pd
+import streamlit as st
+
+from licensee_enrichment.embedding_cache import get_shared_cache
+from licensee_enrichment.job_store import ACTIVE_STATUSES, RESUMABLE_STATUSES, RESULT_FIELDS
+from licensee_enrichment.usage import cached_share
+
+# Seconds between polls of an active job
+POLL_INTERVAL = 2.0
+
+# Most recent outcomes shown while a job is running
+LIVE_TABLE_ROWS = 200
+
+# Rows rendered in the final table; the rest are available as a download
+FINAL_TABLE_MAX_ROWS = 10000
+
+# Session state key of the selected job
+JOB_SELECT_KEY = "batch_job_select"
+
+
+def _job_label(job):
+    label = f"{job['id']} - {job['status']} ({job['processed']} of {job['total_rows']})"
+    return f"{label} {job['source']}" if job["source"] else label
+
+
+def _results_frame(outcomes):
+    return pd.DataFrame(outcomes, columns=RESULT_FIELDS)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _finished_results(_store, job_id, finished_at):
+    """
+    The results table and full CSV of a finished job. finished_at changes
+    when a resumed job finishes again, so it gets rebuilt then.
+    """
+    table = _results_frame(_store.results(job_id, limit=FINAL_TABLE_MAX_ROWS))
+    results_csv = _results_frame(_store.results(job_id)).to_csv(index=False).encode("utf-8")
+    return table, results_csv
+
+
+def _usage_caption(job):
+    budget = job["options"].get("budget")
+    caption = (f"Tokens: {job['prompt_tokens']:,} prompt ({cached_share(job):.0%} from the prompt cache), "
+               f"{job['completion_tokens']:,} completion, {job['embedding_tokens']:,} embedding - "
+               f"estimated cost ${job['cost']:.4f}")
+    return f"{caption} (budget ${budget:.2f} per run)" if budget else caption
+
+
+def render_jobs_panel(runner, resume_job=None):
+    """
+    Pick one of the recent jobs and show its progress and results.
+    Set st.session_state[JOB_SELECT_KEY] to a job id before calling to select it.
+    resume_job(job_id) resumes a stopped job; without it no resume action is offered.
+    """
+    st.write("### Batch Jobs")
+    jobs = runner.store.list_jobs()
+    if not jobs:
+        st.info("No batch jobs yet. Submitted batches run in the background and appear here.")
+        return
+
+    job_ids = [job["id"] for job in jobs]
+    labels = {job["id"]: _job_label(job) for job in jobs}
+    if st.session_state.get(JOB_SELECT_KEY) not in job_ids:
+        st.session_state.pop(JOB_SELECT_KEY, None)
+    job_id = st.selectbox("Job", job_ids, format_func=lambda job_id: labels[job_id], key=JOB_SELECT_KEY)
+
+    job = runner.store.get_job(job_id)
+    if job["status"] in ACTIVE_STATUSES:
+        _render_active_job(runner, job_id)
+    else:
+        _render_finished_job(runner.store, job, resume_job)
+
+
+@st.fragment(run_every=POLL_INTERVAL)
+def _render_active_job(runner, job_id):
+    job = runner.store.get_job(job_id)
+    if job["status"] not in ACTIVE_STATUSES:
+        # Redraw the whole page once so the finished view replaces this polling one
+        st.rerun(scope="app")
+
+    st.progress(min(1.0, job["processed"] / max(job["total_rows"], 1)))
+    st.text(f"{job['status'].capitalize()}: processed {job['processed']} of {job['total_rows']} - "
+            f"{job['succeeded']} succeeded, {job['failed']} failed, {job['skipped']} skipped as unchanged")
+    st.caption(_usage_caption(job))
+    st.dataframe(_results_frame(runner.store.results(job_id, limit=LIVE_TABLE_ROWS, latest=True)))
+
+    if job["status"] != "cancelling" and st.button("Cancel job", key=f"cancel_{job_id}"):
+        runner.cancel(job_id)
+        st.rerun(scope="fragment")
+
+
+def _render_finished_job(store, job, resume_job):
+    st.progress(1.0 if job["status"] == "completed" else min(1.0, job["processed"] / max(job["total_rows"], 1)))
+    st.text(f"Processing {job['status']}: {job['succeeded']} succeeded, {job['failed']} failed, "
+            f"{job['skipped']} skipped as unchanged")
+    if job["status"] == "failed":
+        st.error(f"Job failed: {job['error']}")
+    elif job["status"] == "interrupted":
+        st.warning("The job was interrupted when the app restarted.")
+    elif job["status"] == "paused":
+        st.warning("The job paused at its budget ceiling. Rows marked paused were not enriched; "
+                   "resuming runs them with the same ceiling again.")
+    st.caption(_usage_caption(job))
+
+    if job["status"] in RESUMABLE_STATUSES:
+        stages = store.checkpoint_counts(job["id"])
+        st.caption(f"Checkpoints: {stages['enriched']} rows enriched, {stages['embedded']} embedded, "
+                   f"{stages['persisted']} persisted")
+        if resume_job and st.button("Resume batch", key=f"resume_{job['id']}"):
+            if resume_job(job["id"]):
+                st.rerun()
+            st.error("This job can't be resumed - its uploaded file is no longer available.")
+
+    table, results_csv = _finished_results(store, job["id"], job["finished_at"])
+    st.dataframe(table)
+    if job["processed"] > FINAL_TABLE_MAX_ROWS:
+        st.caption(f"Showing the first {FINAL_TABLE_MAX_ROWS} of {job['processed']} results - download the full results below")
+    st.download_button("Download full results", data=results_csv,
+                       file_name=f"batch_results_{job['id']}.csv", mime="text/csv", key=f"download_{job['id']}")
+
+    # Show how much embedding work the cache saved
+    cache_stats = get_shared_cache().stats()
+    st.caption(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+               f"({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']} cached vectors)")
+
+    if job["succeeded"] > 0:
+        st.success(f"Successfully processed {job['succeeded']} licensees!")
+    if job["failed"] > 0:
+        st.warning(f"Failed to process {job['failed']} licensees. See results table for details.")
@@ -0,0 +1,74 @@
+"""
+"Find similar licensees" panel.
+
+Searches the process-wide SimilarityIndex of the stored embeddings, so a
+query takes milliseconds. The index is filled from Supabase the first time
+(Refresh index) and then kept current by every enrichment this app runs.
+Licensees written by other processes are picked up by the next refresh.
+"""
+import time
+
+import pandas as pd
+import streamlit as st
+
+from licensee_enrichment.licensee import EMBEDDING_COLUMNS
+from licensee_enrichment.similarity_index import DEFAULT_COLUMN, DEFAULT_K, get_similarity_index
+from licensee_enrichment.supabase_writer import LICENSEES_TABLE
+
+# Columns shown next to each neighbor
+DETAIL_COLUMNS = ["uid", "brand_name", "business_category", "primary_licensing_category", "price_positioning"]
+
+
+def _column_label(column):
+    return column[:-len("_embedding")].replace("_", " ").capitalize()
+
+
+def _neighbors_frame(supabase_client, neighbors):
+    uids = [uid for uid, _ in neighbors]
+    response = supabase_client.table(LICENSEES_TABLE).select(",".join(DETAIL_COLUMNS)).in_("uid", uids).execute()
+    details = {str(record["uid"]): record for record in response.data}
+    return pd.DataFrame([{**details.get(uid, {"uid": uid}), "similarity": round(score, 4)}
+                         for uid, score in neighbors], columns=DETAIL_COLUMNS + ["similarity"])
+
+
+def render_similarity_panel(openai_client, supabase_client):
+    """
+    Search the licensees most similar to a stored one or to a description
+    """
+    st.write("### Find Similar Licensees")
+    index = get_similarity_index()
+    st.caption(f"{len(index)} licensees indexed ({index.profile.name} embeddings)")
+    if st.button("Refresh index", help="Fetch the licensees added or changed in Supabase since the last refresh"):
+        with st.spinner("Refreshing the similarity index..."):
+            counts = index.refresh(supabase_client)
+        st.success(f"{counts['added']} added, {counts['updated']} updated, {counts['removed']} removed")
+    if not len(index):
+        st.info("The index is empty - refresh it to search the licensees in Supabase.")
+        return
+
+    with st.form("similar_form"):
+        search_by = st.radio("Search by", ["Licensee UID", "Description"], horizontal=True)
+        query = st.text_input("UID or description")
+        col1, col2 = st.columns(2)
+        with col1:
+            column = st.selectbox("Compare", EMBEDDING_COLUMNS, index=EMBEDDING_COLUMNS.index(DEFAULT_COLUMN),
+                                  format_func=_column_label)
+        with col2:
+            k = st.number_input("Results", min_value=1, max_value=100, value=DEFAULT_K)
+        search = st.form_submit_button("Search")
+
+    if not (search and query.strip()):
+        return
+    started = time.monotonic()
+    try:
+        if search_by == "Licensee UID":
+            neighbors = index.similar_to(query.strip(), int(k), column)
+        else:
+            neighbors = index.search_text(query, int(k), column, client=openai_client)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    elapsed = time.monotonic() - started
+    st.caption(f"{len(neighbors)} results in {elapsed * 1000:.1f} ms")
+    if neighbors:
+        st.dataframe(_neighbors_frame(supabase_client, neighbors))
@@ -0,0 +1,58 @@
+"""
+Shared fixtures. Tests that go over HTTP run against the stand-in OpenAI and
+Supabase endpoints of benchmarks/mock_services.py.
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import mock_services  # noqa: E402
+from licensee_enrichment import embedding_cache, enrichment_cache  # noqa: E402
+from licensee_enrichment.clients import create_openai_client, create_supabase_client  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    """
+    Keep each test's .cache directory and shared caches to itself
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(enrichment_cache, "_shared_cache",
+                        enrichment_cache.EnrichmentCache(str(tmp_path / "enrichment.sqlite3")))
+    monkeypatch.setattr(embedding_cache, "_shared_cache",
+                        embedding_cache.EmbeddingCache(str(tmp_path / "embeddings.sqlite3")))
+
+
+@pytest.fixture
+def start_services():
+    """
+    Start the mock services with a MockConfig's keyword arguments. Returns
+    their state (request counts, stored licensees) with pooled clients for
+    them; every server started is shut down after the test.
+    """
+    servers = []
+
+    def start(**config):
+        config.setdefault("seed", 0)
+        server, url = mock_services.start_server(0, mock_services.MockConfig(**config))
+        servers.append(server)
+        return SimpleNamespace(
+            state=server.RequestHandlerClass.state,
+            openai_client=create_openai_client("sk-test").with_options(base_url=f"{url}/v1"),
+            supabase_client=create_supabase_client(url, "test-" + "k" * 40)
+        )
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def services(start_services):
+    return start_services()
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from licensee_enrichment.cli import main
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    for name, value in (("OPENAI_API_KEY", "sk-test"), ("SUPABASE_URL", "http://127.0.0.1:9"),
+                        ("SUPABASE_KEY", "test-" + "k" * 40)):
+        monkeypatch.setenv(name, value)
+
+
+def _events(stderr):
+    return [json.loads(line) for line in stderr.splitlines() if line.strip()]
+
+
+@pytest.mark.parametrize("content", [b"", b"\n\n"])
+def test_empty_csv_exits_with_bad_input_status(credentials, tmp_path, capsys, content):
+    path = tmp_path / "input.csv"
+    path.write_bytes(content)
+    with pytest.raises(SystemExit) as exit_info:
+        main(["run", str(path)])
+    assert exit_info.value.code == 2
+    events = _events(capsys.readouterr().err)
+    assert [event["event"] for event in events] == ["error"]
+    assert "CSV header" in events[0]["message"]
+
+
+def test_missing_columns_exit_with_bad_input_status(credentials, tmp_path, capsys):
+    path = tmp_path / "input.csv"
+    path.write_text("uid,brand_name\n1,Acme\n")
+    with pytest.raises(SystemExit) as exit_info:
+        main(["run", str(path)])
+    assert exit_info.value.code == 2
+    assert _events(capsys.readouterr().err)[0]["message"] == "Missing required columns: website"
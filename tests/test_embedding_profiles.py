@@ -0,0 +1,187 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from licensee_enrichment import embedding_migration
+from licensee_enrichment.embedding_migration import migrate_embeddings, migration_sql, unmigrated_rows
+from licensee_enrichment.embedding_profiles import (EMBEDDING_PROFILES, INT8_MAX, dequantize_int8,
+                                                    get_embedding_profile, quantize_int8)
+from licensee_enrichment.licensee import EMBEDDING_COLUMNS, embedding_text_fields
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_int8_round_trip_is_within_half_a_step(rng):
+    vector = rng.standard_normal(512).astype(np.float32)
+    values, scale = quantize_int8(vector)
+    assert values.dtype == np.int8
+    assert np.abs(values).max() == INT8_MAX
+    restored = dequantize_int8(values, scale)
+    assert np.abs(restored - vector).max() <= scale / 2 + 1e-6
+    assert np.dot(restored, vector) / (np.linalg.norm(restored) * np.linalg.norm(vector)) > 0.999
+
+
+@pytest.mark.parametrize("vector", [np.zeros(8), np.zeros(0)])
+def test_int8_of_zero_or_empty_vector(vector):
+    values, scale = quantize_int8(vector)
+    assert scale == 1.0
+    assert not dequantize_int8(values, scale).any()
+
+
+@pytest.mark.parametrize("name", list(EMBEDDING_PROFILES))
+def test_encode_decode_round_trip_through_json(name, rng):
+    profile = get_embedding_profile(name)
+    vector = rng.standard_normal(profile.size).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    record = profile.encode_embeddings({"a_embedding": vector, "b_embedding": None})
+    assert set(record) == {*profile.column_types("a_embedding"), *profile.column_types("b_embedding")}
+
+    # As read back through PostgREST: vectors as text, bytea as hex text
+    stored = json.loads(json.dumps({key: json.dumps(value) if isinstance(value, list) else value
+                                    for key, value in record.items()}))
+    restored = profile.decode_record(stored, "a_embedding")
+    tolerance = {"float32": 1e-7, "float16": 1e-3, "int8": 0.5 / INT8_MAX}[profile.storage]
+    assert restored.shape == (profile.size,)
+    assert np.abs(restored - vector).max() <= tolerance
+    assert profile.decode_record(stored, "b_embedding") is None
+
+
+def test_profile_lookup(monkeypatch):
+    monkeypatch.delenv("EMBEDDING_PROFILE", raising=False)
+    assert get_embedding_profile().name == "ada-002"
+    monkeypatch.setenv("EMBEDDING_PROFILE", "3-small-512-int8")
+    assert get_embedding_profile().name == "3-small-512-int8"
+    assert get_embedding_profile("ada-002-int8").same_vectors(get_embedding_profile("ada-002"))
+    assert not get_embedding_profile("3-small-512").same_vectors(get_embedding_profile("3-small"))
+    with pytest.raises(ValueError):
+        get_embedding_profile("ada-003")
+
+
+class _Table:
+    """
+    The PostgREST query builder calls a migration makes, over a dict of rows by uid
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.columns = None
+        self.values = None
+        self.count = None
+
+    def select(self, columns):
+        self.columns = columns.split(",")
+        return self
+
+    def update(self, values):
+        self.values = values
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row[column] == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row[column] > value)
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        rows = sorted((row for row in self.rows.values() if all(test(row) for test in self.filters)),
+                      key=lambda row: row["uid"])
+        if self.values is not None:
+            for row in rows:
+                row.update(self.values)
+            return SimpleNamespace(data=rows)
+        return SimpleNamespace(data=[{column: row.get(column) for column in self.columns}
+                                     for row in rows[:self.count]])
+
+
+@pytest.fixture
+def table():
+    fields = [field_name for field_name, _ in embedding_text_fields({})]
+    rows = {f"u{uid:02d}": {"uid": f"u{uid:02d}", **{field: f"{field} of {uid}" for field in fields}}
+            for uid in range(12)}
+    return SimpleNamespace(rows=rows, fields=fields, table=lambda name: _Table(rows))
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    """
+    Stand-in for the embeddings endpoint: no vector for texts containing BAD, raises while down
+    """
+    state = SimpleNamespace(down=False, calls=0)
+
+    def profile_embed_fn(profile, client=None):
+        def embed(texts):
+            state.calls += 1
+            if state.down:
+                raise RuntimeError("embeddings down")
+            return [None if "BAD" in text else np.ones(profile.size, dtype=np.float32) for text in texts]
+        return embed
+    monkeypatch.setattr(embedding_migration, "profile_embed_fn", profile_embed_fn)
+    return state
+
+
+def test_migration_sql_adds_then_swaps_columns():
+    sql = migration_sql("3-small-512-int8", "ada-002")
+    assert "ADD COLUMN IF NOT EXISTS combined_strategic_summary_embedding_next bytea" in sql["expand"]
+    assert "combined_strategic_summary_embedding_scale_next real" in sql["expand"]
+    assert "DROP COLUMN IF EXISTS combined_strategic_summary_embedding;" in sql["swap"]
+    assert ("RENAME COLUMN combined_strategic_summary_embedding_scale_next TO "
+            "combined_strategic_summary_embedding_scale;") in sql["swap"]
+
+
+def test_failed_rows_are_not_written_and_block_the_swap(table, embeddings):
+    embeddings.down = True
+    pages = list(migrate_embeddings(table, "3-small-512-int8", "ada-002", page_size=5))
+    assert [(page["updated"], len(page["failed"])) for page in pages] == [(0, 5), (0, 5), (0, 2)]
+    assert len(unmigrated_rows(table, "3-small-512-int8", "ada-002")) == 12
+
+    embeddings.down = False
+    table.rows["u03"][table.fields[1]] = "BAD"
+    pages = list(migrate_embeddings(table, "3-small-512-int8", "ada-002", page_size=5))
+    assert sum(page["updated"] for page in pages) == 11
+    assert [uid for page in pages for uid, _ in page["failed"]] == ["u03"]
+    assert "combined_strategic_summary_embedding_next" not in table.rows["u03"]
+    assert unmigrated_rows(table, "3-small-512-int8", "ada-002") == ["u03"]
+
+
+def test_rerun_redoes_only_rows_changed_since(table, embeddings):
+    list(migrate_embeddings(table, "3-small-512", "ada-002", page_size=5))
+    table.rows["u07"][table.fields[0]] = "rewritten while the migration ran"
+    assert unmigrated_rows(table, "3-small-512", "ada-002") == ["u07"]
+
+    pages = list(migrate_embeddings(table, "3-small-512", "ada-002", page_size=5))
+    assert sum(page["skipped"] for page in pages) == 11
+    assert sum(page["updated"] for page in pages) == 1
+    assert unmigrated_rows(table, "3-small-512", "ada-002") == []
+
+
+def test_storage_change_reencodes_without_embedding(table, embeddings, rng):
+    source = get_embedding_profile("ada-002")
+    for row in table.rows.values():
+        vectors = {column: rng.standard_normal(source.size).astype(np.float32) for column in EMBEDDING_COLUMNS}
+        row.update({column: json.dumps(value) for column, value in source.encode_embeddings(vectors).items()})
+        row["vectors"] = vectors
+
+    pages = list(migrate_embeddings(table, "ada-002-int8", source))
+    assert sum(page["updated"] for page in pages) == 12
+    assert embeddings.calls == 0
+    target = get_embedding_profile("ada-002-int8")
+    row = table.rows["u00"]
+    column = EMBEDDING_COLUMNS[0]
+    restored = target.decode(row[f"{column}_next"], row[f"{column}_scale_next"])
+    assert np.abs(restored - row["vectors"][column]).max() <= np.abs(row["vectors"][column]).max() / INT8_MAX
+    assert unmigrated_rows(table, "ada-002-int8", source) == []
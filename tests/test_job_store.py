@@ -0,0 +1,143 @@
+import os
+import time
+
+import pytest
+
+from licensee_enrichment.batch_runner import make_outcome
+from licensee_enrichment.job_runner import JobRunner
+from licensee_enrichment.job_store import ACTIVE_STATUSES, JobStore, RowCheckpoints
+from licensee_enrichment.pipeline import LicenseePipeline
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def _wait(store, job_id, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get_job(job_id)
+        if job["status"] not in ACTIVE_STATUSES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+
+def _csv(uids):
+    lines = ["uid,brand_name,website"] + [f"{uid},Brand {uid},brand{uid}.com" for uid in uids]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def test_checkpoint_keeps_earlier_stages(store):
+    job_id = store.create_job("test.csv", 1, {})
+    store.save_checkpoint(job_id, 7, "enriched", raw_map={"business_category": "Toys"})
+    store.save_checkpoint(job_id, 7, "embedded", embeddings={"a_embedding": [0.5, -1.25], "b_embedding": [2.0, 0.0]})
+
+    saved = store.load_checkpoint(job_id, "7")
+    assert saved["stage"] == "embedded"
+    assert saved["raw_map"] == {"business_category": "Toys"}
+    assert saved["embeddings"] == {"a_embedding": [0.5, -1.25], "b_embedding": [2.0, 0.0]}
+    assert store.load_checkpoint(job_id, "8") is None
+    assert store.checkpoint_counts(job_id) == {"enriched": 0, "embedded": 1, "persisted": 0}
+
+
+def test_succeeded_rows_drop_their_intermediate_results(store):
+    job_id = store.create_job("test.csv", 2, {})
+    checkpoints = RowCheckpoints(store, job_id)
+    checkpoints.enriched("1", {"business_category": "Toys"})
+    checkpoints.enriched("2", {"business_category": "Games"})
+    store.add_results(job_id, [make_outcome("1", "One", "Success", True),
+                               make_outcome("2", "Two", "Failed - Database write: down", False)])
+
+    assert checkpoints.load("1") == {"stage": "persisted", "raw_map": None, "embeddings": None}
+    assert checkpoints.load("2")["raw_map"] == {"business_category": "Games"}
+    job = store.get_job(job_id)
+    assert (job["succeeded"], job["failed"], job["processed"]) == (1, 1, 2)
+
+
+def test_prepare_resume_keeps_done_rows_and_retries_failed_ones(store):
+    job_id = store.create_job("test.csv", 4, {})
+    store.add_results(job_id, [make_outcome("1", "One", "Success", True),
+                               make_outcome("2", "Two", "Skipped - unchanged", False),
+                               make_outcome("3", "Three", "Failed - Embeddings: down", False),
+                               make_outcome("4", "Four", "Paused at the budget ceiling of $1.00", False)])
+    assert store.prepare_resume(job_id) is None
+
+    store.set_status(job_id, "paused")
+    assert store.prepare_resume(job_id) == {"1", "2"}
+    job = store.get_job(job_id)
+    assert job["status"] == "queued"
+    assert (job["succeeded"], job["failed"], job["skipped"]) == (1, 0, 1)
+    assert [result["uid"] for result in store.results(job_id)] == ["1", "2"]
+
+
+def test_jobs_left_active_are_interrupted(store):
+    running = JobStore(store.path, owner="999999999:stopped").create_job("a.csv", 1, {})
+    store.set_status(running, "running")
+    finished = store.create_job("b.csv", 1, {})
+    store.set_status(finished, "completed")
+    assert store.mark_interrupted() == 1
+    assert store.get_job(running)["status"] == "interrupted"
+    assert store.get_job(finished)["status"] == "completed"
+
+
+def test_pipeline_reuses_checkpoints(services, store):
+    job_id = store.create_job("test.csv", 2, {})
+    checkpoints = RowCheckpoints(store, job_id)
+    rows = [{"uid": uid, "brand_name": f"Brand {uid}", "website": f"brand{uid}.com"} for uid in ("1", "2")]
+    first = list(LicenseePipeline(services.openai_client, services.supabase_client, checkpoint=checkpoints,
+                                  force_refresh=True).run(rows[:1]))
+    assert first[0]["status"] == "Success"
+    assert checkpoints.load("1")["stage"] == "embedded"
+
+    # Row 1 was enriched and embedded by the first run, so only row 2 calls the model again
+    chat_before = services.state.counts["chat"]
+    outcomes = list(LicenseePipeline(services.openai_client, services.supabase_client, checkpoint=checkpoints,
+                                     force_refresh=True).run(rows))
+    assert sorted(outcome["status"] for outcome in outcomes) == ["Success", "Success (cached enrichment)"]
+    assert services.state.counts["chat"] == chat_before + 1
+
+
+def test_resumed_job_runs_only_the_remaining_rows(services, store, tmp_path):
+    runner = JobRunner(store, max_jobs=1, upload_dir=str(tmp_path / "uploads"))
+    job_id = store.create_job("test.csv", 5, {"concurrency": 2})
+    with open(runner._upload_path(job_id), "wb") as f:
+        f.write(_csv(range(1, 6)))
+    # An earlier run finished two rows before the process stopped
+    store.add_results(job_id, [make_outcome("1", "Brand 1", "Success", True),
+                               make_outcome("2", "Brand 2", "Skipped - unchanged", False)])
+    store.set_status(job_id, "interrupted")
+
+    assert runner.resume(job_id, services.openai_client, services.supabase_client)
+    job = _wait(store, job_id)
+    assert job["status"] == "completed"
+    assert (job["succeeded"], job["skipped"], job["failed"]) == (4, 1, 0)
+    assert services.state.counts["chat"] == 3
+    assert sorted(services.state.licensees) == ["3", "4", "5"]
+    # A completed job has nothing left to resume
+    assert not runner.resume(job_id, services.openai_client, services.supabase_client)
+
+
+def test_only_jobs_of_stopped_processes_are_interrupted(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    mine = JobStore(path)
+    # The same pid as this process but another token: an earlier process, e.g. before a container restart
+    earlier = JobStore(path, owner=f"{os.getpid()}:earlier")
+    # The parent of this process, which is still running
+    other = JobStore(path, owner=f"{os.getppid()}:other")
+    jobs = {}
+    for name, store in (("mine", mine), ("earlier", earlier), ("other", other), ("unowned", None)):
+        jobs[name] = (store or mine).create_job(f"{name}.csv", 1, {})
+        mine.set_status(jobs[name], "running")
+    # Jobs from before owners were recorded
+    mine.conn.execute("UPDATE jobs SET owner = NULL WHERE id = ?", (jobs["unowned"],))
+    mine.conn.commit()
+
+    assert JobStore(path).mark_interrupted() == 2
+    statuses = {name: mine.get_job(job_id)["status"] for name, job_id in jobs.items()}
+    assert statuses == {"mine": "running", "earlier": "interrupted", "other": "running", "unowned": "interrupted"}
+
+    # A resumed job belongs to the process resuming it
+    assert mine.prepare_resume(jobs["earlier"]) == set()
+    assert mine.mark_interrupted() == 0
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from licensee_enrichment.enrichment import (ENRICHMENT_FIELDS, _complete_brands, enrich_brands,
+                                            packed_enrichment_request, parse_packed_output)
+from licensee_enrichment.enrichment_cache import EnrichmentCache
+
+
+def _brand(uid, **fields):
+    return {"uid": uid, **{name: f"{name} of {uid}" for name in ENRICHMENT_FIELDS}, **fields}
+
+
+def _brands(count):
+    return [(str(uid), f"brand{uid}.com", f"Brand {uid}") for uid in range(count)]
+
+
+def test_parse_packed_output_maps_uids_to_raw_maps():
+    content = json.dumps({"brands": [_brand("1"), _brand("2", age_group="  18-25 ")]})
+    raw_maps = parse_packed_output(content, [1, 2])
+    assert set(raw_maps) == {"1", "2"}
+    assert raw_maps["1"]["business_category"] == "business_category of 1"
+    assert raw_maps["2"]["age_group"] == "18-25"
+    assert "uid" not in raw_maps["1"]
+
+
+def test_parse_packed_output_ignores_unknown_repeated_and_empty_brands():
+    content = json.dumps({"brands": [
+        _brand("1"),
+        _brand("1", business_category="second answer"),
+        _brand("99"),
+        {"uid": "2", **{name: " " for name in ENRICHMENT_FIELDS}},
+        "not an object",
+    ]})
+    raw_maps = parse_packed_output(content, ["1", "2"])
+    assert list(raw_maps) == ["1"]
+    assert raw_maps["1"]["business_category"] == "business_category of 1"
+
+
+@pytest.mark.parametrize("content", ["", "not json", json.dumps({"brands": "none"}), json.dumps([1, 2])])
+def test_parse_packed_output_without_brands(content):
+    assert parse_packed_output(content, ["1"]) == {}
+
+
+def test_truncated_response_keeps_complete_brands():
+    full = json.dumps({"brands": [_brand("1"), _brand("2"), _brand("3")]}, indent=2)
+    # Cut off partway through the third brand, as at max_tokens
+    truncated = full[:full.index('"uid": "3"') + 40]
+    assert [brand["uid"] for brand in _complete_brands(truncated)] == ["1", "2"]
+    assert set(parse_packed_output(truncated, ["1", "2", "3"])) == {"1", "2"}
+
+
+def test_complete_brands_without_array():
+    assert _complete_brands('{"other": [') == []
+
+
+def test_packed_request_timeout_grows_with_the_pack():
+    brands = _brands(10)
+    request = packed_enrichment_request(brands)
+    assert request["timeout"] == 150
+    assert request["max_tokens"] == 10 * packed_enrichment_request(brands[:1])["max_tokens"]
+    assert packed_enrichment_request(brands[:2])["timeout"] == 60
+
+
+def test_enrich_brands_sends_one_packed_request_then_uses_the_cache(services, tmp_path):
+    cache = EnrichmentCache(str(tmp_path / "cache.sqlite3"))
+    results = enrich_brands(_brands(4), client=services.openai_client, cache=cache)
+    assert services.state.counts["chat"] == 1
+    assert all(error is None and not cached and raw_map["product_summary_text"]
+               for raw_map, cached, error in results)
+
+    again = enrich_brands(_brands(4), client=services.openai_client, cache=cache)
+    assert services.state.counts["chat"] == 1
+    assert [raw_map for raw_map, _, _ in again] == [raw_map for raw_map, _, _ in results]
+    assert all(cached for _, cached, _ in again)
+
+
+def test_failed_pack_falls_back_to_single_requests(start_services, tmp_path):
+    services = start_services(error_rate=1.0)
+    results = enrich_brands(_brands(3), client=services.openai_client,
+                            cache=EnrichmentCache(str(tmp_path / "cache.sqlite3")))
+    # The packed request, then one request per brand; each brand fails on its own
+    assert services.state.counts["chat"] == 4
+    assert all(raw_map is None and error is not None for raw_map, _, error in results)
@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+
+import mock_services
+from licensee_enrichment.enrichment import EMPTY_ENRICHMENT_ERROR
+from licensee_enrichment.pipeline import _STOP, LicenseePipeline, Stage, row_item
+
+
+def _rows(count):
+    return [{"uid": str(uid), "brand_name": f"Brand {uid}", "website": f"brand{uid}.com"} for uid in range(count)]
+
+
+def _statuses(outcomes):
+    return {outcome["uid"]: outcome["status"] for outcome in outcomes}
+
+
+def _run_stages(stages, rows):
+    """
+    Feed rows through stages and return the items they put out
+    """
+    output = []
+    done = threading.Event()
+    for stage, downstream in zip(stages, stages[1:] + [None]):
+        finish = done.set if downstream is None else (lambda downstream=downstream: downstream.inbox.put(_STOP))
+        stage.start(downstream, finish, output.append)
+    for row in rows:
+        stages[0].inbox.put(row_item(row))
+    stages[0].inbox.put(_STOP)
+    assert done.wait(5)
+    return output
+
+
+def test_a_failing_batch_fails_only_its_items():
+    def first(items):
+        if any(item["uid"] == "2" for item in items):
+            raise RuntimeError("batch down")
+        for item in items:
+            item["first"] = True
+
+    reached = []
+    stages = [Stage("first", first, batch_size=2, max_wait=1.0),
+              Stage("second", lambda items: reached.extend(item["uid"] for item in items))]
+    output = _run_stages(stages, _rows(4))
+
+    assert sorted(item["uid"] for item in output) == ["0", "1", "2", "3"]
+    failed = {item["uid"]: item["error"] for item in output if item["error"]}
+    # Items are batched in order, so 2 and 3 went together and never reached the second stage
+    assert failed == {"2": "batch down", "3": "batch down"}
+    assert sorted(reached) == ["0", "1"]
+    assert stages[0].metrics.failed == 2
+
+
+def test_an_item_error_is_kept_over_the_batch_error():
+    def first(items):
+        items[0]["error"] = "own error"
+        raise RuntimeError("batch down")
+
+    output = _run_stages([Stage("first", first)], _rows(1))
+    assert output[0]["error"] == "own error"
+
+
+def test_pipeline_writes_every_row(services):
+    outcomes = list(LicenseePipeline(services.openai_client, services.supabase_client).run(_rows(5)))
+    assert set(_statuses(outcomes).values()) == {"Success"}
+    assert sorted(services.state.licensees) == ["0", "1", "2", "3", "4"]
+
+
+def test_enrichment_errors_fail_rows_before_anything_is_written(start_services):
+    services = start_services(error_rate=1.0)
+    rows = _rows(3) + [{"uid": "9", "brand_name": "No website", "website": ""}]
+    outcomes = list(LicenseePipeline(services.openai_client, services.supabase_client).run(rows))
+    statuses = _statuses(outcomes)
+    assert statuses.pop("9") == "Failed - Missing required fields"
+    assert all(status.startswith("Failed - ") for status in statuses.values())
+    assert services.state.counts["embeddings"] == 0
+    assert services.state.licensees == {}
+
+
+def test_failed_embeddings_fail_rows_instead_of_writing_them(services):
+    def embeddings_down(texts):
+        raise RuntimeError("embed down")
+
+    pipeline = LicenseePipeline(services.openai_client, services.supabase_client)
+    pipeline.profile_embed_fn = embeddings_down
+    outcomes = list(pipeline.run(_rows(3)))
+    assert set(_statuses(outcomes).values()) == {"Failed - Embeddings: embed down"}
+    assert services.state.licensees == {}
+
+
+def test_database_errors_are_reported_per_row(start_services):
+    services = start_services(db_error_rate=1.0)
+    outcomes = list(LicenseePipeline(services.openai_client, services.supabase_client).run(_rows(2)))
+    assert all(status.startswith("Failed - Database write") for status in _statuses(outcomes).values())
+
+
+def test_empty_enrichment_is_failed_and_retried(services, monkeypatch):
+    answer = mock_services.brand_answer
+    monkeypatch.setattr(mock_services, "brand_answer", lambda fields, brand, seed:
+                        {field: "N/A" for field in fields} if brand == "Brand 1" else answer(fields, brand, seed))
+
+    for _ in range(2):
+        outcomes = list(LicenseePipeline(services.openai_client, services.supabase_client).run(_rows(3),
+                                                                                               incremental=True))
+        assert _statuses(outcomes)["1"] == f"Failed - {EMPTY_ENRICHMENT_ERROR}"
+    # The row never gets an input_hash, so the second incremental run asked for it again
+    assert "1" not in services.state.licensees
+    assert _statuses(outcomes)["0"] == "Skipped - unchanged"
+
+
+def test_budget_ceiling_pauses_the_run(services):
+    pipeline = LicenseePipeline(services.openai_client, services.supabase_client, budget=0.000001)
+    outcomes = list(pipeline.run(_rows(3)))
+    assert pipeline.paused
+    assert all(status.startswith("Paused at the budget ceiling") for status in _statuses(outcomes).values())
+    assert services.state.counts["chat"] == 0
+
+
+def test_input_errors_are_raised_after_queued_rows_finish(services):
+    def rows():
+        yield from _rows(2)
+        raise ValueError("bad CSV")
+
+    outcomes = []
+    with pytest.raises(ValueError, match="bad CSV"):
+        for outcome in LicenseePipeline(services.openai_client, services.supabase_client).run(rows()):
+            outcomes.append(outcome)
+    assert set(_statuses(outcomes).values()) == {"Success"}
@@ -0,0 +1,85 @@
+import time
+
+import openai
+import pytest
+
+from licensee_enrichment.rate_limiter import RateLimiter, parse_reset_duration
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("20ms", 0.02),
+    ("1s", 1.0),
+    ("6m0s", 360.0),
+    ("1h2m3.5s", 3723.5),
+    ("1.5", 1.5),
+])
+def test_parse_reset_duration(value, seconds):
+    assert parse_reset_duration(value) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize("value", ["", None, "soon"])
+def test_parse_reset_duration_unparseable(value):
+    assert parse_reset_duration(value) is None
+
+
+def test_headers_resize_buckets_without_raising_local_count():
+    limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=1000)
+    limiter.tokens.tokens = 10
+    limiter.update_from_headers({
+        "x-ratelimit-limit-requests": "5000",
+        "x-ratelimit-remaining-requests": "40",
+        "x-ratelimit-limit-tokens": "80000",
+        "x-ratelimit-remaining-tokens": "79000",
+    })
+    assert limiter.requests.capacity == 5000
+    assert limiter.requests.tokens == 40
+    assert limiter.tokens.capacity == 80000
+    # Requests still in flight are only counted locally, so the server's higher figure is ignored
+    assert limiter.tokens.tokens < 11
+
+
+def test_exhausted_budget_blocks_until_reset():
+    limiter = RateLimiter()
+    before = time.monotonic()
+    limiter.update_from_headers({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "2s",
+                                 "x-ratelimit-limit-tokens": "not a number"})
+    assert limiter.blocked_until >= before + 2
+    assert limiter.tokens.capacity > 0
+
+
+def test_backoff_honors_retry_after_then_jitters():
+    limiter = RateLimiter(base_delay=1.0, max_delay=8.0)
+    assert limiter.backoff(0, {"retry-after-ms": "250"}) == pytest.approx(0.25)
+    assert limiter.backoff(0, {"retry-after": "3"}) == pytest.approx(3.0)
+    delays = [limiter.backoff(10, {"retry-after": "later"}) for _ in range(50)]
+    assert all(0 <= delay <= 8.0 for delay in delays)
+
+
+def _chat(limiter, client):
+    return limiter.call(client.chat.completions.with_raw_response.create, estimated_tokens=10,
+                        model="gpt-4o", messages=[{"role": "user", "content": "Brand name: Acme"}])
+
+
+def test_call_retries_429_and_sizes_from_headers(start_services):
+    # The first draw is under the rate, the second over it: one 429, then an answer
+    services = start_services(rate_limit_rate=0.5, seed=1)
+    limiter = RateLimiter(requests_per_minute=100)
+    response = _chat(limiter, services.openai_client)
+    assert response.choices[0].message.content
+    assert services.state.counts["rate_limited"] == 1
+    assert services.state.counts["chat"] == 2
+    assert limiter.requests.capacity == 30000
+
+
+def test_call_gives_up_after_max_retries(start_services):
+    services = start_services(rate_limit_rate=1.0)
+    with pytest.raises(openai.RateLimitError):
+        _chat(RateLimiter(max_retries=2), services.openai_client)
+    assert services.state.counts["chat"] == 3
+
+
+def test_call_does_not_retry_server_errors(start_services):
+    services = start_services(error_rate=1.0)
+    with pytest.raises(openai.InternalServerError):
+        _chat(RateLimiter(), services.openai_client)
+    assert services.state.counts["chat"] == 1
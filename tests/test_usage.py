@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from licensee_enrichment.openai_batch import BatchEnrichment
+from licensee_enrichment.usage import (BudgetExceeded, CostBudget, USAGE_FIELDS, estimate_cost, metering,
+                                       record_usage, reserving, response_usage, split_usage)
+
+
+def _usage(**fields):
+    return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "embedding_tokens": 0, "cost": 0.0,
+            **fields}
+
+
+def test_response_usage_bills_cached_prompt_tokens_at_cached_price():
+    usage = response_usage("gpt-4o", {"prompt_tokens": 1000, "completion_tokens": 100,
+                                      "prompt_tokens_details": {"cached_tokens": 400}})
+    assert usage["prompt_tokens"] == 1000
+    assert usage["cached_tokens"] == 400
+    assert usage["cost"] == pytest.approx((600 * 2.50 + 400 * 1.25 + 100 * 10.00) / 1_000_000)
+
+
+def test_embedding_usage_counts_as_embedding_tokens():
+    usage = response_usage("text-embedding-3-small", {"prompt_tokens": 500}, embedding=True)
+    assert usage == _usage(embedding_tokens=500, cost=pytest.approx(500 * 0.02 / 1_000_000))
+
+
+def test_batch_requests_cost_half():
+    assert estimate_cost("gpt-4o", 1000, 100, batch=True) == pytest.approx(estimate_cost("gpt-4o", 1000, 100) / 2)
+
+
+def test_split_usage_keeps_whole_tokens_and_totals():
+    usage = _usage(prompt_tokens=1001, cached_tokens=7, completion_tokens=10, embedding_tokens=3, cost=0.01)
+    shares = split_usage(usage, [1, 2, 3])
+    for name in USAGE_FIELDS:
+        assert sum(share[name] for share in shares) == pytest.approx(usage[name])
+        if name != "cost":
+            assert all(isinstance(share[name], int) for share in shares)
+    assert shares[2]["prompt_tokens"] == pytest.approx(3 * shares[0]["prompt_tokens"], abs=1)
+    assert shares[1]["cost"] == pytest.approx(0.01 * 2 / 6)
+
+
+def test_split_usage_with_zero_weights_splits_evenly():
+    shares = split_usage(_usage(prompt_tokens=10, cost=1.0), [0, 0])
+    assert [share["prompt_tokens"] for share in shares] == [5, 5]
+    assert [share["cost"] for share in shares] == [0.5, 0.5]
+
+
+def test_metering_nests_and_charges_the_budget():
+    budget = CostBudget(1.0)
+    with metering(budget) as outer:
+        record_usage("gpt-4o", {"prompt_tokens": 100, "completion_tokens": 10})
+        with metering() as inner:
+            record_usage("gpt-4o", {"prompt_tokens": 200})
+    assert inner["prompt_tokens"] == 200
+    assert outer["prompt_tokens"] == 300
+    assert budget.spent == pytest.approx(outer["cost"])
+
+
+def test_reserve_and_release():
+    budget = CostBudget(1.0)
+    budget.reserve(0.6)
+    assert budget.reserved == pytest.approx(0.6) and budget.in_flight == 1
+    budget.release(0.6)
+    budget.charge(0.5)
+    assert budget.reserved == pytest.approx(0) and budget.in_flight == 0
+
+    with pytest.raises(BudgetExceeded):
+        budget.reserve(0.6)
+    # Once exceeded the run stays paused, even for requests that would fit
+    with pytest.raises(BudgetExceeded):
+        budget.reserve(0.01)
+
+
+def test_reserve_waits_for_requests_in_flight():
+    budget = CostBudget(1.0)
+    budget.reserve(0.8)
+    reserved = threading.Event()
+
+    def second():
+        budget.reserve(0.5)
+        reserved.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    time.sleep(0.05)
+    assert not reserved.is_set()
+    # The first request settles for less than it reserved, which makes room
+    budget.charge(0.3)
+    budget.release(0.8)
+    thread.join(timeout=1)
+    assert reserved.is_set()
+    assert budget.reserved == pytest.approx(0.5)
+
+
+def test_try_reserve_does_not_wait():
+    budget = CostBudget(1.0)
+    assert budget.try_reserve(0.7)
+    assert not budget.try_reserve(0.4)
+    assert budget.exceeded
+
+
+def test_reserving_holds_worst_case_only_while_sending():
+    budget = CostBudget(1.0)
+    with metering(budget):
+        with reserving("gpt-4o", 1000, 500):
+            assert budget.reserved == pytest.approx(estimate_cost("gpt-4o", 1000, 500))
+        assert budget.reserved == pytest.approx(0)
+        with pytest.raises(BudgetExceeded):
+            with reserving("gpt-4o", 1_000_000, 100_000):
+                pass
+
+
+def test_batch_rows_left_unanswered_release_their_reservation(start_services, tmp_path):
+    services = start_services(batch_delay=0, batch_drop_rate=1.0)
+    runner = BatchEnrichment(services.openai_client, services.supabase_client, poll_interval=0.05,
+                             work_dir=str(tmp_path / "batches"), budget=1.0)
+    rows = [{"uid": str(uid), "brand_name": f"Brand {uid}", "website": f"brand{uid}.com"} for uid in range(3)]
+    outcomes = list(runner.run(rows))
+    assert {outcome["status"] for outcome in outcomes} == {"Failed - Enrichment: no result from the batch"}
+    # Nothing was spent, so nothing may stay held against the ceiling
+    assert runner.budget.reserved == pytest.approx(0)
+    assert runner.budget.in_flight == 0
+    assert runner.budget.spent == 0